@@ -0,0 +1,87 @@
+'''
+Benchmark of upstream task resolution (requires()) for a merge task, whose
+in-port is connected to a large number of TargetInfos from a fixed number of
+upstream tasks.
+
+Run from within the benchmarks folder: python bench_fanin.py
+'''
+
+import logging
+import time
+import luigi
+import sciluigi as sl
+from luigi.six import iteritems
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+UPSTREAM_TASKS = 50
+FANIN_SIZES = [1000, 5000, 10000, 50000, 100000]
+REPEATS = 5
+
+# ------------------------------------------------------------------------------
+
+class ShardWriter(sl.Task):
+    shard_id = luigi.IntParameter()
+    shards = luigi.IntParameter()
+
+    def out_shards(self):
+        return [sl.TargetInfo(self, '/tmp/bench_fanin_%d_%d.txt' % (self.shard_id, i))
+                for i in range(self.shards)]
+
+class ShardMerger(sl.Task):
+    in_shards = None
+
+    def out_merged(self):
+        return sl.TargetInfo(self, '/tmp/bench_fanin_merged.txt')
+
+# ------------------------------------------------------------------------------
+
+def recursive_upstream_tasks(val, tasks):
+    '''
+    The recursive, non-deduplicating resolution sciluigi used before, kept
+    here for comparison.
+    '''
+    if callable(val):
+        val = val()
+    if isinstance(val, sl.TargetInfo):
+        tasks.append(val.task)
+    elif isinstance(val, list):
+        for valitem in val:
+            tasks = recursive_upstream_tasks(valitem, tasks)
+    elif isinstance(val, dict):
+        for _, valitem in iteritems(val):
+            tasks = recursive_upstream_tasks(valitem, tasks)
+    return tasks
+
+def best_of(func, repeats=REPEATS):
+    '''
+    Return the result of func, and the best wall clock time out of a number of runs.
+    '''
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        result = func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return result, best
+
+def main():
+    wf = sl.WorkflowTask(instance_name='bench_fanin_wf')
+    print('%10s %14s %14s %10s %10s' % (
+        'fan-in', 'recursive (s)', 'iterative (s)', 'tasks old', 'tasks new'))
+    for size in FANIN_SIZES:
+        writers = [wf.new_task('writer_%d' % i, ShardWriter,
+                               shard_id=i, shards=size // UPSTREAM_TASKS)
+                   for i in range(UPSTREAM_TASKS)]
+        merger = wf.new_task('merger_%d' % size, ShardMerger)
+        merger.in_shards = [tinfo for writer in writers for tinfo in writer.out_shards()]
+
+        old_tasks, old_time = best_of(lambda: recursive_upstream_tasks(merger.in_shards, []))
+        new_tasks, new_time = best_of(merger.requires)
+        print('%10d %14.4f %14.4f %10d %10d' % (
+            size, old_time, new_time, len(old_tasks), len(new_tasks)))
+
+if __name__ == '__main__':
+    main()
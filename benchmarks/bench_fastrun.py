@@ -0,0 +1,100 @@
+'''
+Benchmark of running synthetic workflows of many small tasks with luigi's
+worker and local scheduler (as with run_local()), and with the in-process
+engine of run_fast(), for a wide graph (many independent tasks merged by one
+task) and a deep graph (a chain of tasks).
+
+Run from within the benchmarks folder: python bench_fastrun.py
+'''
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import luigi
+import sciluigi as sl
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+logging.getLogger('luigi-interface').setLevel(logging.WARNING)
+
+WIDE_SIZES = [100, 500, 2000]
+DEEP_SIZES = [50, 200, 500]
+WORKERS = 4
+
+# ------------------------------------------------------------------------------
+
+class BenchWrite(sl.Task):
+    path = luigi.Parameter()
+    in_upstream = None
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        with self.out_data().open('w') as outfile:
+            outfile.write('data\n')
+
+class WideWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+    size = luigi.IntParameter()
+
+    def workflow(self):
+        tasks = [self.new_task('wide_%d' % i, BenchWrite,
+                               path=os.path.join(self.tmpdir, 'wide_%d.txt' % i))
+                 for i in range(self.size)]
+        sink = self.new_task('wide_sink', BenchWrite, path=os.path.join(self.tmpdir, 'sink.txt'))
+        sink.in_upstream = [task.out_data for task in tasks]
+        return sink
+
+class DeepWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+    size = luigi.IntParameter()
+
+    def workflow(self):
+        prev = None
+        for i in range(self.size):
+            task = self.new_task('deep_%d' % i, BenchWrite,
+                                 path=os.path.join(self.tmpdir, 'deep_%d.txt' % i))
+            if prev is not None:
+                task.in_upstream = prev.out_data
+            prev = task
+        return prev
+
+# ------------------------------------------------------------------------------
+
+def run_luigi(wf):
+    luigi.build([wf], local_scheduler=True, workers=WORKERS)
+
+def run_fast(wf):
+    sl.run_fast(wf, workers=WORKERS)
+
+def timed_run(runner, wfclass, size):
+    '''
+    Return the wall clock time of running a fresh workflow, in a fresh folder.
+    '''
+    tmpdir = tempfile.mkdtemp(prefix='bench_fastrun_')
+    try:
+        wf = wfclass(instance_name='bench_%s_%s' % (runner.__name__, os.path.basename(tmpdir)),
+                     tmpdir=tmpdir, size=size)
+        start = time.time()
+        runner(wf)
+        duration = time.time() - start
+        if not wf.complete():
+            raise Exception('Workflow %s did not complete' % wf.instance_name)
+        return duration
+    finally:
+        shutil.rmtree(tmpdir)
+
+def main():
+    print('%6s %8s %12s %12s %10s' % ('graph', 'tasks', 'luigi (s)', 'fast (s)', 'speedup'))
+    for wfclass, sizes in [(WideWf, WIDE_SIZES), (DeepWf, DEEP_SIZES)]:
+        for size in sizes:
+            luigi_time = timed_run(run_luigi, wfclass, size)
+            fast_time = timed_run(run_fast, wfclass, size)
+            print('%6s %8d %12.3f %12.3f %9.1fx' % (
+                wfclass.__name__[:-2].lower(), size, luigi_time, fast_time, luigi_time / fast_time))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+Benchmark of memory use and construction time of TargetInfo objects, comparing
+the current lazy, __slots__ based TargetInfo with the eager one sciluigi used
+before, which created a luigi.LocalTarget in its constructor.
+
+Run from within the benchmarks folder: python bench_targetinfo.py [count]
+'''
+
+import gc
+import logging
+import sys
+import time
+import tracemalloc
+import luigi
+import sciluigi as sl
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+DEFAULT_COUNT = 1000000
+
+# ------------------------------------------------------------------------------
+
+class EagerTargetInfo(object):
+    '''
+    The TargetInfo class as it looked before, kept here for comparison.
+    '''
+    task = None
+    path = None
+    target = None
+
+    def __init__(self, task, path, format=None, is_tmp=False):
+        self.task = task
+        self.path = path
+        self.target = luigi.LocalTarget(path, format, is_tmp)
+
+# ------------------------------------------------------------------------------
+
+def measure(cls, count):
+    '''
+    Create count TargetInfos of class cls, and return the time taken and the
+    peak memory allocated while doing so.
+    '''
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    tinfos = [cls(None, '/tmp/sample_%d.bam' % i) for i in range(count)]
+    duration = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tinfos
+    return duration, peak
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+    print('Creating %d TargetInfos' % count)
+    print('%-18s %10s %12s %14s' % ('class', 'time (s)', 'peak (MiB)', 'bytes/object'))
+    for name, cls in [('eager (before)', EagerTargetInfo), ('lazy (after)', sl.TargetInfo)]:
+        duration, peak = measure(cls, count)
+        print('%-18s %10.2f %12.1f %14.0f' % (name, duration, peak / 2.0**20, float(peak) / count))
+
+if __name__ == '__main__':
+    main()
@@ -8,22 +8,43 @@ flexible and modular.
 from sciluigi import audit
 from sciluigi.audit import AuditTrailHelpers
 
+from sciluigi import auditdb
+from sciluigi.auditdb import AuditDB
+
 from sciluigi import dependencies
 from sciluigi.dependencies import TargetInfo
 from sciluigi.dependencies import S3TargetInfo
 from sciluigi.dependencies import DependencyHelpers
 
+from sciluigi import fscache
+from sciluigi.fscache import DirListingCache
+
 from sciluigi import interface
 from sciluigi.interface import run
 from sciluigi.interface import run_local
+from sciluigi.interface import run_fast
 from sciluigi.interface import LOGFMT_STREAM
 from sciluigi.interface import LOGFMT_LUIGI
 from sciluigi.interface import LOGFMT_SCILUIGI
 from sciluigi.interface import DATEFMT
 
+from sciluigi import plan
+from sciluigi.plan import WorkflowPlan
+
+from sciluigi import fastrun
+from sciluigi.fastrun import FastRunner
+
+from sciluigi import critpath
+from sciluigi.critpath import CriticalPathAnalysis
+
+from sciluigi import trace
+
 from sciluigi import parameter
 from sciluigi.parameter import Parameter
 
+from sciluigi import slots
+from sciluigi.slots import NodeSlotScheduler
+
 from sciluigi import slurm
 from sciluigi.slurm import SlurmInfo
 from sciluigi.slurm import SlurmTask
@@ -31,6 +52,16 @@ from sciluigi.slurm import SlurmHelpers
 from sciluigi.slurm import RUNMODE_LOCAL
 from sciluigi.slurm import RUNMODE_HPC
 from sciluigi.slurm import RUNMODE_MPI
+from sciluigi.slurm import RUNMODE_HPC_ARRAY
+from sciluigi.slurm import RUNMODE_HPC_SBATCH
+from sciluigi.slurm import RUNMODE_HPC_POOL
+
+from sciluigi import slurmarray
+from sciluigi import slurmacct
+from sciluigi import slurmestimate
+from sciluigi.slurmestimate import SlurmResourceEstimator
+from sciluigi import slurmpoll
+from sciluigi import slurmpool
 
 from sciluigi import task
 from sciluigi.task import new_task
@@ -38,6 +69,10 @@ from sciluigi.task import Task
 from sciluigi.task import ExternalTask
 from sciluigi.workflow import WorkflowTask
 
+from sciluigi import executor
+from sciluigi.executor import Executor
+from sciluigi.executor import register_executor
+
 from sciluigi import util
 from sciluigi.util import timestamp
 from sciluigi.util import timepath
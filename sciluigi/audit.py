@@ -2,12 +2,18 @@
 This module contains functionality for the audit-trail logging functionality
 '''
 
+import json
 import logging
 import luigi
 import os
-import random
 import time
-from luigi.six import iteritems
+import sciluigi.util
+from luigi.six import iteritems, string_types
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # ==============================================================================
 
@@ -15,10 +21,84 @@ log = logging.getLogger('sciluigi-interface')
 
 # ==============================================================================
 
+class JsonLinesAuditBackend(object):
+    '''
+    Audit backend writing one JSON record per line to a single, append-only
+    file per workflow.
+
+    Each record is written with one single write to a file opened in append
+    mode (under an exclusive lock, where supported), so that records from
+    concurrently running tasks, also in different processes, never interleave.
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, record):
+        '''
+        Append one record to the audit file.
+        '''
+        dirpath = os.path.dirname(self.path)
+        if dirpath:
+            sciluigi.util.ensuredir(dirpath)
+        data = (json.dumps(record) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+
+    def read(self):
+        '''
+        Return all records in the audit file, in the order they were written.
+        '''
+        return read_auditrecords(self.path)
+
+# ==============================================================================
+
+def read_auditrecords(path):
+    '''
+    Read the records of a JSON lines audit file, skipping any lines that
+    can not be parsed (such as one cut short by a crash).
+    '''
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as auditfile:
+        for line in auditfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                log.warning('Skipping unparseable line in audit file %s: %s', path, line)
+    return records
+
+def _auditvalue(infoval):
+    '''
+    Keep values that can be stored as they are in JSON, and convert others to strings.
+    '''
+    if infoval is None or isinstance(infoval, (bool, int, float, list, dict) + string_types):
+        return infoval
+    return str(infoval)
+
+# ==============================================================================
+
 class AuditTrailHelpers(object):
     '''
     Mixin for luigi.Task:s, with functionality for writing audit logs of running tasks
+
+    Audit info is collected in memory while the task runs, and written to the
+    workflow's audit backend(s) in one go when the task finishes.
     '''
+    _auditinfo = None
+    # Time the task started running, for the execution trace
+    _trace_start = None
+
     def add_auditinfo(self, infotype, infoval):
         '''
         Alias to _add_auditinfo(), that can be overridden.
@@ -27,20 +107,63 @@ class AuditTrailHelpers(object):
 
     def _add_auditinfo(self, instance_name, infotype, infoval):
         '''
-        Save audit information in a designated file, specific for this task.
+        Collect audit information for this task, until flush_auditinfo() is called.
+        '''
+        if self._auditinfo is None:
+            self._auditinfo = {}
+        self._auditinfo.setdefault(instance_name, []).append((infotype, _auditvalue(infoval)))
+
+    def flush_auditinfo(self):
+        '''
+        Write the collected audit information to the workflow's audit backend(s),
+        as one record per instance name. Records hold all entries in the order
+        they were added, and a dict with the last value of each info type, for
+        looking values up.
         '''
-        dirpath = self.workflow_task.get_auditdirpath()
-        if not os.path.isdir(dirpath):
-            time.sleep(random.random())
-            if not os.path.isdir(dirpath):
-                os.makedirs(dirpath)
+        auditinfo = self._auditinfo
+        self._auditinfo = None
+        if not auditinfo:
+            return
+        params = dict((paramname, _auditvalue(paramval))
+                      for paramname, paramval in iteritems(self.param_kwargs)
+                      if paramname not in ['workflow_task'])
+        for instance_name, entries in iteritems(auditinfo):
+            record = {
+                'instance_name': instance_name,
+                'task_family': self.task_family,
+                'task_id': self.task_id,
+                'time': time.time(),
+                'params': params,
+                'info': dict(entries),
+                'entries': [list(entry) for entry in entries],
+            }
+            self.get_audit_workflow().write_auditrecord(record)
 
-        auditfile = os.path.join(dirpath, instance_name)
-        if not os.path.exists(auditfile):
-            with open(auditfile, 'w') as afile:
-                afile.write('[%s]\n' % self.instance_name)
-        with open(auditfile, 'a') as afile:
-            afile.write('%s: %s\n' % (infotype, infoval))
+    def get_audit_workflow(self):
+        '''
+        Return the workflow task whose audit log this task writes to.
+        '''
+        return self.workflow_task
+
+    def collect_final_auditinfo(self):
+        '''
+        Hook for adding audit info right before it is written out, when the
+        task has finished or failed. Does nothing by default.
+        '''
+        pass
+
+    def add_trace_auditinfo(self, failed=False):
+        '''
+        Add when the task started and finished, and the worker process it ran
+        in, to the audit info, for building an execution trace (see sciluigi.trace).
+        '''
+        if self._trace_start is None:
+            return
+        self.add_auditinfo('trace_start', self._trace_start)
+        self.add_auditinfo('trace_end', time.time())
+        self.add_auditinfo('trace_worker', os.getpid())
+        if failed:
+            self.add_auditinfo('trace_failed', True)
 
     def get_instance_name(self):
         '''
@@ -59,6 +182,7 @@ class AuditTrailHelpers(object):
         Log start of execution of task.
         '''
         if hasattr(self, 'workflow_task') and self.workflow_task is not None:
+            self._trace_start = time.time()
             msg = 'Task {task} started'.format(
                 task=self.get_instance_name())
             log.info(msg)
@@ -73,7 +197,20 @@ class AuditTrailHelpers(object):
                 task=self.get_instance_name(),
                 proctime=task_exectime_sec)
             log.info(msg)
+            self.collect_final_auditinfo()
+            self.add_trace_auditinfo()
             self.add_auditinfo('task_exectime_sec', '%.3f' % task_exectime_sec)
             for paramname, paramval in iteritems(self.param_kwargs):
                 if paramname not in ['workflow_task']:
                     self.add_auditinfo(paramname, paramval)
+            self.flush_auditinfo()
+
+    @luigi.Task.event_handler(luigi.Event.FAILURE)
+    def save_failure(self, exception):
+        '''
+        Write out any audit info collected before the task failed.
+        '''
+        if hasattr(self, 'workflow_task') and self.workflow_task is not None:
+            self.collect_final_auditinfo()
+            self.add_trace_auditinfo(failed=True)
+            self.flush_auditinfo()
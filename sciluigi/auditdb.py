@@ -0,0 +1,240 @@
+'''
+This module contains an SQLite-backed store for audit information, that can
+be queried across workflow runs, e.g. for the slowest tasks, or runtime
+statistics per task class.
+
+It can also be used from the commandline:
+
+    python -m sciluigi.auditdb <dbpath> slowest|percentiles|trend|runs [options]
+'''
+
+import argparse
+import json
+import os
+import sqlite3
+import sciluigi.util
+
+# ==============================================================================
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    workflow TEXT NOT NULL,
+    started TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id TEXT NOT NULL,
+    workflow TEXT NOT NULL,
+    instance_name TEXT NOT NULL,
+    task_family TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    params TEXT,
+    info TEXT,
+    task_exectime_sec REAL,
+    slurm_exectime_sec REAL,
+    slurm_jobid TEXT,
+    recorded REAL,
+    PRIMARY KEY (run_id, task_id)
+);
+CREATE INDEX IF NOT EXISTS tasks_by_workflow ON tasks (workflow, run_id);
+CREATE INDEX IF NOT EXISTS tasks_by_instance ON tasks (run_id, instance_name);
+CREATE INDEX IF NOT EXISTS tasks_by_family ON tasks (task_family);
+'''
+
+# Seconds to wait for other processes writing to the database
+BUSY_TIMEOUT = 60.0
+
+# ==============================================================================
+
+def connect(dbpath):
+    '''
+    Open a connection to the audit database, creating it if needed.
+    '''
+    dirpath = os.path.dirname(dbpath)
+    if dirpath:
+        sciluigi.util.ensuredir(dirpath)
+    conn = sqlite3.connect(dbpath, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+# ==============================================================================
+
+class SqliteAuditBackend(object):
+    '''
+    Audit backend recording task audit records in an SQLite database, with
+    one row per task and workflow run.
+    '''
+    def __init__(self, dbpath, workflow, run_id, started):
+        self.dbpath = dbpath
+        self.workflow = workflow
+        self.run_id = run_id
+        self.started = started
+
+    def write(self, record):
+        '''
+        Insert an audit record, merging it with any earlier record of the same
+        task in the same run.
+        '''
+        conn = connect(self.dbpath)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR IGNORE INTO runs (run_id, workflow, started) VALUES (?, ?, ?)',
+                         (self.run_id, self.workflow, self.started))
+            row = conn.execute('SELECT info FROM tasks WHERE run_id = ? AND task_id = ?',
+                               (self.run_id, record['task_id'])).fetchone()
+            info = json.loads(row['info']) if row is not None else {}
+            info.update(record['info'])
+            conn.execute(
+                'INSERT OR REPLACE INTO tasks (run_id, workflow, instance_name, task_family, '
+                'task_id, params, info, task_exectime_sec, slurm_exectime_sec, slurm_jobid, '
+                'recorded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.run_id, self.workflow, record['instance_name'], record['task_family'],
+                 record['task_id'], json.dumps(record.get('params', {})), json.dumps(info),
+                 sciluigi.util.float_or_none(info.get('task_exectime_sec')),
+                 sciluigi.util.float_or_none(info.get('slurm_exectime_sec')),
+                 info.get('slurm_jobid'), record['time']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+# ==============================================================================
+
+class AuditDB(object):
+    '''
+    Query API for audit databases written by SqliteAuditBackend.
+    '''
+    def __init__(self, dbpath):
+        self.conn = connect(dbpath)
+
+    def close(self):
+        '''
+        Close the database connection
+        '''
+        self.conn.close()
+
+    def _select(self, sql, filters, suffix='', args=()):
+        '''
+        Run a query, with a WHERE clause built from the filters whose value is not None.
+        '''
+        where = [(col, val) for col, val in filters if val is not None]
+        if where:
+            sql += ' WHERE ' + ' AND '.join('%s = ?' % col for col, _ in where)
+        rows = self.conn.execute(sql + suffix, tuple(val for _, val in where) + tuple(args))
+        return [dict(row) for row in rows]
+
+    def runs(self, workflow=None):
+        '''
+        Return all recorded workflow runs, oldest first.
+        '''
+        return self._select('SELECT run_id, workflow, started FROM runs',
+                            [('workflow', workflow)], ' ORDER BY started')
+
+    def records(self, workflow=None, run_id=None, task_family=None):
+        '''
+        Return the recorded task rows, with params and info decoded into dicts.
+        '''
+        rows = self._select(
+            'SELECT tasks.*, runs.started FROM tasks JOIN runs USING (run_id, workflow)',
+            [('workflow', workflow), ('run_id', run_id), ('task_family', task_family)],
+            ' ORDER BY runs.started, tasks.recorded')
+        for row in rows:
+            row['params'] = json.loads(row['params'] or '{}')
+            row['info'] = json.loads(row['info'] or '{}')
+        return rows
+
+    def slowest_tasks(self, limit=10, workflow=None, run_id=None):
+        '''
+        Return the tasks with the longest execution times.
+        '''
+        return self._select(
+            'SELECT run_id, workflow, instance_name, task_family, task_exectime_sec, '
+            'slurm_exectime_sec, slurm_jobid FROM tasks',
+            [('workflow', workflow), ('run_id', run_id)],
+            ' ORDER BY task_exectime_sec DESC LIMIT ?', (limit,))
+
+    def runtime_percentiles(self, workflow=None, percentiles=(50, 95),
+                            column='task_exectime_sec'):
+        '''
+        Return a dict of task class -> dict with the number of runs and the
+        given percentiles of the execution time (as 'p50', 'p95' etc).
+        '''
+        if column not in ('task_exectime_sec', 'slurm_exectime_sec'):
+            raise Exception('Not a runtime column: %s' % column)
+        times = {}
+        for row in self._select('SELECT task_family, %s AS sec FROM tasks' % column,
+                                [('workflow', workflow)]):
+            if row['sec'] is not None:
+                times.setdefault(row['task_family'], []).append(row['sec'])
+        stats = {}
+        for task_family, values in times.items():
+            stats[task_family] = {'count': len(values)}
+            for pct in percentiles:
+                stats[task_family]['p%d' % pct] = sciluigi.util.percentile(values, pct)
+        return stats
+
+    def runtime_trend(self, workflow=None, task_family=None):
+        '''
+        Return execution time statistics per workflow run, oldest run first,
+        to follow how runtimes change across runs.
+        '''
+        return self._select(
+            'SELECT run_id, workflow, started, COUNT(*) AS tasks, '
+            'SUM(task_exectime_sec) AS total_sec, AVG(task_exectime_sec) AS mean_sec, '
+            'MAX(task_exectime_sec) AS max_sec FROM tasks JOIN runs USING (run_id, workflow)',
+            [('workflow', workflow), ('task_family', task_family)],
+            ' GROUP BY run_id ORDER BY started')
+
+# ==============================================================================
+
+def _print_rows(rows, columns):
+    '''
+    Print rows of dicts as an aligned table.
+    '''
+    fmtd = [[_fmt(row.get(col)) for col in columns] for row in rows]
+    widths = [max([len(col)] + [len(r[i]) for r in fmtd]) for i, col in enumerate(columns)]
+    print('  '.join(col.ljust(w) for col, w in zip(columns, widths)))
+    for fmtrow in fmtd:
+        print('  '.join(val.ljust(w) for val, w in zip(fmtrow, widths)))
+
+def _fmt(val):
+    if isinstance(val, float):
+        return '%.3f' % val
+    return '' if val is None else str(val)
+
+def main(args=None):
+    '''
+    Commandline interface for querying an audit database.
+    '''
+    parser = argparse.ArgumentParser(description='Query a sciluigi audit database')
+    parser.add_argument('dbpath', help='Path to the SQLite audit database')
+    parser.add_argument('query', choices=['slowest', 'percentiles', 'trend', 'runs'])
+    parser.add_argument('--workflow', help='Only include this workflow (lower case class name)')
+    parser.add_argument('--run', dest='run_id', help='Only include this run (for slowest)')
+    parser.add_argument('--task-family', help='Only include this task class (for trend)')
+    parser.add_argument('--limit', type=int, default=10, help='Number of tasks (for slowest)')
+    opts = parser.parse_args(args)
+
+    auditdb = AuditDB(opts.dbpath)
+    try:
+        if opts.query == 'slowest':
+            _print_rows(auditdb.slowest_tasks(opts.limit, opts.workflow, opts.run_id),
+                        ['run_id', 'instance_name', 'task_family', 'task_exectime_sec',
+                         'slurm_exectime_sec', 'slurm_jobid'])
+        elif opts.query == 'percentiles':
+            stats = auditdb.runtime_percentiles(opts.workflow)
+            rows = [dict(stats[family], task_family=family) for family in sorted(stats)]
+            _print_rows(rows, ['task_family', 'count', 'p50', 'p95'])
+        elif opts.query == 'trend':
+            _print_rows(auditdb.runtime_trend(opts.workflow, opts.task_family),
+                        ['run_id', 'started', 'tasks', 'total_sec', 'mean_sec', 'max_sec'])
+        elif opts.query == 'runs':
+            _print_rows(auditdb.runs(opts.workflow), ['run_id', 'workflow', 'started'])
+    finally:
+        auditdb.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+'''
+This module contains functionality for analysing the critical path and the
+parallelism of a workflow, from the runtimes of its tasks in the audit report
+of a finished run, and the workflow's dependency graph.
+
+It can also be used from the commandline:
+
+    python -m sciluigi.critpath <module>.<WorkflowClass> <.audit file> [options]
+'''
+
+import argparse
+import heapq
+import importlib
+import luigi
+import sciluigi.audit
+import sciluigi.util
+
+# ==============================================================================
+
+def read_auditreport(path):
+    '''
+    Read an audit report (the .audit file written by WorkflowTask.run()) into
+    a dict of instance name -> dict of audit info, with values as strings.
+    '''
+    report = {}
+    info = None
+    with open(path) as auditfile:
+        for line in auditfile:
+            line = line.rstrip('\n')
+            if line.startswith('[') and line.endswith(']'):
+                info = report.setdefault(line[1:-1], {})
+            elif info is not None and ': ' in line:
+                infotype, infoval = line.split(': ', 1)
+                info[infotype] = infoval
+    return report
+
+def workflow_requirements(workflow_task):
+    '''
+    Return the dependency graph of a workflow, as a dict of instance name ->
+    list of the instance names of the tasks it requires.
+    '''
+    _, requirements = workflow_graph(workflow_task.get_workflow_output())
+    return requirements
+
+def workflow_graph(workflow_output):
+    '''
+    Return all tasks upstream of (and including) the task(s) returned by a
+    workflow() method, as a dict of instance name -> task, and the dependency
+    graph, as a dict of instance name -> list of instance names.
+    '''
+    tasks = {}
+    requirements = {}
+    stack = list(luigi.task.flatten(workflow_output))
+    while stack:
+        task = stack.pop()
+        name = sciluigi.util.task_name(task)
+        if name in requirements:
+            continue
+        deps = luigi.task.flatten(task.requires())
+        tasks[name] = task
+        requirements[name] = sorted(set(sciluigi.util.task_name(dep) for dep in deps))
+        stack.extend(deps)
+    return (tasks, requirements)
+
+def historical_runtimes(auditpaths):
+    '''
+    Return the median execution time of each task class (by task family) in
+    the given JSON lines audit files of earlier workflow runs.
+    '''
+    times = {}
+    for path in auditpaths:
+        for record in sciluigi.audit.read_auditrecords(path):
+            sec = sciluigi.util.float_or_none(record.get('info', {}).get('task_exectime_sec'))
+            if sec is not None:
+                times.setdefault(record['task_family'], []).append(sec)
+    return dict((family, sciluigi.util.percentile(values, 50))
+                for family, values in times.items())
+
+# ==============================================================================
+
+class CriticalPathAnalysis(object):
+    '''
+    Critical path and parallelism analysis of a workflow graph, given the
+    duration of each task in seconds (tasks without a duration, such as ones
+    that were already complete, count as taking no time).
+    '''
+    def __init__(self, requirements, durations, intervals=None):
+        self.requirements = requirements
+        self.durations = dict((name, float(durations.get(name) or 0.0)) for name in requirements)
+        # Measured (start, end) times of tasks, where known
+        self.intervals = intervals or {}
+        self.order = _topological_order(requirements)
+        self.dependents = dict((name, []) for name in requirements)
+        for name, deps in requirements.items():
+            for dep in deps:
+                self.dependents[dep].append(name)
+        self._remaining = None
+
+    @classmethod
+    def from_auditreport(cls, workflow_task, auditpath):
+        '''
+        Set up an analysis from a workflow task, for the graph, and the path
+        to the audit report of a run of it, for the task runtimes.
+        '''
+        report = read_auditreport(auditpath)
+        durations = {}
+        intervals = {}
+        for name, info in report.items():
+            durations[name] = sciluigi.util.float_or_none(info.get('task_exectime_sec'))
+            start = sciluigi.util.float_or_none(info.get('trace_start'))
+            end = sciluigi.util.float_or_none(info.get('trace_end'))
+            if start is not None and end is not None:
+                intervals[name] = (start, end)
+        return cls(workflow_requirements(workflow_task), durations, intervals)
+
+    @property
+    def total_work(self):
+        '''
+        The sum of the durations of all tasks.
+        '''
+        return sum(self.durations.values())
+
+    def remaining_path_lengths(self):
+        '''
+        Return a dict of instance name -> length of the longest path from the
+        start of the task to the end of the workflow (including the task itself).
+        '''
+        if self._remaining is None:
+            remaining = {}
+            for name in reversed(self.order):
+                remaining[name] = self.durations[name] + max(
+                    [remaining[dep] for dep in self.dependents[name]] or [0.0])
+            self._remaining = remaining
+        return self._remaining
+
+    def critical_path(self):
+        '''
+        Return the length of the critical path in seconds, and the instance
+        names of the tasks on it, in execution order.
+        '''
+        remaining = self.remaining_path_lengths()
+        if not remaining:
+            return (0.0, [])
+        sources = [name for name in self.order if not self.requirements[name]]
+        name = max(sources, key=lambda name: remaining[name])
+        path = [name]
+        while self.dependents[name]:
+            name = max(self.dependents[name], key=lambda dep: remaining[dep])
+            path.append(name)
+        return (remaining[path[0]], path)
+
+    def earliest_starts(self):
+        '''
+        Return a dict of instance name -> the earliest time the task can
+        start, with unlimited workers.
+        '''
+        starts = {}
+        for name in self.order:
+            starts[name] = max([starts[dep] + self.durations[dep]
+                                for dep in self.requirements[name]] or [0.0])
+        return starts
+
+    def parallelism_profile(self):
+        '''
+        Return the parallelism available over time, with unlimited workers and
+        all tasks started as early as possible, as a list of (time, number of
+        tasks running from that time on) tuples.
+        '''
+        starts = self.earliest_starts()
+        return _profile([(starts[name], starts[name] + self.durations[name])
+                         for name in self.order])
+
+    def measured_parallelism_profile(self):
+        '''
+        Return the parallelism of the actual run, as parallelism_profile()
+        does, from the recorded task start and end times (only available in
+        audit reports that contain trace_start and trace_end).
+        '''
+        if not self.intervals:
+            return []
+        t0 = min(start for start, _ in self.intervals.values())
+        return _profile([(start - t0, end - t0) for start, end in self.intervals.values()])
+
+    def average_parallelism(self):
+        '''
+        Return the total work divided by the critical path length: the
+        largest number of workers that can be kept busy on average.
+        '''
+        length, _ = self.critical_path()
+        if length == 0:
+            return 0.0
+        return self.total_work / length
+
+    def min_makespan(self, workers):
+        '''
+        Return the theoretical minimum makespan with the given number of
+        workers: no shorter than the critical path, nor than the total work
+        spread evenly over all workers.
+        '''
+        length, _ = self.critical_path()
+        return max(length, self.total_work / workers)
+
+    def simulate_makespan(self, workers):
+        '''
+        Return the makespan of a simulated run with the given number of
+        workers, always starting the ready task with the longest remaining
+        path first. This is achievable, and never more than twice the minimum.
+        '''
+        remaining = self.remaining_path_lengths()
+        waiting_for = dict((name, len(deps)) for name, deps in self.requirements.items())
+        ready = [(-remaining[name], name) for name in self.order if waiting_for[name] == 0]
+        heapq.heapify(ready)
+        running = []
+        now = 0.0
+        while ready or running:
+            while ready and len(running) < workers:
+                _, name = heapq.heappop(ready)
+                heapq.heappush(running, (now + self.durations[name], name))
+            now, name = heapq.heappop(running)
+            for dep in self.dependents[name]:
+                waiting_for[dep] -= 1
+                if waiting_for[dep] == 0:
+                    heapq.heappush(ready, (-remaining[dep], dep))
+        return now
+
+    def report(self, workers=(1, 2, 4, 8, 16, 32)):
+        '''
+        Return a readable, multi-line report of the analysis.
+        '''
+        length, path = self.critical_path()
+        lines = ['Tasks: %d' % len(self.order),
+                 'Total work: %.3fs' % self.total_work,
+                 'Critical path: %.3fs' % length]
+        for name in path:
+            lines.append('    %s (%.3fs)' % (name, self.durations[name]))
+        lines.append('Average parallelism: %.2f' % self.average_parallelism())
+        if self.intervals:
+            starts, ends = zip(*self.intervals.values())
+            lines.append('Measured makespan: %.3fs' % (max(ends) - min(starts)))
+        lines.append('Makespan by number of workers (minimum / simulated):')
+        for nworkers in workers:
+            lines.append('    %3d: %.3fs / %.3fs' % (
+                nworkers, self.min_makespan(nworkers), self.simulate_makespan(nworkers)))
+        lines.append('Available parallelism over time (from second: tasks):')
+        for time, running in self.parallelism_profile():
+            lines.append('    %.3f: %d' % (time, running))
+        measured = self.measured_parallelism_profile()
+        if measured:
+            lines.append('Measured parallelism over time (from second: tasks):')
+            for time, running in measured:
+                lines.append('    %.3f: %d' % (time, running))
+        return '\n'.join(lines)
+
+# ==============================================================================
+
+def _topological_order(requirements):
+    '''
+    Return the instance names in an order where every task comes after the
+    tasks it requires.
+    '''
+    waiting_for = dict((name, len(set(deps))) for name, deps in requirements.items())
+    dependents = {}
+    for name, deps in requirements.items():
+        for dep in set(deps):
+            dependents.setdefault(dep, []).append(name)
+    stack = sorted((name for name, count in waiting_for.items() if count == 0), reverse=True)
+    order = []
+    while stack:
+        name = stack.pop()
+        order.append(name)
+        for dep in dependents.get(name, []):
+            waiting_for[dep] -= 1
+            if waiting_for[dep] == 0:
+                stack.append(dep)
+    if len(order) != len(requirements):
+        raise Exception('Workflow graph has a cycle, among: %s' % ', '.join(
+            sorted(name for name, count in waiting_for.items() if count > 0)))
+    return order
+
+def _profile(intervals):
+    '''
+    Turn (start, end) intervals into a list of (time, number of intervals
+    ongoing from that time on) tuples, for the times where the number changes.
+    '''
+    changes = {}
+    for start, end in intervals:
+        if end > start:
+            changes[start] = changes.get(start, 0) + 1
+            changes[end] = changes.get(end, 0) - 1
+    profile = []
+    running = 0
+    for time in sorted(changes):
+        running += changes[time]
+        if not profile or profile[-1][1] != running:
+            profile.append((time, running))
+    return profile
+
+# ==============================================================================
+
+def main(args=None):
+    '''
+    Commandline interface, printing an analysis of a finished workflow run.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Critical path and parallelism analysis of a sciluigi workflow run')
+    parser.add_argument('workflow', help='Workflow class, as <module>.<WorkflowClass>')
+    parser.add_argument('auditpath', help='Path to the .audit file of the run')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='Parameter of the workflow task (may be given several times)')
+    parser.add_argument('--workers', default='1,2,4,8,16,32',
+                        help='Comma separated numbers of workers to compute makespans for')
+    opts = parser.parse_args(args)
+
+    modulename, clsname = opts.workflow.rsplit('.', 1)
+    wfcls = getattr(importlib.import_module(modulename), clsname)
+    workflow_task = wfcls.from_str_params(dict(param.split('=', 1) for param in opts.param))
+    analysis = CriticalPathAnalysis.from_auditreport(workflow_task, opts.auditpath)
+    print(analysis.report([int(n) for n in opts.workers.split(',')]))
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ the dependency graph of workflows.
 '''
 
 import luigi
+import sciluigi.fscache
 from luigi.contrib.postgres import PostgresTarget
 from luigi.contrib.s3 import S3Target
 from luigi.six import iteritems
@@ -14,15 +15,40 @@ class TargetInfo(object):
     '''
     Class to be used for sending specification of which target, from which
     task, to use, when stitching workflow tasks' outputs and inputs together.
+
+    The luigi target is not created until it is first accessed, since in many
+    cases only the path is ever used.
     '''
-    task = None
-    path = None
-    target = None
+    __slots__ = ('task', 'path', '_format', '_is_tmp', '_target')
 
     def __init__(self, task, path, format=None, is_tmp=False):
         self.task = task
         self.path = path
-        self.target = luigi.LocalTarget(path, format, is_tmp)
+        self._format = format
+        self._is_tmp = is_tmp
+        self._target = None
+        if path is None:
+            # Let luigi pick a temporary path for us, right away
+            self.path = self.target.path
+
+    @property
+    def target(self):
+        '''
+        The luigi target, created on first access
+        '''
+        if self._target is None:
+            self._target = self._create_target()
+        return self._target
+
+    @target.setter
+    def target(self, target):
+        self._target = target
+
+    def _create_target(self):
+        '''
+        Create the luigi target that this TargetInfo points to
+        '''
+        return luigi.LocalTarget(self.path, self._format, self._is_tmp)
 
     def open(self, *args, **kwargs):
         '''
@@ -33,16 +59,30 @@ class TargetInfo(object):
 # ==============================================================================
 
 class S3TargetInfo(TargetInfo):
+    __slots__ = ('_client',)
+
     def __init__(self, task, path, format=None, client=None):
         self.task = task
         self.path = path
-        self.target = S3Target(path, format=format, client=client)
+        self._format = format
+        self._is_tmp = False
+        self._client = client
+        self._target = None
+
+    def _create_target(self):
+        return S3Target(self.path, format=self._format, client=self._client)
 
 # ==============================================================================
 
 class PostgresTargetInfo(TargetInfo):
+    __slots__ = ('host', 'database', 'user', 'password', 'update_id', 'table', 'port')
+
     def __init__(self, task, host, database, user, password, update_id, table=None, port=None):
         self.task = task
+        self.path = None
+        self._format = None
+        self._is_tmp = False
+        self._target = None
         self.host = host
         self.database = database
         self.user = user
@@ -50,7 +90,20 @@ class PostgresTargetInfo(TargetInfo):
         self.update_id = update_id
         self.table = table
         self.port = port
-        self.target = PostgresTarget(host=host, database=database, user=user, password=password, table=table, update_id=update_id, port=port)
+
+    def _create_target(self):
+        return PostgresTarget(host=self.host, database=self.database, user=self.user,
+                              password=self.password, table=self.table,
+                              update_id=self.update_id, port=self.port)
+
+# ==============================================================================
+
+class PortChangedException(Exception):
+    '''
+    Exception to throw if an out-port returns different targets on a later call,
+    when running with strict_ports turned on.
+    '''
+    pass
 
 # ==============================================================================
 
@@ -60,6 +113,46 @@ class DependencyHelpers(object):
     workflow definition, as opposed to the task-based one in vanilla luigi.
     '''
 
+    # If True, out-ports are re-evaluated on every call to output(), and a
+    # PortChangedException is raised if they no longer match the cached targets.
+    strict_ports = False
+
+    # If True, complete() checks local output files through the directory
+    # listing cache in sciluigi.fscache, instead of with one stat call per file.
+    cached_exists_checks = True
+
+    _outport_cache = None
+
+    # Registry of port names, built once per subclass in __init_subclass__(),
+    # and extended per instance in __setattr__()
+    _inport_names = ()
+    _outport_names = ()
+
+    def __init_subclass__(cls, **kwargs):
+        '''
+        Record the names of the in- and out-ports declared on the class (and
+        its parents), so that they don't need to be looked up on every call to
+        requires() or output().
+        '''
+        super(DependencyHelpers, cls).__init_subclass__(**kwargs)
+        cls._inport_names = tuple(n for n in dir(cls) if n[0:3] == 'in_')
+        cls._outport_names = tuple(n for n in dir(cls) if n[0:4] == 'out_')
+
+    def __setattr__(self, name, value):
+        '''
+        Keep the port registry up to date when ports are assigned on the
+        instance, e.g. task.in_foo = other.out_bar, and drop cached output
+        targets if a port is rewired to something else.
+        '''
+        if name[0:3] == 'in_' or name[0:4] == 'out_':
+            registry = '_inport_names' if name[0:3] == 'in_' else '_outport_names'
+            names = getattr(self, registry)
+            if name not in names:
+                super(DependencyHelpers, self).__setattr__(registry, names + (name,))
+            if name not in self.__dict__ or not _port_value_equals(self.__dict__[name], value):
+                self.clear_port_cache()
+        super(DependencyHelpers, self).__setattr__(name, value)
+
     # --------------------------------------------------------
     # Handle inputs
     # --------------------------------------------------------
@@ -75,32 +168,46 @@ class DependencyHelpers(object):
         Extract upstream tasks from the TargetInfo objects
         or functions returning those (or lists of both the earlier)
         for use in luigi's requires() method.
+
+        Each upstream task is returned only once, even if several
+        TargetInfos from it are connected.
         '''
         upstream_tasks = []
-        for attrname, attrval in iteritems(self.__dict__):
-            if 'in_' == attrname[0:3]:
-                upstream_tasks = self._parse_inputitem(attrval, upstream_tasks)
+        seen_taskids = set()
+        for attrname in self._inport_names:
+            # Only ports connected on the instance count as dependencies
+            if attrname in self.__dict__:
+                upstream_tasks = self._parse_inputitem(
+                        self.__dict__[attrname], upstream_tasks, seen_taskids)
 
         return upstream_tasks
 
-    def _parse_inputitem(self, val, tasks):
+    def _parse_inputitem(self, val, tasks, seen_taskids=None):
         '''
-        Recursively loop through lists of TargetInfos, or
-        callables returning TargetInfos, or lists of ...
-        (repeat recursively) ... and return all tasks.
+        Loop through lists of TargetInfos, or callables returning
+        TargetInfos, or lists of ... (to any depth) ... and return all
+        tasks not already seen.
+
+        Nested items are walked with an explicit stack rather than by
+        recursion, so that deep nesting can not hit the recursion limit.
         '''
-        if callable(val):
-            val = val()
-        if isinstance(val, TargetInfo):
-            tasks.append(val.task)
-        elif isinstance(val, list):
-            for valitem in val:
-                tasks = self._parse_inputitem(valitem, tasks)
-        elif isinstance(val, dict):
-            for _, valitem in iteritems(val):
-                tasks = self._parse_inputitem(valitem, tasks)
-        else:
-            raise Exception('Input item is neither callable, TargetInfo, nor list: %s' % val)
+        if seen_taskids is None:
+            seen_taskids = set(id(task) for task in tasks)
+        stack = [val]
+        while stack:
+            val = stack.pop()
+            if callable(val):
+                val = val()
+            if isinstance(val, TargetInfo):
+                if id(val.task) not in seen_taskids:
+                    seen_taskids.add(id(val.task))
+                    tasks.append(val.task)
+            elif isinstance(val, list):
+                stack.extend(reversed(val))
+            elif isinstance(val, dict):
+                stack.extend(reversed([valitem for _, valitem in iteritems(val)]))
+            else:
+                raise Exception('Input item is neither callable, TargetInfo, nor list: %s' % val)
         return tasks
 
     # --------------------------------------------------------
@@ -113,19 +220,82 @@ class DependencyHelpers(object):
         '''
         return self._output_targets()
 
+    def complete(self):
+        '''
+        Implement luigi API method, checking the existence of all local file
+        outputs in one batch, per directory.
+        '''
+        outputs = luigi.task.flatten(self.output())
+        if not self.cached_exists_checks or len(outputs) == 0:
+            return super(DependencyHelpers, self).complete()
+        local_paths = []
+        for target in outputs:
+            if target.__class__ is luigi.LocalTarget:
+                local_paths.append(target.path)
+            elif not target.exists():
+                return False
+        return sciluigi.fscache.dircache.all_exist(local_paths)
+
+    @luigi.Task.event_handler(luigi.Event.SUCCESS)
+    @luigi.Task.event_handler(luigi.Event.FAILURE)
+    def clear_output_dir_cache(self, *args):
+        '''
+        Drop cached listings of the directories this task has written its
+        outputs to, after it has finished running (successfully or not).
+        '''
+        if isinstance(self, DependencyHelpers) and self.cached_exists_checks:
+            sciluigi.fscache.dircache.invalidate(
+                [t.path for t in luigi.task.flatten(self.output()) if hasattr(t, 'path')])
+
+    def clear_port_cache(self):
+        '''
+        Drop the cached output targets, so that they are resolved again on the
+        next call to output(). Call this after rewiring the ports of a task
+        whose output() has already been used.
+        '''
+        self._outport_cache = None
+
     def _output_targets(self):
         '''
         Extract output targets from the TargetInfo objects
         or functions returning those (or lists of both the earlier)
         for use in luigi's output() method.
+
+        The targets are resolved once per task instance, and cached until
+        clear_port_cache() is called.
         '''
+        if self._outport_cache is None:
+            self._outport_cache = self._resolve_output_ports()
+        elif self.strict_ports:
+            self._check_output_ports(self._outport_cache, self._resolve_output_ports())
+
         output_targets = []
-        for attrname in dir(self):
+        for portname in sorted(self._outport_cache):
+            output_targets.extend(self._outport_cache[portname])
+        return output_targets
+
+    def _resolve_output_ports(self):
+        '''
+        Build a table of port name -> list of luigi targets, for all out-ports.
+        '''
+        port_table = {}
+        for attrname in self._outport_names:
             attrval = getattr(self, attrname)
-            if attrname[0:4] == 'out_':
-                output_targets = self._parse_outputitem(attrval, output_targets)
+            port_table[attrname] = self._parse_outputitem(attrval, [])
+        return port_table
 
-        return output_targets
+    def _check_output_ports(self, cached_table, new_table):
+        '''
+        Raise a PortChangedException if any out-port resolves to other targets
+        than the ones in the cached port table.
+        '''
+        for portname in sorted(set(cached_table) | set(new_table)):
+            cached_keys = [_target_key(t) for t in cached_table.get(portname, [])]
+            new_keys = [_target_key(t) for t in new_table.get(portname, [])]
+            if cached_keys != new_keys:
+                raise PortChangedException(
+                    'Out-port %s of task %s changed between calls: %s != %s' % (
+                        portname, self, cached_keys, new_keys))
 
     def _parse_outputitem(self, val, targets):
         '''
@@ -146,3 +316,25 @@ class DependencyHelpers(object):
         else:
             raise Exception('Input item is neither callable, TargetInfo, nor list: %s' % val)
         return targets
+
+# ==============================================================================
+
+def _port_value_equals(old, new):
+    '''
+    Check whether a port is re-assigned to the same thing. Bound methods
+    compare equal when they wrap the same function of the same task.
+    '''
+    try:
+        return bool(old == new)
+    except Exception:
+        return False
+
+def _target_key(target):
+    '''
+    Return a comparable key identifying a luigi target, for use when checking
+    that out-ports resolve to the same targets between calls.
+    '''
+    return (target.__class__.__name__,
+            getattr(target, 'path', None),
+            getattr(target, 'table', None),
+            getattr(target, 'update_id', None))
@@ -0,0 +1,255 @@
+'''
+This module contains the executors that tasks run their commands through
+(with Task.ex()), and the registry they are looked up by name in.
+
+The executor of a task is, in order of precedence:
+
+- The executor attribute of the task (a name, or an Executor instance)
+- The executor option in the task's section of the luigi config file
+  (named by its task family)
+- The executor attribute of the workflow
+- The executor option in the [sciluigi] section of the luigi config file
+
+  (these two only for tasks the executor supports, so that e.g. 'sbatch' for
+  a whole workflow leaves its plain, non-SLURM tasks to the default)
+- The task's default executor: 'local' for plain tasks, and the one matching
+  the runmode of the SLURM info for SLURM tasks
+
+Options of executors looked up by name are read from the [executor_<name>]
+section of the luigi config file, e.g.:
+
+    [executor_fake]
+    latency_sec = 0.05
+
+Executors looked up by name are shared within the process, so that e.g. the
+slot accounting of 'local_pool' covers all tasks running in the process.
+'''
+
+import logging
+import os
+import random
+import threading
+import time
+import luigi
+import sciluigi.task
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# ==============================================================================
+
+class Executor(object):
+    '''
+    Base class of executors. Subclasses implement execute(), and declare their
+    options, with default values, in options.
+    '''
+    options = {}
+
+    def __init__(self, **options):
+        for name, default in self.options.items():
+            setattr(self, name, options.pop(name, default))
+        if options:
+            raise Exception('Unknown options for executor %s: %s' % (
+                self.__class__.__name__, ', '.join(sorted(options))))
+
+    def execute(self, task, command):
+        '''
+        Execute command for task, and return (retcode, stdout, stderr), or
+        raise a sciluigi.task.CommandFailedException if it failed.
+        '''
+        raise NotImplementedError
+
+    def supports(self, task):
+        '''
+        Return whether the executor can execute the commands of task.
+        '''
+        return True
+
+class LocalExecutor(Executor):
+    '''
+    Execute commands as local subprocesses.
+    '''
+    def execute(self, task, command):
+        return task.ex_local(command)
+
+class LocalPoolExecutor(Executor):
+    '''
+    Execute commands as local subprocesses, with at most slots (by default the
+    number of CPUs) in use at once. A command takes as many slots as the cores
+    declared by its task (at least one), and waits until they are free. The
+    total time each task's commands waited is added to its audit info.
+    '''
+    options = {'slots': 0}
+
+    def __init__(self, **options):
+        super(LocalPoolExecutor, self).__init__(**options)
+        self.slots = int(self.slots) or os.cpu_count() or 1
+        self.slots_in_use = 0
+        self.peak_slots_in_use = 0
+        self.commands = 0
+        self.wait_sec = 0.0
+        self._cond = threading.Condition()
+
+    def execute(self, task, command):
+        need = min(self.slots, max(1, int(getattr(task, 'cores', None) or 1)))
+        start = time.time()
+        with self._cond:
+            while self.slots_in_use + need > self.slots:
+                self._cond.wait()
+            self.slots_in_use += need
+            self.peak_slots_in_use = max(self.peak_slots_in_use, self.slots_in_use)
+            self.commands += 1
+            wait_sec = time.time() - start
+            self.wait_sec += wait_sec
+        task.add_executor_slot_wait(wait_sec)
+        try:
+            return task.ex_local(command)
+        finally:
+            with self._cond:
+                self.slots_in_use -= need
+                self._cond.notify_all()
+
+class SlurmExecutor(Executor):
+    '''
+    Base class of executors running commands via SLURM, through the method of
+    SlurmHelpers named by task_method. Tasks without SLURM support are refused.
+    '''
+    task_method = None
+
+    def supports(self, task):
+        return hasattr(task, self.task_method)
+
+    def execute(self, task, command):
+        if not self.supports(task):
+            raise Exception('Executor %s needs a SLURM task (a SlurmHelpers subclass), but task '
+                            '%s is a %s' % (self.__class__.__name__, task.instance_name,
+                                             task.__class__.__name__))
+        return getattr(task, self.task_method)(command)
+
+class SallocExecutor(SlurmExecutor):
+    '''
+    Execute commands in their own SLURM allocation, with salloc (see
+    SlurmHelpers.ex_hpc()).
+    '''
+    task_method = 'ex_hpc'
+
+class SallocMpiExecutor(SlurmExecutor):
+    '''
+    Execute MPI commands in their own SLURM allocation, with salloc (see
+    SlurmHelpers.ex_mpi()).
+    '''
+    task_method = 'ex_mpi'
+
+class SbatchExecutor(SlurmExecutor):
+    '''
+    Submit commands with sbatch, and wait for them with a shared poller (see
+    SlurmHelpers.ex_hpc_sbatch()).
+    '''
+    task_method = 'ex_hpc_sbatch'
+
+class SlurmArrayExecutor(SlurmExecutor):
+    '''
+    Execute commands as elements of shared SLURM job arrays (see
+    SlurmHelpers.ex_hpc_array()).
+    '''
+    task_method = 'ex_hpc_array'
+
+class SlurmPoolExecutor(SlurmExecutor):
+    '''
+    Execute commands in a pool of SLURM pilot jobs (see
+    SlurmHelpers.ex_hpc_pool()).
+    '''
+    task_method = 'ex_hpc_pool'
+
+class FakeExecutor(Executor):
+    '''
+    Simulate executing commands, taking latency_sec seconds (plus a random
+    jitter of up to jitter_sec) per command, and returning retcode, without
+    running them (unless run is set, in which case they are also run locally).
+    For measuring scheduling overhead, and trying out workflows.
+    '''
+    options = {'latency_sec': 0.0, 'jitter_sec': 0.0, 'retcode': 0, 'run': False}
+
+    def __init__(self, **options):
+        super(FakeExecutor, self).__init__(**options)
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def execute(self, task, command):
+        start = time.time()
+        time.sleep(float(self.latency_sec) + random.uniform(0, float(self.jitter_sec)))
+        with self._lock:
+            self.commands += 1
+        if self.run:
+            return task.ex_local(command)
+        retcode = int(self.retcode)
+        task.trace_command('ex_fake', command, start, time.time(), retcode=retcode)
+        if retcode != 0:
+            errmsg = 'Simulated command failed (retcode {ret}): {cmd}'.format(ret=retcode, cmd=command)
+            log.error(errmsg)
+            raise sciluigi.task.CommandFailedException(errmsg, retcode, b'', b'')
+        return (retcode, b'', b'')
+
+# ==============================================================================
+
+EXECUTORS = {}
+
+def register_executor(name, cls):
+    '''
+    Register an Executor subclass under a name, for use in the executor
+    attributes of tasks and workflows, and in the luigi config file.
+    '''
+    EXECUTORS[name] = cls
+
+register_executor('local', LocalExecutor)
+register_executor('local_pool', LocalPoolExecutor)
+register_executor('salloc', SallocExecutor)
+register_executor('salloc_mpi', SallocMpiExecutor)
+register_executor('sbatch', SbatchExecutor)
+register_executor('slurm_array', SlurmArrayExecutor)
+register_executor('slurm_pool', SlurmPoolExecutor)
+register_executor('fake', FakeExecutor)
+
+_executors = {}
+_executors_pid = None
+_executors_lock = threading.Lock()
+
+def get_executor(executor):
+    '''
+    Return the executor registered under a name, shared within the process,
+    with the options in the [executor_<name>] section of the luigi config
+    file. Executor instances are returned as they are.
+    '''
+    global _executors_pid
+    if isinstance(executor, Executor):
+        return executor
+    with _executors_lock:
+        # Locks held by other threads at fork time would never be released
+        if _executors_pid != os.getpid():
+            _executors.clear()
+            _executors_pid = os.getpid()
+        if executor not in _executors:
+            if executor not in EXECUTORS:
+                raise Exception('Unknown executor: %s (registered: %s)' % (
+                    executor, ', '.join(sorted(EXECUTORS))))
+            cls = EXECUTORS[executor]
+            _executors[executor] = cls(**_config_options(executor, cls))
+        return _executors[executor]
+
+def _config_options(name, cls):
+    '''
+    Read the options of an executor from the luigi config file, converted to
+    the types of their defaults.
+    '''
+    config = luigi.configuration.get_config()
+    section = 'executor_' + name
+    options = {}
+    for option, default in cls.options.items():
+        if not config.has_option(section, option):
+            continue
+        if isinstance(default, bool):
+            options[option] = config.getboolean(section, option)
+        else:
+            options[option] = type(default)(config.get(section, option))
+    return options
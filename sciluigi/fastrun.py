@@ -0,0 +1,224 @@
+'''
+This module contains an in-process engine for running workflows, as an
+alternative to luigi's worker and scheduler, for workflows of very many small
+tasks, where the per-task overhead of luigi's scheduling loop dominates.
+
+The workflow graph is built once, and the completeness of all its tasks is
+checked up front, concurrently, by a dry run (see sciluigi.plan). The tasks
+that need to run, ending with the workflow task itself, are then dispatched
+from an asyncio event loop to a pool of threads, or of forked processes, each
+as soon as the tasks it requires have finished, in order of luigi priority.
+
+Tasks are run the way luigi's workers run them, with the same events (START,
+PROCESSING_TIME, SUCCESS and FAILURE) triggered around run(), so that audit
+info, traces and the audit report are written as with luigi. Tasks are not
+re-checked for completeness before they run, and dynamic dependencies (run()
+methods yielding tasks) are not supported.
+
+    result = sciluigi.run_fast(MyWorkflow(instance_name='my_wf'), workers=8)
+'''
+
+import asyncio
+import heapq
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+import types
+import luigi
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import sciluigi.plan
+import sciluigi.util
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Tasks of the run in progress, by task id, for forked worker processes
+_fork_tasks = {}
+
+# ==============================================================================
+
+class FastRunResult(object):
+    '''
+    The outcome of running a workflow with run_fast(), as lists of instance
+    names (task ids, for non-sciluigi tasks).
+    '''
+    def __init__(self):
+        # Tasks that were already complete
+        self.complete = []
+        # Tasks that were run successfully
+        self.done = []
+        # Tasks that failed, or whose completeness check failed, mapped to the error
+        self.failed = {}
+        # Incomplete external tasks, and tasks depending on them or on failed tasks
+        self.blocked = []
+        self.check_seconds = 0.0
+        self.run_seconds = 0.0
+
+    @property
+    def success(self):
+        '''
+        Whether nothing failed, or was blocked
+        '''
+        return not self.failed and not self.blocked
+
+    def summary(self):
+        '''
+        Return a one-line summary of the run
+        '''
+        return ('{done} tasks run, {failed} failed, {blocked} blocked, {complete} already complete '
+                '(checked in {check:.3f}s, run in {run:.3f}s)').format(
+                    done=len(self.done), failed=len(self.failed), blocked=len(self.blocked),
+                    complete=len(self.complete), check=self.check_seconds, run=self.run_seconds)
+
+# ==============================================================================
+
+class FastRunner(object):
+    '''
+    Run a workflow task with at most workers tasks running at a time (by
+    default the number of CPUs), in threads, or in forked processes if
+    use_processes is set (see the module docstring).
+    '''
+    def __init__(self, workflow_task, workers=None, use_processes=False,
+                 check_workers=sciluigi.plan.DEFAULT_PLAN_WORKERS):
+        self.workflow_task = workflow_task
+        self.workers = workers or os.cpu_count() or 1
+        self.use_processes = use_processes
+        self.check_workers = check_workers
+
+    def run(self):
+        '''
+        Run the workflow, and return a FastRunResult.
+        '''
+        result = FastRunResult()
+        # Through requires(), to log the start of the workflow, as with luigi
+        self.workflow_task.requires()
+        plan = sciluigi.plan.plan_workflow(self.workflow_task, workers=self.check_workers)
+        result.check_seconds = plan.check_seconds
+        result.complete = [sciluigi.util.task_name(task) for task in plan.complete]
+        for task in plan.blocked:
+            if task in plan.errors:
+                result.failed[sciluigi.util.task_name(task)] = (
+                    'Checking completeness failed: %s' % plan.errors[task])
+            else:
+                result.blocked.append(sciluigi.util.task_name(task))
+        log.info('Running %d tasks of workflow %s, %d already complete, %d blocked',
+                 len(plan.to_run), sciluigi.util.task_name(self.workflow_task),
+                 len(plan.complete), len(plan.blocked))
+
+        start = time.time()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._dispatch(plan, result))
+        finally:
+            loop.close()
+        result.run_seconds = time.time() - start
+        log.info('Workflow %s: %s', sciluigi.util.task_name(self.workflow_task), result.summary())
+        return result
+
+    async def _dispatch(self, plan, result):
+        '''
+        Run the tasks to run in the plan, each once all the tasks it requires
+        have finished successfully.
+        '''
+        global _fork_tasks
+        loop = asyncio.get_event_loop()
+        tasks = dict((task.task_id, task) for task in plan.to_run)
+        waiting_for = {}
+        dependents = {}
+        for task_id in tasks:
+            dep_ids = set(dep_id for dep_id in plan.requirements[task_id] if dep_id in tasks)
+            waiting_for[task_id] = len(dep_ids)
+            for dep_id in dep_ids:
+                dependents.setdefault(dep_id, []).append(task_id)
+        ready = []
+        for task_id, count in waiting_for.items():
+            if count == 0:
+                heapq.heappush(ready, (-tasks[task_id].priority, task_id))
+
+        if self.use_processes:
+            # Worker processes are forked on the first dispatch, and look the
+            # tasks up here, so that tasks are never pickled
+            _fork_tasks = tasks
+            pool = ProcessPoolExecutor(max_workers=self.workers,
+                                       mp_context=multiprocessing.get_context('fork'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+        running = {}
+        try:
+            while ready or running:
+                while ready and len(running) < self.workers:
+                    _, task_id = heapq.heappop(ready)
+                    if self.use_processes:
+                        future = loop.run_in_executor(pool, _run_forked_task, task_id)
+                    else:
+                        future = loop.run_in_executor(pool, run_task, tasks[task_id])
+                    running[future] = task_id
+                done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    task_id = running.pop(future)
+                    name = sciluigi.util.task_name(tasks[task_id])
+                    error = future.result()
+                    if error is not None:
+                        log.error('Task %s failed: %s', name, error)
+                        result.failed[name] = error
+                        for blocked_id in _downstream(task_id, dependents):
+                            if waiting_for.pop(blocked_id, None) is not None:
+                                result.blocked.append(sciluigi.util.task_name(tasks[blocked_id]))
+                        continue
+                    result.done.append(name)
+                    for dependent_id in dependents.get(task_id, []):
+                        if dependent_id not in waiting_for:
+                            continue
+                        waiting_for[dependent_id] -= 1
+                        if waiting_for[dependent_id] == 0:
+                            heapq.heappush(ready, (-tasks[dependent_id].priority, dependent_id))
+        finally:
+            pool.shutdown(wait=True)
+            _fork_tasks = {}
+
+# ==============================================================================
+
+def run_task(task):
+    '''
+    Run a task the way luigi's workers do, triggering the same events, and
+    return None if it succeeded, or the formatted traceback if it failed.
+    '''
+    try:
+        task.trigger_event(luigi.Event.START, task)
+        start = time.time()
+        output = task.run()
+        if isinstance(output, types.GeneratorType):
+            raise Exception('Dynamic dependencies are not supported by run_fast(), in %s' % task)
+        task.trigger_event(luigi.Event.PROCESSING_TIME, task, time.time() - start)
+        task.on_success()
+        task.trigger_event(luigi.Event.SUCCESS, task)
+        return None
+    except KeyboardInterrupt:
+        raise
+    except BaseException as exc:
+        error = traceback.format_exc()
+        task.trigger_event(luigi.Event.FAILURE, task, exc)
+        task.on_failure(exc)
+        return error
+
+def _run_forked_task(task_id):
+    '''
+    Run a task of the run in progress, in a forked worker process.
+    '''
+    return run_task(_fork_tasks[task_id])
+
+def _downstream(task_id, dependents):
+    '''
+    Return the ids of all tasks depending, directly or indirectly, on a task.
+    '''
+    found = set()
+    stack = list(dependents.get(task_id, []))
+    while stack:
+        dependent_id = stack.pop()
+        if dependent_id not in found:
+            found.add(dependent_id)
+            stack.extend(dependents.get(dependent_id, []))
+    return found
@@ -0,0 +1,147 @@
+'''
+This module contains a cache of directory listings, used for answering
+existence checks of many local files with few filesystem calls.
+'''
+
+import os
+import threading
+import time
+from luigi.six import iteritems
+
+# ==============================================================================
+
+# Directories modified more recently than this many seconds ago are not
+# trusted to be completely listed, since file systems with coarse timestamps
+# might not register further changes in the directory's modification time.
+RACY_SECONDS = 2.0
+
+# ==============================================================================
+
+class DirListing(object):
+    '''
+    Names of the entries in one directory, as listed at a given modification
+    time of the directory.
+    '''
+    __slots__ = ('mtime', 'files', 'links', 'complete')
+
+    def __init__(self, mtime, files, links, complete):
+        self.mtime = mtime
+        self.files = files
+        self.links = links
+        self.complete = complete
+
+# ==============================================================================
+
+class DirListingCache(object):
+    '''
+    Answer existence checks for local files from cached directory listings,
+    instead of doing one stat call per file.
+
+    Each directory is listed once with os.scandir, and only listed again when
+    its modification time changes, which is checked with one stat call per
+    directory and check. For directories modified very recently, files not
+    yet seen are looked up one by one, until the directory has settled.
+    '''
+    def __init__(self):
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def exists(self, path):
+        '''
+        Check whether a single file or directory exists.
+        '''
+        return self.all_exist([path])
+
+    def all_exist(self, paths):
+        '''
+        Check whether all the given files or directories exist, listing each
+        parent directory at most once.
+        '''
+        names_by_dir = {}
+        for path in paths:
+            dirpath, name = os.path.split(os.path.abspath(path))
+            names_by_dir.setdefault(dirpath, []).append(name)
+        for dirpath, names in iteritems(names_by_dir):
+            if not self._dir_contains(dirpath, names):
+                return False
+        return True
+
+    def invalidate(self, paths=None):
+        '''
+        Drop the cached listings of the parent directories of the given paths,
+        or of all directories if no paths are given.
+        '''
+        with self._lock:
+            if paths is None:
+                self._listings.clear()
+            else:
+                for path in paths:
+                    self._listings.pop(os.path.dirname(os.path.abspath(path)), None)
+
+    def _dir_contains(self, dirpath, names):
+        '''
+        Check whether all names exist in the directory at dirpath.
+        '''
+        listing = self._get_listing(dirpath)
+        if listing is None:
+            return False
+        for name in names:
+            if not name:
+                # The path is a file system root, which exists if listable
+                continue
+            if name in listing.files:
+                continue
+            path = os.path.join(dirpath, name)
+            if name in listing.links:
+                # Follow symlinks, as os.path.exists does
+                if not os.path.exists(path):
+                    return False
+            elif listing.complete or not os.path.exists(path):
+                return False
+            else:
+                listing.files.add(name)
+        return True
+
+    def _get_listing(self, dirpath):
+        '''
+        Return an up to date listing of dirpath, or None if it does not exist.
+        '''
+        try:
+            mtime = os.stat(dirpath).st_mtime
+        except OSError:
+            with self._lock:
+                self._listings.pop(dirpath, None)
+            return None
+
+        with self._lock:
+            listing = self._listings.get(dirpath)
+        if listing is not None and listing.complete and listing.mtime == mtime:
+            return listing
+
+        if time.time() - mtime < RACY_SECONDS:
+            # Keep the files seen so far, but don't trust the listing to be complete
+            if listing is None:
+                listing = DirListing(mtime, set(), set(), False)
+            else:
+                listing = DirListing(mtime, listing.files, listing.links, False)
+        else:
+            files = set()
+            links = set()
+            try:
+                for entry in os.scandir(dirpath):
+                    if entry.is_symlink():
+                        links.add(entry.name)
+                    else:
+                        files.add(entry.name)
+            except OSError:
+                return None
+            listing = DirListing(mtime, files, links, True)
+
+        with self._lock:
+            self._listings[dirpath] = listing
+        return listing
+
+# ==============================================================================
+
+# The cache shared by all tasks in the process
+dircache = DirListingCache()
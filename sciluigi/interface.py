@@ -4,6 +4,7 @@ This module contains mappings of methods that are part of the sciluigi API
 
 import luigi
 import logging
+import sciluigi.fastrun
 import sciluigi.util
 
 LOGFMT_STREAM = '%(asctime)s | %(levelname)8s | %(message)s'
@@ -62,3 +63,10 @@ def run_local(*args, **kwargs):
     Forwarding luigi's run method, with local scheduler
     '''
     run(local_scheduler=True, *args, **kwargs)
+
+def run_fast(workflow_task, workers=None, use_processes=False):
+    '''
+    Run a workflow task in-process, without luigi's worker and scheduler (see
+    sciluigi.fastrun), and return a sciluigi.fastrun.FastRunResult
+    '''
+    return sciluigi.fastrun.FastRunner(workflow_task, workers, use_processes).run()
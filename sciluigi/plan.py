@@ -0,0 +1,157 @@
+'''
+This module contains functionality for dry-running workflows, to find out
+which tasks will run, before actually running anything.
+'''
+
+import logging
+import time
+import luigi
+import sciluigi.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Number of threads to check task completeness with, by default
+DEFAULT_PLAN_WORKERS = 16
+
+# ==============================================================================
+
+class WorkflowPlan(object):
+    '''
+    The result of a dry run of a workflow: which tasks are already complete,
+    and which will be run.
+
+    Tasks are traversed the way luigi does it, so requirements of tasks that
+    are already complete are not included.
+    '''
+    def __init__(self, workflow_task):
+        self.workflow_task = workflow_task
+        # Tasks whose outputs already exist
+        self.complete = []
+        # Tasks that will run, and can start right away
+        self.ready = []
+        # Tasks that will run, once other tasks in the plan have finished
+        self.pending = []
+        # Incomplete external tasks, and tasks depending on them, which can not run
+        self.blocked = []
+        # Tasks whose complete() raised an exception, mapped to the exception
+        self.errors = {}
+        # Task id -> ids of the tasks it requires, for all incomplete tasks
+        self.requirements = {}
+        self.check_seconds = 0.0
+
+    @property
+    def to_run(self):
+        '''
+        All tasks that will be run
+        '''
+        return self.ready + self.pending
+
+    def summary(self):
+        '''
+        Return a readable, multi-line summary of the plan
+        '''
+        lines = ['Plan for workflow {wf} (completeness checked in {sec:.3f}s):'.format(
+                    wf=sciluigi.util.task_name(self.workflow_task), sec=self.check_seconds)]
+        for title, tasks in [('Complete', self.complete),
+                             ('Ready to run', self.ready),
+                             ('Pending', self.pending),
+                             ('Blocked', self.blocked)]:
+            lines.append('  {title}: {n}'.format(title=title, n=len(tasks)))
+            for task in tasks:
+                if task in self.errors:
+                    lines.append('    {t} (check failed: {e})'.format(
+                        t=sciluigi.util.task_name(task), e=self.errors[task]))
+                else:
+                    lines.append('    {t}'.format(t=sciluigi.util.task_name(task)))
+        return '\n'.join(lines)
+
+# ==============================================================================
+
+def plan_workflow(workflow_task, workers=DEFAULT_PLAN_WORKERS):
+    '''
+    Dry-run a workflow task, checking the completeness of its tasks
+    concurrently on a pool of threads, and return a WorkflowPlan.
+    '''
+    plan = WorkflowPlan(workflow_task)
+    tasks = {workflow_task.task_id: workflow_task}
+    is_complete = {}
+
+    start = time.time()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(_check_complete, workflow_task): workflow_task}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = futures.pop(future)
+                complete, error = future.result()
+                is_complete[task.task_id] = complete
+                if error is not None:
+                    plan.errors[task] = error
+                if complete or error is not None:
+                    continue
+                deps = _requirements(workflow_task, task)
+                plan.requirements[task.task_id] = [dep.task_id for dep in deps]
+                for dep in deps:
+                    if dep.task_id not in tasks:
+                        tasks[dep.task_id] = dep
+                        futures[pool.submit(_check_complete, dep)] = dep
+    finally:
+        pool.shutdown()
+    plan.check_seconds = time.time() - start
+
+    # Find the tasks that can't run, and everything downstream of them
+    dependents = {}
+    for task_id, dep_ids in plan.requirements.items():
+        for dep_id in dep_ids:
+            dependents.setdefault(dep_id, []).append(task_id)
+    blocked_ids = set()
+    stack = [task_id for task_id, task in tasks.items()
+             if not is_complete[task_id] and (_is_external(task) or task in plan.errors)]
+    while stack:
+        task_id = stack.pop()
+        if task_id not in blocked_ids:
+            blocked_ids.add(task_id)
+            stack.extend(dependents.get(task_id, []))
+
+    for task_id in sorted(tasks):
+        task = tasks[task_id]
+        if is_complete[task_id]:
+            plan.complete.append(task)
+        elif task_id in blocked_ids:
+            plan.blocked.append(task)
+        elif all(is_complete[dep_id] for dep_id in plan.requirements[task_id]):
+            plan.ready.append(task)
+        else:
+            plan.pending.append(task)
+    return plan
+
+def _check_complete(task):
+    '''
+    Check whether a task is complete, returning the exception instead of
+    raising it, if the check fails.
+    '''
+    try:
+        return (bool(task.complete()), None)
+    except Exception as exc:
+        log.warning('Checking completeness of %s failed: %s', sciluigi.util.task_name(task), exc)
+        return (False, exc)
+
+def _requirements(workflow_task, task):
+    '''
+    Return the flattened list of tasks required by task. For the workflow task
+    itself, the tasks are taken from its workflow graph directly, to not set up
+    logging as requires() does.
+    '''
+    if task is workflow_task:
+        return luigi.task.flatten(workflow_task.get_workflow_output())
+    return luigi.task.flatten(task.requires())
+
+def _is_external(task):
+    '''
+    Check if a task is external, i.e. can not be run, the way luigi does it.
+    '''
+    return task.run is None or task.run == NotImplemented
@@ -0,0 +1,204 @@
+'''
+This module contains a background sampler of the resource usage of a process
+tree, reading from /proc (so only working on Linux).
+'''
+
+import logging
+import os
+import threading
+import time
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+PROC_DIR = '/proc'
+
+# ==============================================================================
+
+def read_proc_stats(proc_dir=PROC_DIR):
+    '''
+    Read the parent pid, command name, CPU ticks (user + system) and resident
+    set size (in kB) of all processes, as a dict of pid -> dict.
+    '''
+    page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+    stats = {}
+    for entry in os.listdir(proc_dir):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc_dir, entry, 'stat')) as statfile:
+                statline = statfile.read()
+        except (IOError, OSError):
+            # The process has exited
+            continue
+        # The command name is within parentheses, and may itself contain them
+        comm = statline[statline.index('(') + 1:statline.rindex(')')]
+        fields = statline[statline.rindex(')') + 2:].split()
+        stats[int(entry)] = {
+            'ppid': int(fields[1]),
+            'comm': comm,
+            'ticks': int(fields[11]) + int(fields[12]),
+            'rss_kb': int(fields[21]) * page_kb,
+        }
+    return stats
+
+def read_proc_io(pid, proc_dir=PROC_DIR):
+    '''
+    Read the bytes read from and written to storage by a process, or None if
+    not readable.
+    '''
+    try:
+        with open(os.path.join(proc_dir, str(pid), 'io')) as iofile:
+            values = dict(line.split(': ') for line in iofile.read().splitlines())
+        return int(values['read_bytes']), int(values['write_bytes'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+def descendants(stats, root_pid):
+    '''
+    Return the pids of all descendants of root_pid, given the output of
+    read_proc_stats().
+    '''
+    children = {}
+    for pid, stat in stats.items():
+        children.setdefault(stat['ppid'], []).append(pid)
+    found = []
+    stack = list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        found.append(pid)
+        stack.extend(children.get(pid, []))
+    return found
+
+# ==============================================================================
+
+class ProcessTreeSampler(object):
+    '''
+    Sample the resource usage of all descendant processes of a process (by
+    default the current one) at a fixed interval, in a background thread.
+    With commands_only set, only the processes registered with add_command(),
+    and their descendants, are sampled instead, so that processes started by
+    others in the same process (such as tasks in other threads) are left out.
+
+    Each sample is a dict with the time since start ('t'), the number of
+    processes ('procs'), their total resident set size ('rss_kb'), CPU usage
+    since the previous sample in percent of one core ('cpu_pct'), the bytes
+    read from and written to storage so far ('read_bytes', 'write_bytes'),
+    and the resident set size of the largest commands by name ('top').
+    '''
+    def __init__(self, root_pid=None, interval=1.0, top=5, proc_dir=PROC_DIR, commands_only=False):
+        self.root_pid = root_pid if root_pid is not None else os.getpid()
+        self.command_pids = set() if commands_only else None
+        self._command_lock = threading.Lock()
+        self.interval = interval
+        self.top = top
+        self.proc_dir = proc_dir
+        self.samples = []
+        self._ticks_per_sec = os.sysconf('SC_CLK_TCK')
+        # Last seen cumulative values per pid, also kept for exited processes
+        self._ticks = {}
+        self._io = {}
+        self._start = None
+        self._last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''
+        Start sampling in a background thread.
+        '''
+        if not os.path.isdir(self.proc_dir):
+            log.warning('Can not sample resource usage: %s not available', self.proc_dir)
+            return
+        self._start = time.time()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stop sampling, and return the samples taken.
+        '''
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        return self.samples
+
+    def add_command(self, pid):
+        '''
+        Start sampling the process tree of a command (with commands_only set).
+        '''
+        with self._command_lock:
+            self.command_pids.add(pid)
+
+    def remove_command(self, pid):
+        '''
+        Stop sampling the process tree of a command that has finished.
+        '''
+        with self._command_lock:
+            self.command_pids.discard(pid)
+
+    def _sampled_pids(self, stats):
+        '''
+        Return the pids of the processes to sample, given the output of
+        read_proc_stats().
+        '''
+        if self.command_pids is None:
+            return descendants(stats, self.root_pid)
+        with self._command_lock:
+            command_pids = [pid for pid in self.command_pids if pid in stats]
+        pids = []
+        for pid in command_pids:
+            pids.append(pid)
+            pids.extend(descendants(stats, pid))
+        return pids
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as exc:
+                log.warning('Resource sampling failed: %s', exc)
+            if self._stop.wait(self.interval):
+                break
+
+    def sample(self):
+        '''
+        Take one sample, add it to self.samples and return it.
+        '''
+        now = time.time()
+        if self._start is None:
+            self._start = now
+        stats = read_proc_stats(self.proc_dir)
+        pids = self._sampled_pids(stats)
+
+        rss_by_comm = {}
+        for pid in pids:
+            stat = stats[pid]
+            self._ticks[pid] = stat['ticks']
+            rss_by_comm[stat['comm']] = rss_by_comm.get(stat['comm'], 0) + stat['rss_kb']
+            proc_io = read_proc_io(pid, self.proc_dir)
+            if proc_io is not None:
+                self._io[pid] = proc_io
+        total_ticks = sum(self._ticks.values())
+
+        cpu_pct = 0.0
+        if self._last is not None and now > self._last[0]:
+            cpu_sec = float(total_ticks - self._last[1]) / self._ticks_per_sec
+            cpu_pct = 100.0 * cpu_sec / (now - self._last[0])
+        self._last = (now, total_ticks)
+
+        top = sorted(rss_by_comm.items(), key=lambda item: -item[1])[:self.top]
+        sample = {
+            't': round(now - self._start, 3),
+            'procs': len(pids),
+            'rss_kb': sum(stats[pid]['rss_kb'] for pid in pids),
+            'cpu_pct': round(cpu_pct, 1),
+            'read_bytes': sum(rbytes for rbytes, _ in self._io.values()),
+            'write_bytes': sum(wbytes for _, wbytes in self._io.values()),
+            'top': dict(top),
+        }
+        self.samples.append(sample)
+        return sample
@@ -0,0 +1,270 @@
+'''
+This module contains functionality for accounting for the cores and memory
+in use on the local node, within the node's budget, across all luigi worker
+processes (and workflows) sharing a slots folder.
+
+Tasks of workflows are held back by luigi's scheduler until they fit, through
+the cores and mem_mb resources they declare (see Task.process_resources()),
+and take their slots without waiting, for accounting. Other callers can wait
+for their slots with acquire().
+
+The tasks holding slots, and the tasks waiting for them, are kept in a state
+file in the slots folder, updated under a lock. Slots held by processes that
+no longer exist are freed. A task that does not fit waits, and is overtaken
+by smaller tasks that fit, but only until it has waited for starvation_sec
+seconds, after which no newer task is admitted before it.
+
+Every change in the slots in use is appended to an events file, from which
+the utilisation of the budget over a period of time is computed. Status and
+utilisation can also be shown from the commandline:
+
+    python -m sciluigi.slots <slots folder> [--since <unix time>]
+'''
+
+import argparse
+import json
+import logging
+import os
+import time
+import uuid
+import sciluigi.util
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Folder for the state and events of the slots of the node
+SLOTS_DIR = '.sciluigi/node_slots'
+# Seconds between checks whether a waiting task fits
+POLL_INTERVAL = 0.5
+# Seconds after which a waiting task is no longer overtaken by newer ones
+STARVATION_SEC = 60.0
+
+# ==============================================================================
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        # EPERM means that the process exists, but belongs to someone else
+        return exc.errno == 1
+    return True
+
+class NodeSlotScheduler(object):
+    '''
+    Admit tasks within a budget of cores and memory (see the module
+    docstring). A mem_mb of None means no memory budget.
+    '''
+    def __init__(self, cores, mem_mb=None, slotsdir=SLOTS_DIR, poll_interval=POLL_INTERVAL,
+                 starvation_sec=STARVATION_SEC):
+        self.cores = int(cores)
+        self.mem_mb = int(mem_mb) if mem_mb is not None else None
+        self.slotsdir = os.path.abspath(slotsdir)
+        self.poll_interval = poll_interval
+        self.starvation_sec = starvation_sec
+        self.statepath = os.path.join(self.slotsdir, 'state.json')
+        self.eventspath = os.path.join(self.slotsdir, 'events.jsonl')
+        sciluigi.util.ensuredir(self.slotsdir)
+
+    def acquire(self, name, cores=1, mem_mb=0, wait=True):
+        '''
+        Wait until the cores and memory fit within the budget, and take them.
+        Requests larger than the whole budget are cut down to it, and so run
+        alone. If wait is False, they are taken right away, also beyond the
+        budget, for accounting only. Returns a token for release().
+        '''
+        cores = min(max(1, int(cores)), self.cores)
+        mem_mb = int(mem_mb or 0)
+        if self.mem_mb is not None:
+            mem_mb = min(mem_mb, self.mem_mb)
+        token = uuid.uuid4().hex
+        entry = {'name': name, 'cores': cores, 'mem_mb': mem_mb, 'pid': os.getpid(),
+                 'since': time.time()}
+        waiting = False
+        while True:
+            with self._state() as state:
+                if not wait or self._fits(state, token, entry):
+                    state['waiting'].pop(token, None)
+                    entry['since'] = time.time()
+                    state['running'][token] = entry
+                    self._write_event(state)
+                    return token
+                if not waiting:
+                    log.info('Task %s waits for %d cores and %dMB of memory', name, cores, mem_mb)
+                    state['waiting'][token] = entry
+                    waiting = True
+            time.sleep(self.poll_interval)
+
+    def release(self, token):
+        '''
+        Free the cores and memory taken with the given token.
+        '''
+        with self._state() as state:
+            if state['running'].pop(token, None) is not None:
+                self._write_event(state)
+
+    def _fits(self, state, token, entry):
+        in_use = _totals(state['running'])
+        if in_use['cores'] + entry['cores'] > self.cores:
+            return False
+        if self.mem_mb is not None and in_use['mem_mb'] + entry['mem_mb'] > self.mem_mb:
+            return False
+        # Not before tasks that have waited too long to be overtaken
+        now = time.time()
+        for other_token, other in state['waiting'].items():
+            if other_token != token and other['since'] < entry['since'] \
+                    and now - other['since'] >= self.starvation_sec:
+                return False
+        return True
+
+    def _state(self):
+        return _StateFile(self.statepath)
+
+    def _write_event(self, state):
+        totals = _totals(state['running'])
+        event = {'time': time.time(), 'cores': totals['cores'], 'mem_mb': totals['mem_mb'],
+                 'tasks': len(state['running'])}
+        with open(self.eventspath, 'a') as eventsfile:
+            eventsfile.write(json.dumps(event) + '\n')
+
+    def status(self):
+        '''
+        Return the tasks holding and waiting for slots, as dicts of token ->
+        dict with name, cores, mem_mb, pid and since (the time of admission or
+        of starting to wait).
+        '''
+        with self._state() as state:
+            return {'running': dict(state['running']), 'waiting': dict(state['waiting'])}
+
+    def utilisation(self, since=None, until=None):
+        '''
+        Return the average and peak cores and memory in use between since and
+        until (by default from the first event until now), and the average
+        share of the budget in use.
+        '''
+        return utilisation(read_events(self.eventspath), self.cores, self.mem_mb, since, until)
+
+class _StateFile(object):
+    '''
+    The state of the slots, read and locked within a with statement, and
+    written back at the end of it, with the slots of dead processes freed.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._lock = sciluigi.util.FileLock(path + '.lock')
+        self.state = None
+
+    def __enter__(self):
+        self._lock.__enter__()
+        try:
+            with open(self.path) as statefile:
+                self.state = json.load(statefile)
+        except (IOError, ValueError):
+            self.state = {'running': {}, 'waiting': {}}
+        for kind in ['running', 'waiting']:
+            for token, entry in list(self.state[kind].items()):
+                if not _process_exists(entry['pid']):
+                    log.warning('Freeing slots of task %s, as its process %d is gone',
+                                entry['name'], entry['pid'])
+                    del self.state[kind][token]
+        return self.state
+
+    def __exit__(self, *args):
+        try:
+            if args[0] is None:
+                sciluigi.util.write_atomically(self.path, json.dumps(self.state))
+        finally:
+            self._lock.__exit__(*args)
+
+def _totals(entries):
+    return {'cores': sum(entry['cores'] for entry in entries.values()),
+            'mem_mb': sum(entry['mem_mb'] for entry in entries.values())}
+
+# ==============================================================================
+
+def read_events(path):
+    '''
+    Read the events of a slots folder, oldest first.
+    '''
+    events = []
+    if not os.path.exists(path):
+        return events
+    with open(path) as eventsfile:
+        for line in eventsfile:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return sorted(events, key=lambda event: event['time'])
+
+def utilisation(events, cores, mem_mb=None, since=None, until=None):
+    '''
+    Compute the time-weighted average and the peak of the cores and memory
+    in use, from events of the total in use after each change.
+    '''
+    if until is None:
+        until = time.time()
+    if since is None:
+        since = events[0]['time'] if events else until
+    current = {'cores': 0, 'mem_mb': 0}
+    area = {'cores': 0.0, 'mem_mb': 0.0}
+    peak = {'cores': 0, 'mem_mb': 0}
+    last = since
+    for event in events + [{'time': until}]:
+        if event['time'] > since:
+            end = min(event['time'], until)
+            for key in area:
+                area[key] += current[key] * max(0.0, end - last)
+                peak[key] = max(peak[key], current[key])
+            last = end
+        if event['time'] >= until:
+            break
+        if 'cores' in event:
+            current = {'cores': event['cores'], 'mem_mb': event['mem_mb']}
+    duration = until - since
+    result = {'seconds': duration, 'cores_budget': cores, 'mem_mb_budget': mem_mb,
+              'peak_cores': peak['cores'], 'peak_mem_mb': peak['mem_mb']}
+    for key in area:
+        result['avg_' + key] = area[key] / duration if duration > 0 else 0.0
+    result['cores_utilisation'] = result['avg_cores'] / cores if cores else None
+    result['mem_utilisation'] = result['avg_mem_mb'] / mem_mb if mem_mb else None
+    return result
+
+def format_utilisation(stats):
+    '''
+    Format utilisation statistics as a one-line summary.
+    '''
+    summary = 'cores: %.1f of %d in use on average (%.0f%%), peak %d' % (
+        stats['avg_cores'], stats['cores_budget'], 100 * stats['cores_utilisation'],
+        stats['peak_cores'])
+    if stats['mem_mb_budget']:
+        summary += '; memory: %.0fMB of %dMB in use on average (%.0f%%), peak %dMB' % (
+            stats['avg_mem_mb'], stats['mem_mb_budget'], 100 * stats['mem_utilisation'],
+            stats['peak_mem_mb'])
+    return summary + ' (over %.1fs)' % stats['seconds']
+
+# ==============================================================================
+
+def main(args=None):
+    '''
+    Commandline interface, showing the status and utilisation of a slots folder.
+    '''
+    parser = argparse.ArgumentParser(description='Show the status of sciluigi node slots')
+    parser.add_argument('slotsdir', nargs='?', default=SLOTS_DIR, help='Slots folder')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='Cores in the budget')
+    parser.add_argument('--mem-mb', type=int, help='Memory in the budget, in megabytes')
+    parser.add_argument('--since', type=float, help='Start of the period for utilisation (unix time)')
+    opts = parser.parse_args(args)
+
+    scheduler = NodeSlotScheduler(opts.cores, opts.mem_mb, opts.slotsdir)
+    status = scheduler.status()
+    for kind in ['running', 'waiting']:
+        print('%s:' % kind.capitalize())
+        for entry in sorted(status[kind].values(), key=lambda entry: entry['since']):
+            print('  %s: %d cores, %dMB (pid %d, since %s)' % (
+                entry['name'], entry['cores'], entry['mem_mb'], entry['pid'],
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['since']))))
+    print('Utilisation: ' + format_utilisation(scheduler.utilisation(since=opts.since)))
+
+if __name__ == '__main__':
+    main()
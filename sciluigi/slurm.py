@@ -3,11 +3,19 @@ This module contains functionality related to integration with the SLURM HPC
 resource manger.
 '''
 
-import datetime
 import logging
+import os
 import re
+import threading
 import time
+import uuid
 import sciluigi.parameter
+import sciluigi.slurmacct
+import sciluigi.slurmestimate
+import sciluigi.slurmarray
+import sciluigi.slurmpoll
+import sciluigi.slurmpool
+import sciluigi.util
 import sciluigi.task
 import subprocess as sub
 
@@ -20,6 +28,39 @@ log = logging.getLogger('sciluigi-interface')
 RUNMODE_LOCAL = 'runmode_local'
 RUNMODE_HPC = 'runmode_hpc'
 RUNMODE_MPI = 'runmode_mpi'
+# Run commands as elements of SLURM job arrays, shared between tasks with the
+# same SLURM info (see sciluigi.slurmarray)
+RUNMODE_HPC_ARRAY = 'runmode_hpc_array'
+# Submit commands with sbatch, and wait for them with a poller shared by all
+# tasks, instead of holding a blocking salloc per command (see sciluigi.slurmpoll)
+RUNMODE_HPC_SBATCH = 'runmode_hpc_sbatch'
+# Run commands as job steps in a pool of long-lived allocations (pilot jobs),
+# shared between tasks with the same SLURM info (see sciluigi.slurmpool)
+RUNMODE_HPC_POOL = 'runmode_hpc_pool'
+
+# Names of the executors that run commands in each runmode (see sciluigi.executor)
+RUNMODE_EXECUTORS = {
+    RUNMODE_LOCAL: 'local',
+    RUNMODE_HPC: 'salloc',
+    RUNMODE_MPI: 'salloc_mpi',
+    RUNMODE_HPC_ARRAY: 'slurm_array',
+    RUNMODE_HPC_SBATCH: 'sbatch',
+    RUNMODE_HPC_POOL: 'slurm_pool',
+}
+
+# Guards the list of accounting requests of tasks
+_accounting_lock = threading.Lock()
+# Guards the estimation of the resources of tasks
+_estimate_lock = threading.Lock()
+
+# Job id in salloc output, such as "salloc: Granted job allocation 5836263"
+SALLOC_JOBID_PATTERN = re.compile(r'[Jj]ob allocation ([0-9]+)')
+
+# Script submitted with sbatch in RUNMODE_HPC_SBATCH
+SBATCH_SCRIPT = '''#!/bin/bash
+cd {cwd}
+{launcher} bash {cmdpath}
+'''
 
 # ================================================================================
 
@@ -27,15 +68,16 @@ class SlurmInfo():
     '''
     A data object for keeping slurm run parameters.
     '''
-    runmode = None # One of RUNMODE_LOCAL|RUNMODE_HPC|RUNMODE_MPI
+    runmode = None # One of the RUNMODE_* constants above
     project = None
     partition = None
     cores = None
     time = None
     jobname = None
     threads = None
+    mem = None # Memory in megabytes, or None to use the partition's default
 
-    def __init__(self, runmode, project, partition, cores, time, jobname, threads):
+    def __init__(self, runmode, project, partition, cores, time, jobname, threads, mem=None):
         '''
         Init a SlurmInfo object, from string data.
         Time is on format: [[[d-]HH:]MM:]SS
@@ -47,6 +89,7 @@ class SlurmInfo():
         self.time = time
         self.jobname = jobname
         self.threads = threads
+        self.mem = mem
 
     def __str__(self):
         '''
@@ -57,40 +100,71 @@ class SlurmInfo():
                    'cores: {c}, '
                    'threads: {thr}, '
                    'jobname: {j}, '
-                   'project: {pr})').format(
+                   'project: {pr}{m})').format(
                 t=self.time,
                 pt=self.partition,
                 c=self.cores,
                 thr=self.threads,
                 j=self.jobname,
-                pr=self.project)
+                pr=self.project,
+                m=', mem: %sM' % self.mem if self.mem else '')
         return strrepr
 
+    def get_mem_arg(self):
+        '''
+        Return the --mem option flag, if a memory size is set.
+        '''
+        if self.mem:
+            return ' --mem={m}M'.format(m=self.mem)
+        return ''
+
     def get_argstr_hpc(self):
         '''
         Return a formatted string with arguments and option flags to SLURM
         commands such as salloc and sbatch, for non-MPI, HPC jobs.
         '''
-        argstr = ' -A {pr} -p {pt} -n {c} -t {t} -J {j} srun -n 1 -c {thr} '.format(
+        argstr = ' -A {pr} -p {pt} -n {c} -t {t} -J {j}{m} srun -n 1 -c {thr} '.format(
                 pr=self.project,
                 pt=self.partition,
                 c=self.cores,
                 t=self.time,
                 j=self.jobname,
+                m=self.get_mem_arg(),
                 thr=self.threads)
         return argstr
 
+    def get_sbatch_args(self, time=None):
+        '''
+        Return a formatted string with the option flags for allocating the
+        resources of a job with sbatch, for non-MPI, HPC jobs. A time limit
+        other than the one of the SLURM info can be given with time.
+        '''
+        return '-A {pr} -p {pt} -n {c} -t {t} -J {j}{m}'.format(
+                pr=self.project,
+                pt=self.partition,
+                c=self.cores,
+                t=time or self.time,
+                j=self.jobname,
+                m=self.get_mem_arg())
+
+    def get_launcher_hpc(self):
+        '''
+        Return the command that launches a non-MPI command within a job.
+        '''
+        return 'srun -n 1 -c {thr}'.format(thr=self.threads)
+
     def get_argstr_mpi(self):
         '''
         Return a formatted string with arguments and option flags to SLURM
         commands such as salloc and sbatch, for MPI jobs.
         '''
-        argstr = ' -A {pr} -p {pt} -n {c1} -t {t} -J {j} mpirun -v -np {c2} '.format(
+        argstr = ' -A {pr} -p {pt} -n {c1} -t {t} -J {j}{m} mpirun -v -np {c2} '.format(
                 pr=self.project,
                 pt=self.partition,
                 c1=self.cores,
                 t=self.time,
                 j=self.jobname,
+                m=self.get_mem_arg(),
                 c2=self.cores)
         return argstr
 
@@ -114,6 +188,40 @@ class SlurmHelpers():
     '''
     # Other class-fields
     slurminfo = SlurmInfoParameter(default=None) # Class: SlurmInfo
+    # Job id and execution time in SLURM of the last command executed via SLURM
+    # (with ex_hpc() and ex_mpi(), the execution time is known only once the
+    # task has finished)
+    slurm_jobid = None
+    slurm_exectime_sec = None
+    # Seconds to wait, when the task finishes, for the accounting records of
+    # jobs run with ex_hpc() and ex_mpi()
+    slurm_accounting_timeout = sciluigi.slurmacct.MAX_WAIT_SECONDS
+    _slurm_accounting = None
+
+    # Seconds to wait for commands of other tasks to add to the same job array,
+    # and between looking up the state of job arrays, in RUNMODE_HPC_ARRAY
+    array_gather_seconds = sciluigi.slurmarray.GATHER_SECONDS
+    array_poll_interval = sciluigi.slurmarray.POLL_INTERVAL
+    # Seconds between looking up the state of jobs, and seconds after a job
+    # has left the queue to give up on getting its accounting record, in
+    # RUNMODE_HPC_SBATCH
+    sbatch_poll_interval = sciluigi.slurmpoll.POLL_INTERVAL
+    sbatch_max_wait_seconds = sciluigi.slurmpoll.MAX_WAIT_SECONDS
+    # Largest number of pilot jobs, seconds a pilot job stays without commands
+    # to run, time limit of pilot jobs (or the time of the SLURM info, if that
+    # is longer), how pilot jobs are started (sciluigi.slurmpool.LAUNCH_LOCAL
+    # runs the agents as local processes instead), and seconds to wait for a
+    # command, including time in the queue, in RUNMODE_HPC_POOL
+    pool_max_agents = sciluigi.slurmpool.MAX_AGENTS
+    pool_idle_seconds = sciluigi.slurmpool.IDLE_SECONDS
+    pool_agent_time = sciluigi.slurmpool.AGENT_TIME
+    pool_launch = sciluigi.slurmpool.LAUNCH_SBATCH
+    pool_timeout_seconds = sciluigi.slurmpool.TIMEOUT_SECONDS
+    # Set to a sciluigi.slurmestimate.SlurmResourceEstimator, to run jobs with
+    # the time, cores and memory estimated from earlier runs of the workflow,
+    # instead of the ones in the SLURM info
+    slurm_estimator = None
+    _estimated_slurminfo = None
 
     # Main Execution methods
     def ex(self, command):
@@ -123,15 +231,56 @@ class SlurmHelpers():
         if isinstance(command, list):
             command = ' '.join(command)
 
-        if self.slurminfo.runmode == RUNMODE_LOCAL:
-            log.info('Executing command in local mode: %s', command)
-            self.ex_local(command) # Defined in task.py
-        elif self.slurminfo.runmode == RUNMODE_HPC:
-            log.info('Executing command in HPC mode: %s', command)
-            self.ex_hpc(command)
-        elif self.slurminfo.runmode == RUNMODE_MPI:
-            log.info('Executing command in MPI mode: %s', command)
-            self.ex_mpi(command)
+        executor = self.get_executor()
+        log.info('Executing command with %s: %s', executor.__class__.__name__, command)
+        return executor.execute(self, command)
+
+    def get_default_executor(self):
+        '''
+        Return the name of the executor matching the runmode of the SLURM info.
+        '''
+        if self.slurminfo.runmode not in RUNMODE_EXECUTORS:
+            raise Exception('Unknown runmode: %s' % self.slurminfo.runmode)
+        return RUNMODE_EXECUTORS[self.slurminfo.runmode]
+
+    def get_max_concurrency(self):
+        '''
+        Run at most as many commands at once in ex_many() as the number of
+        threads in the SLURM info.
+        '''
+        if self.slurminfo is not None and self.slurminfo.threads:
+            return int(self.slurminfo.threads)
+        return super(SlurmHelpers, self).get_max_concurrency()
+
+    def get_local_resources(self):
+        '''
+        Return the cores and memory the task uses on the local node: the ones
+        declared by the task, or else the threads and memory of the SLURM
+        info, in RUNMODE_LOCAL. Other runmodes run commands elsewhere.
+        '''
+        if self.slurminfo is None or self.slurminfo.runmode != RUNMODE_LOCAL:
+            return None
+        return (int(self.cores or self.slurminfo.threads or 1),
+                int(self.mem_mb or self.slurminfo.mem or 0))
+
+    def get_slurminfo(self):
+        '''
+        Return the SLURM info to run jobs with: the one given to the task, or
+        if slurm_estimator is set, a copy with the resources estimated from
+        earlier runs. The estimate, and the reasoning behind it, are logged
+        and written to the audit log once per task.
+        '''
+        if self.slurm_estimator is None or self.slurminfo.runmode == RUNMODE_LOCAL:
+            return self.slurminfo
+        with _estimate_lock:
+            if self._estimated_slurminfo is None:
+                estimate = self.slurm_estimator.estimate(
+                    self.workflow_task.get_audit_history(), self.task_family, self.param_kwargs)
+                self._estimated_slurminfo = estimate.apply(self.slurminfo)
+                log.info('Estimated SLURM resources for task %s: %s (%s)', self.instance_name,
+                         self._estimated_slurminfo, '; '.join(estimate.reasons))
+                self.add_auditinfo('slurm_estimate', estimate.to_dict())
+            return self._estimated_slurminfo
 
 
     def ex_hpc(self, command):
@@ -141,11 +290,7 @@ class SlurmHelpers():
         if isinstance(command, list):
             command = sub.list2cmdline(command)
 
-        fullcommand = 'salloc %s %s' % (self.slurminfo.get_argstr_hpc(), command)
-        (retcode, stdout, stderr) = self.ex_local(fullcommand)
-
-        self.log_slurm_info(stderr)
-        return (retcode, stdout, stderr)
+        return self._ex_salloc('ex_hpc', self.get_slurminfo().get_argstr_hpc(), command)
 
 
     def ex_mpi(self, command):
@@ -155,10 +300,170 @@ class SlurmHelpers():
         if isinstance(command, list):
             command = sub.list2cmdline(command)
 
-        fullcommand = 'salloc %s %s' % (self.slurminfo.get_argstr_mpi(), command)
+        return self._ex_salloc('ex_mpi', self.get_slurminfo().get_argstr_mpi(), command)
+
+    def ex_hpc_array(self, command):
+        '''
+        Execute command in HPC mode, as an element of a job array shared with
+        other tasks with the same SLURM info, and wait for it to finish.
+        '''
+        if isinstance(command, list):
+            command = sub.list2cmdline(command)
+
+        slurminfo = self.get_slurminfo()
+        runner = sciluigi.slurmarray.SlurmArrayRunner(
+            slurminfo.get_sbatch_args(),
+            slurminfo.get_launcher_hpc(),
+            gather_seconds=self.array_gather_seconds,
+            poll_interval=self.array_poll_interval)
+        start = time.time()
+        result = runner.run(command)
+        self.slurm_jobid = result.jobid
+        self.slurm_exectime_sec = result.exectime_sec
+        self.add_auditinfo('slurm_jobid', result.jobid)
+        if result.exectime_sec is not None:
+            self.add_auditinfo('slurm_exectime_sec', result.exectime_sec)
+        self.trace_command('ex_hpc_array', command, start, time.time(), retcode=result.retcode,
+                           slurm_exectime_sec=result.exectime_sec, slurm_jobid=result.jobid)
+
+        if result.retcode != 0:
+            errmsg = ('Command failed in job array element {jobid} ({status}): {cmd}\n'
+                      'Command output: {out}\n'
+                      'Command stderr: {err}').format(
+                    jobid=result.jobid,
+                    status='state ' + result.state if result.state else 'retcode %s' % result.retcode,
+                    cmd=command,
+                    out=result.stdout,
+                    err=result.stderr)
+            log.error(errmsg)
+            raise sciluigi.task.CommandFailedException(errmsg, result.retcode,
+                                                       result.stdout, result.stderr)
+        return (result.retcode, result.stdout, result.stderr)
+
+    def ex_hpc_sbatch(self, command):
+        '''
+        Execute command in HPC mode, by submitting it with sbatch, and waiting
+        for the job to finish with the poller shared by all tasks.
+        '''
+        if isinstance(command, list):
+            command = sub.list2cmdline(command)
+
+        slurminfo = self.get_slurminfo()
+        basepath = self.get_cmdlog_path('sbatch_' + uuid.uuid4().hex[:12])
+        sciluigi.util.ensuredir(os.path.dirname(basepath))
+        with open(basepath + '.cmd', 'w') as cmdfile:
+            cmdfile.write(command + '\n')
+        with open(basepath + '.sh', 'w') as scriptfile:
+            scriptfile.write(SBATCH_SCRIPT.format(cwd=os.getcwd(), cmdpath=basepath + '.cmd',
+                                                  launcher=slurminfo.get_launcher_hpc()))
+
+        start = time.time()
+        (_, sbatch_stdout, _) = self.ex_local(
+            'sbatch --parsable -o {out} -e {err} {args} {script}'.format(
+                out=basepath + '.out', err=basepath + '.err',
+                args=slurminfo.get_sbatch_args(), script=basepath + '.sh'))
+        jobid = sciluigi.util.parse_sbatch_jobid(sbatch_stdout)
+        log.info('Submitted job %s for task %s: %s', jobid, self.instance_name, command)
+        poller = sciluigi.slurmpoll.get_poller(interval=self.sbatch_poll_interval,
+                                               max_wait_seconds=self.sbatch_max_wait_seconds)
+        result = poller.watch(jobid).wait()
+
+        outputs = []
+        for ext in ['.out', '.err']:
+            # Missing for jobs that never started
+            if os.path.exists(basepath + ext):
+                with open(basepath + ext, 'rb') as outfile:
+                    outputs.append(outfile.read())
+            else:
+                outputs.append(b'')
+        stdout, stderr = outputs
+
+        self.slurm_jobid = jobid
+        self.slurm_exectime_sec = result.elapsed_sec
+        self.add_auditinfo('slurm_jobid', jobid)
+        if result.elapsed_sec is not None:
+            self.add_auditinfo('slurm_exectime_sec', int(result.elapsed_sec))
+        self._add_slurm_usage(result)
+        self.trace_command('ex_hpc_sbatch', command, start, time.time(), retcode=result.exitcode,
+                           slurm_exectime_sec=result.elapsed_sec, slurm_jobid=jobid)
+
+        if result.state != 'COMPLETED' or result.exitcode != 0:
+            errmsg = ('Command failed in job {jobid} (state {state}, retcode {ret}): {cmd}\n'
+                      'Command output: {out}\n'
+                      'Command stderr: {err}').format(
+                    jobid=jobid,
+                    state=result.state,
+                    ret=result.exitcode,
+                    cmd=command,
+                    out=stdout,
+                    err=stderr)
+            log.error(errmsg)
+            raise sciluigi.task.CommandFailedException(errmsg, result.exitcode, stdout, stderr)
+        return (result.exitcode, stdout, stderr)
+
+    def ex_hpc_pool(self, command):
+        '''
+        Execute command in HPC mode, as a job step in one of the pilot jobs of
+        the pool shared by tasks with the same SLURM info, and wait for it to
+        finish. Each pilot job runs as many commands at once as the threads of
+        the SLURM info fit in its cores.
+        '''
+        if isinstance(command, list):
+            command = sub.list2cmdline(command)
+
+        slurminfo = self.get_slurminfo()
+        command_seconds = sciluigi.slurmpool.parse_time_limit(slurminfo.time)
+        agent_time = self.pool_agent_time or slurminfo.time
+        agent_seconds = sciluigi.slurmpool.parse_time_limit(agent_time)
+        if agent_seconds is None or (command_seconds is not None and agent_seconds < command_seconds):
+            agent_time, agent_seconds = slurminfo.time, command_seconds
+        pool = sciluigi.slurmpool.SlurmPool(
+            slurminfo.get_sbatch_args(time=agent_time),
+            slurminfo.get_launcher_hpc(),
+            slots=int(slurminfo.cores) // max(1, int(slurminfo.threads)),
+            max_agents=self.pool_max_agents,
+            idle_seconds=self.pool_idle_seconds,
+            launch=self.pool_launch,
+            agent_seconds=agent_seconds,
+            command_seconds=command_seconds,
+            timeout=self.pool_timeout_seconds)
+        start = time.time()
+        result = pool.run(command)
+        self.slurm_exectime_sec = result.exectime_sec
+        self.add_auditinfo('slurm_pool_agent', result.agentid)
+        self.add_auditinfo('slurm_pool_wait_sec', '%.3f' % result.wait_sec)
+        self.add_auditinfo('slurm_exectime_sec', int(result.exectime_sec))
+        self.trace_command('ex_hpc_pool', command, start, time.time(), retcode=result.retcode,
+                           slurm_exectime_sec=result.exectime_sec, slurm_pool_agent=result.agentid)
+
+        if result.retcode != 0:
+            errmsg = ('Command failed in pool agent {agent} (retcode {ret}): {cmd}\n'
+                      'Command output: {out}\n'
+                      'Command stderr: {err}').format(
+                    agent=result.agentid,
+                    ret=result.retcode,
+                    cmd=command,
+                    out=result.stdout,
+                    err=result.stderr)
+            log.error(errmsg)
+            raise sciluigi.task.CommandFailedException(errmsg, result.retcode,
+                                                       result.stdout, result.stderr)
+        return (result.retcode, result.stdout, result.stderr)
+
+    def _ex_salloc(self, kind, argstr, command):
+        '''
+        Execute command through salloc, log the SLURM job info, and record the
+        command for the execution trace, with the time spent executing in SLURM
+        (the rest being time waiting in the queue) once known.
+        '''
+        start = time.time()
+        fullcommand = 'salloc %s %s' % (argstr, command)
         (retcode, stdout, stderr) = self.ex_local(fullcommand)
+        end = time.time()
 
-        self.log_slurm_info(stderr)
+        # The job id and time spent executing are filled in by log_slurm_info()
+        trace_entry = self.trace_command(kind, command, start, end, retcode=retcode)
+        self.log_slurm_info(stderr, trace_entry)
         return (retcode, stdout, stderr)
 
 
@@ -181,59 +486,74 @@ class SlurmHelpers():
     #def get_task_config(self, name):
     #    return luigi.configuration.get_config().get(self.task_family, name)
 
-    def log_slurm_info(self, slurm_stderr):
+    def log_slurm_info(self, slurm_stderr, trace_entry=None):
         '''
-        Parse information of the following example form:
+        Find the job id in salloc output of the following example form, write
+        it to the audit log, and request the job's accounting record (elapsed
+        time, total CPU time, peak memory and state) from the accounting
+        collector shared within the process. The record is written to the
+        audit log when the task finishes (see collect_final_auditinfo()).
+        If given, the job id and execution time are also added to trace_entry.
+        Returns the accounting request, or None if no job id was found.
 
         salloc: Granted job allocation 5836263
         srun: Job step created
         salloc: Relinquishing job allocation 5836263
         salloc: Job allocation 5836263 has been revoked.
         '''
-
-        matches = re.search('[0-9]+', str(slurm_stderr))
-        if matches:
-            jobid = matches.group(0)
-
-            # Write slurm execution time to audit log
-            cmd = 'sacct -j {jobid} --noheader --format=elapsed'.format(jobid=jobid)
-            (_, jobinfo_stdout, _) = self.ex_local(cmd)
-            sacct_matches = re.findall('([0-9\:\-]+)', str(jobinfo_stdout))
-
-            if len(sacct_matches) < 2:
-                log.warn('Not enough matches from sacct for task %s: %s',
-                    self.instance_name, ', '.join(['Match: %s' % m for m in sacct_matches])
-                    )
-            else:
-                slurm_exectime_fmted = sacct_matches[1]
-                # Date format needs to be handled differently if the days field is included
-                if '-' in slurm_exectime_fmted:
-                    tobj = time.strptime(slurm_exectime_fmted, '%d-%H:%M:%S')
-                    self.slurm_exectime_sec = int(datetime.timedelta(
-                        tobj.tm_mday,
-                        tobj.tm_sec,
-                        0,
-                        0,
-                        tobj.tm_min,
-                        tobj.tm_hour).total_seconds())
-                else:
-                    tobj = time.strptime(slurm_exectime_fmted, '%H:%M:%S')
-                    self.slurm_exectime_sec = int(datetime.timedelta(
-                        0,
-                        tobj.tm_sec,
-                        0,
-                        0,
-                        tobj.tm_min,
-                        tobj.tm_hour).total_seconds())
-
+        if isinstance(slurm_stderr, bytes):
+            slurm_stderr = slurm_stderr.decode('utf-8', 'replace')
+        matches = SALLOC_JOBID_PATTERN.search(str(slurm_stderr))
+        if not matches:
+            log.warning('No job id found in SLURM output of task %s', self.instance_name)
+            return None
+        jobid = matches.group(1)
+        self.slurm_jobid = jobid
+        self.add_auditinfo('slurm_jobid', jobid)
+        if trace_entry is not None:
+            trace_entry['slurm_jobid'] = jobid
+        request = sciluigi.slurmacct.get_collector().request(jobid)
+        with _accounting_lock:
+            if self._slurm_accounting is None:
+                self._slurm_accounting = []
+            self._slurm_accounting.append((request, trace_entry))
+        return request
+
+    def collect_final_auditinfo(self):
+        '''
+        Wait for the accounting records of the task's SLURM jobs (at most
+        slurm_accounting_timeout seconds), and write them to the audit log.
+        '''
+        with _accounting_lock:
+            accounting = self._slurm_accounting or []
+            self._slurm_accounting = None
+        deadline = time.time() + self.slurm_accounting_timeout
+        for request, trace_entry in accounting:
+            record = request.wait(max(0.0, deadline - time.time()))
+            if record is None:
+                log.warning('No accounting record of SLURM job %s for task %s',
+                            request.jobid, self.instance_name)
+                continue
+            if record.elapsed_sec is not None:
+                self.slurm_exectime_sec = int(record.elapsed_sec)
                 log.info('Slurm execution time for task %s was %ss',
-                    self.instance_name,
-                    self.slurm_exectime_sec)
-                self.add_auditinfo('slurm_exectime_sec', int(self.slurm_exectime_sec))
-
-            # Write this last, so as to get the main task exectime and slurm exectime together in
-            # audit log later
-            self.add_auditinfo('slurm_jobid', jobid)
+                         self.instance_name, self.slurm_exectime_sec)
+                self.add_auditinfo('slurm_exectime_sec', self.slurm_exectime_sec)
+            self._add_slurm_usage(record)
+            if trace_entry is not None:
+                trace_entry['slurm_exectime_sec'] = record.elapsed_sec
+        super(SlurmHelpers, self).collect_final_auditinfo()
+
+    def _add_slurm_usage(self, record):
+        '''
+        Write the state, total CPU time and peak memory use of a SLURM job to
+        the audit log.
+        '''
+        self.add_auditinfo('slurm_state', record.state)
+        if record.totalcpu_sec is not None:
+            self.add_auditinfo('slurm_totalcpu_sec', '%.3f' % record.totalcpu_sec)
+        if record.maxrss_kb is not None:
+            self.add_auditinfo('slurm_maxrss_kb', record.maxrss_kb)
 
 # ================================================================================
 
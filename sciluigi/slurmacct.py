@@ -0,0 +1,258 @@
+'''
+This module contains functionality for looking up SLURM accounting records
+(state, elapsed time, total CPU time and peak memory of jobs) with sacct.
+
+A collector shared within the process gathers the job ids that tasks ask
+about, and looks them up in batches, with one sacct call per batch. Results
+for finished jobs are cached, and handed to the tasks asynchronously, so that
+tasks do not have to wait for the lookup after each command.
+'''
+
+import logging
+import os
+import subprocess as sub
+import threading
+import time
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Fields looked up with sacct
+SACCT_FIELDS = ['JobID', 'State', 'ExitCode', 'Elapsed', 'TotalCPU', 'MaxRSS']
+# Seconds to gather job ids before looking them up
+BATCH_SECONDS = 1.0
+# Seconds between lookups of jobs that are not yet finished in the accounting
+# database (which can lag behind the job itself)
+RETRY_SECONDS = 5.0
+# Seconds after which to give up on jobs that are not reported as finished
+MAX_WAIT_SECONDS = 120.0
+
+# Job states in which a job will not run any further
+FINAL_STATES = set(['COMPLETED', 'FAILED', 'CANCELLED', 'TIMEOUT', 'NODE_FAIL', 'PREEMPTED',
+                    'BOOT_FAIL', 'DEADLINE', 'OUT_OF_MEMORY', 'REVOKED'])
+
+# ==============================================================================
+
+def parse_duration(duration):
+    '''
+    Parse a SLURM duration on the form [[D-]HH:]MM:SS[.fff] into seconds, or
+    return None if it can not be parsed.
+    '''
+    try:
+        days = 0
+        if '-' in duration:
+            days, duration = duration.split('-', 1)
+        seconds = 0.0
+        for part in duration.split(':'):
+            seconds = seconds * 60 + float(part)
+        return int(days) * 86400 + seconds
+    except (AttributeError, ValueError):
+        return None
+
+def parse_size_kb(size):
+    '''
+    Parse a SLURM memory size such as 1234K or 1.5G into kilobytes (sizes
+    without a unit are taken to be in kilobytes, as requested from sacct), or
+    return None if it can not be parsed.
+    '''
+    factors = {'K': 1, 'M': 1024, 'G': 1024 ** 2, 'T': 1024 ** 3}
+    try:
+        if size and size[-1].upper() in factors:
+            return int(float(size[:-1]) * factors[size[-1].upper()])
+        return int(float(size))
+    except (TypeError, ValueError):
+        return None
+
+def _int_or_none(val):
+    try:
+        return int(val)
+    except (TypeError, ValueError):
+        return None
+
+class SacctRecord(object):
+    '''
+    Accounting record of a SLURM job, with the peak memory use of its steps.
+    '''
+    def __init__(self, jobid, state, exitcode=None, signal=None, elapsed_sec=None,
+                 totalcpu_sec=None, maxrss_kb=None):
+        self.jobid = jobid
+        self.state = state
+        self.exitcode = exitcode
+        self.signal = signal
+        self.elapsed_sec = elapsed_sec
+        self.totalcpu_sec = totalcpu_sec
+        self.maxrss_kb = maxrss_kb
+
+    @property
+    def finished(self):
+        '''
+        Whether the job is in one of the FINAL_STATES.
+        '''
+        return self.state in FINAL_STATES
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+def parse_sacct(output):
+    '''
+    Parse sacct --parsable2 output with the SACCT_FIELDS into a dict of job id
+    -> SacctRecord. Job steps (such as 123.batch or 123.0) are not returned
+    on their own, but their peak memory use counts for their job.
+    '''
+    records = {}
+    maxrss = {}
+    for line in output.splitlines():
+        fields = line.split('|')
+        if len(fields) < len(SACCT_FIELDS):
+            continue
+        jobid, state, exitcode, elapsed, totalcpu, rss = fields[:len(SACCT_FIELDS)]
+        jobid, _, step = jobid.partition('.')
+        rss_kb = parse_size_kb(rss)
+        if rss_kb is not None:
+            maxrss[jobid] = max(maxrss.get(jobid, 0), rss_kb)
+        if step:
+            continue
+        code, _, signal = exitcode.partition(':')
+        # Such as "CANCELLED by 1234"
+        records[jobid] = SacctRecord(jobid, state.split(' ')[0], _int_or_none(code),
+                                     _int_or_none(signal), parse_duration(elapsed),
+                                     parse_duration(totalcpu))
+    for jobid, record in records.items():
+        record.maxrss_kb = maxrss.get(jobid)
+    return records
+
+def sacct(jobids):
+    '''
+    Look up the accounting records of jobs with one sacct call, and return
+    them as a dict of job id -> SacctRecord.
+    '''
+    cmd = 'sacct -j {ids} --noheader --parsable2 --units=K -o {fields}'.format(
+        ids=','.join(jobids), fields=','.join(SACCT_FIELDS))
+    proc = sub.Popen(cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        log.warning('sacct failed: %s', stderr.decode('utf-8', 'replace').strip())
+        return {}
+    return parse_sacct(stdout.decode('utf-8'))
+
+# ==============================================================================
+
+class AccountingRequest(object):
+    '''
+    Handle for waiting on the accounting record of a job, requested from a
+    SacctCollector.
+    '''
+    def __init__(self, jobid):
+        self.jobid = jobid
+        self.record = None
+        self.requested = time.time()
+        self.next_lookup = 0.0
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        '''
+        Wait for the record, and return it (or None, if the timeout passed
+        first, or the job could not be found).
+        '''
+        self._done.wait(timeout)
+        return self.record
+
+    def _set_record(self, record):
+        self.record = record
+        self._done.set()
+
+class SacctCollector(object):
+    '''
+    Look up accounting records of jobs in batches (see the module docstring).
+    Use get_collector() to get the collector shared within the process.
+    '''
+    def __init__(self, batch_seconds=BATCH_SECONDS, retry_seconds=RETRY_SECONDS,
+                 max_wait_seconds=MAX_WAIT_SECONDS):
+        self.batch_seconds = batch_seconds
+        self.retry_seconds = retry_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.pid = os.getpid()
+        # Records of finished jobs, by job id
+        self.cache = {}
+        self.lookups = 0
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def request(self, jobid):
+        '''
+        Request the accounting record of a job, and return an
+        AccountingRequest for waiting on it.
+        '''
+        jobid = str(jobid)
+        with self._lock:
+            if jobid in self.cache:
+                request = AccountingRequest(jobid)
+                request._set_record(self.cache[jobid])
+                return request
+            request = self._requests.get(jobid)
+            if request is None:
+                request = AccountingRequest(jobid)
+                self._requests[jobid] = request
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return request
+
+    def _run(self):
+        while True:
+            time.sleep(self.batch_seconds)
+            try:
+                self.lookup()
+            except Exception as exc:
+                log.warning('Looking up SLURM accounting records failed: %s', exc)
+            with self._lock:
+                if not self._requests:
+                    self._thread = None
+                    return
+
+    def lookup(self):
+        '''
+        Look up all requested jobs that are due, with one sacct call, and hand
+        out the records of the ones that have finished.
+        '''
+        now = time.time()
+        with self._lock:
+            due = [request for request in self._requests.values() if request.next_lookup <= now]
+        if not due:
+            return
+        records = sacct([request.jobid for request in due])
+        self.lookups += 1
+        for request in due:
+            record = records.get(request.jobid)
+            gave_up = time.time() - request.requested >= self.max_wait_seconds
+            if record is not None and record.finished:
+                with self._lock:
+                    self.cache[request.jobid] = record
+            elif not gave_up:
+                request.next_lookup = time.time() + self.retry_seconds
+                continue
+            else:
+                log.warning('No final accounting record of job %s after %.0fs',
+                            request.jobid, self.max_wait_seconds)
+            with self._lock:
+                del self._requests[request.jobid]
+            request._set_record(record)
+
+# ==============================================================================
+
+_collector = None
+_collector_lock = threading.Lock()
+
+def get_collector():
+    '''
+    Return the accounting collector of this process.
+    '''
+    global _collector
+    with _collector_lock:
+        # A collector's thread does not survive forking a worker process
+        if _collector is None or _collector.pid != os.getpid():
+            _collector = SacctCollector()
+        return _collector
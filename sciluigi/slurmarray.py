@@ -0,0 +1,267 @@
+'''
+This module contains functionality for running the commands of many tasks as
+the elements of SLURM job arrays, submitted with one sbatch call per group of
+tasks with identical SLURM settings.
+
+Tasks that are to run in a job array write their command to a spool folder
+shared by all luigi worker processes. The first of them to get the lock of
+its group waits a moment for more commands to arrive, and then submits all
+commands waiting in the group as one job array. Each task then waits for its
+own array element to finish, while the state of the array in the queue is
+looked up (with squeue) at most once per poll interval, and shared between
+all waiting tasks through a status file.
+
+The spool folder needs to be on a file system shared with the compute nodes,
+as the array elements write their output and exit status to it.
+'''
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import subprocess as sub
+import time
+import uuid
+import sciluigi.slurmacct
+import sciluigi.util
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Folder for the commands, scripts and outputs of job arrays
+SPOOL_DIR = '.sciluigi/slurm_arrays'
+# Seconds to wait for more commands before submitting a job array
+GATHER_SECONDS = 5.0
+# Seconds between looking up the state of submitted job arrays
+POLL_INTERVAL = 10.0
+# Largest number of elements per job array (SLURM's MaxArraySize defaults to 1001)
+MAX_ARRAY_SIZE = 1000
+
+# Script run by each array element. The exit status and elapsed seconds are
+# written last, through a rename, so that they are complete once visible.
+ARRAY_SCRIPT = '''#!/bin/bash
+cd {cwd}
+i=$SLURM_ARRAY_TASK_ID
+start=$(date +%s)
+{launcher} bash {batchdir}/$i.cmd > {batchdir}/$i.out 2> {batchdir}/$i.err
+rc=$?
+echo "$rc $(( $(date +%s) - start ))" > {batchdir}/$i.rc.tmp
+mv {batchdir}/$i.rc.tmp {batchdir}/$i.rc
+'''
+
+# ==============================================================================
+
+class ArrayElementResult(object):
+    '''
+    The outcome of a command run as an element of a job array.
+    '''
+    def __init__(self, jobid, retcode, stdout, stderr, exectime_sec=None, state=None):
+        # Id of the array element, on the form <array job id>_<index>
+        self.jobid = jobid
+        self.retcode = retcode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exectime_sec = exectime_sec
+        # SLURM job state, if the element did not finish by itself
+        self.state = state
+
+class ArraySubmissionException(Exception):
+    '''
+    Exception to throw when a job array could not be submitted.
+    '''
+    pass
+
+# ==============================================================================
+
+class SlurmArrayRunner(object):
+    '''
+    Run commands as elements of job arrays, sharing arrays with other commands
+    run with the same sbatch arguments and launcher (see the module docstring).
+    '''
+    def __init__(self, sbatch_args, launcher='', spooldir=SPOOL_DIR,
+                 gather_seconds=GATHER_SECONDS, poll_interval=POLL_INTERVAL,
+                 max_array_size=MAX_ARRAY_SIZE):
+        self.sbatch_args = sbatch_args
+        self.launcher = launcher
+        self.gather_seconds = gather_seconds
+        self.poll_interval = poll_interval
+        self.max_array_size = max_array_size
+        groupkey = hashlib.md5((sbatch_args + '\n' + launcher).encode('utf-8')).hexdigest()[:16]
+        self.groupdir = os.path.join(os.path.abspath(spooldir), groupkey)
+
+    def run(self, command):
+        '''
+        Run command as an element of a job array, wait for it to finish, and
+        return an ArrayElementResult.
+        '''
+        entry = uuid.uuid4().hex
+        pendingdir = os.path.join(self.groupdir, 'pending')
+        sciluigi.util.ensuredir(pendingdir)
+        sciluigi.util.ensuredir(os.path.join(self.groupdir, 'assigned'))
+        sciluigi.util.write_atomically(os.path.join(pendingdir, entry), command)
+
+        assignment = self._submit_or_wait(entry)
+        if 'error' in assignment:
+            raise ArraySubmissionException(assignment['error'])
+        log.info('Command submitted as job array element %s_%s: %s',
+                 assignment['jobid'], assignment['index'], command)
+        return self._wait_for_element(assignment['batchdir'], assignment['jobid'],
+                                      assignment['index'])
+
+    def _submit_or_wait(self, entry):
+        '''
+        Get the group lock, and unless another process has already submitted
+        the command in the meantime, gather the waiting commands and submit
+        them. Return the assignment of the command to an array element.
+        '''
+        assignedpath = os.path.join(self.groupdir, 'assigned', entry)
+        with sciluigi.util.FileLock(os.path.join(self.groupdir, 'submit.lock')):
+            if not os.path.exists(assignedpath):
+                time.sleep(self.gather_seconds)
+                self._submit_pending()
+        with open(assignedpath) as assignedfile:
+            assignment = json.load(assignedfile)
+        os.remove(assignedpath)
+        return assignment
+
+    def _submit_pending(self):
+        '''
+        Submit all waiting commands in the group as job arrays, and assign
+        each command to its array element. Must be called with the group lock.
+        '''
+        pendingdir = os.path.join(self.groupdir, 'pending')
+        entries = sorted(os.listdir(pendingdir))
+        for chunk_start in range(0, len(entries), self.max_array_size):
+            chunk = entries[chunk_start:chunk_start + self.max_array_size]
+            batchdir = os.path.join(self.groupdir, 'batch_' + uuid.uuid4().hex)
+            sciluigi.util.ensuredir(batchdir)
+            for index, entry in enumerate(chunk):
+                os.rename(os.path.join(pendingdir, entry), os.path.join(batchdir, '%d.cmd' % index))
+            try:
+                jobid = self._sbatch(batchdir, len(chunk))
+                assignments = [{'batchdir': batchdir, 'jobid': jobid, 'index': index}
+                               for index in range(len(chunk))]
+            except ArraySubmissionException as exc:
+                log.error(str(exc))
+                assignments = [{'error': str(exc)}] * len(chunk)
+            for entry, assignment in zip(chunk, assignments):
+                sciluigi.util.write_atomically(os.path.join(self.groupdir, 'assigned', entry),
+                                               json.dumps(assignment))
+
+    def _sbatch(self, batchdir, size):
+        '''
+        Submit a job array of the given size, running the commands in batchdir,
+        and return its job id.
+        '''
+        scriptpath = os.path.join(batchdir, 'array.sh')
+        with open(scriptpath, 'w') as scriptfile:
+            scriptfile.write(ARRAY_SCRIPT.format(cwd=os.getcwd(), batchdir=batchdir,
+                                                 launcher=self.launcher))
+        cmd = 'sbatch --parsable --array=0-{last} -o /dev/null {args} {script}'.format(
+            last=size - 1, args=self.sbatch_args, script=scriptpath)
+        log.info('Submitting job array of %d commands: %s', size, cmd)
+        proc = sub.Popen(cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+        stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise ArraySubmissionException('Submitting job array failed (retcode {r}): {c}\n{e}'.format(
+                r=proc.returncode, c=cmd, e=stderr.decode('utf-8', 'replace')))
+        return sciluigi.util.parse_sbatch_jobid(stdout)
+
+    def _wait_for_element(self, batchdir, jobid, index):
+        '''
+        Wait until an array element has finished, and return its result.
+        '''
+        rcpath = os.path.join(batchdir, '%d.rc' % index)
+        elementid = '%s_%s' % (jobid, index)
+        missing_since = None
+        while not os.path.exists(rcpath):
+            queued = self._queued_elements(batchdir, jobid)
+            if queued is not None and elementid not in queued and not _in_pending_range(queued, jobid, index):
+                # Give the element's files a poll interval to show up, in case
+                # the shared file system lags behind, before giving up on it
+                if missing_since is None:
+                    missing_since = time.time()
+                elif time.time() - missing_since >= self.poll_interval:
+                    if os.path.exists(rcpath):
+                        break
+                    state = _sacct_state(elementid)
+                    log.error('Job array element %s ended without exit status (state %s)',
+                              elementid, state)
+                    return ArrayElementResult(elementid, None, *_read_outputs(batchdir, index),
+                                              state=state)
+            time.sleep(min(self.poll_interval, 1.0) if missing_since is None else self.poll_interval)
+
+        with open(rcpath) as rcfile:
+            retcode, exectime_sec = [int(val) for val in rcfile.read().split()]
+        stdout, stderr = _read_outputs(batchdir, index)
+        return ArrayElementResult(elementid, retcode, stdout, stderr, exectime_sec)
+
+    def _queued_elements(self, batchdir, jobid):
+        '''
+        Return the ids of the elements of the job array still in the queue, as
+        looked up at most once per poll interval by any process, or None if
+        the lookup fails.
+        '''
+        statuspath = os.path.join(batchdir, 'status.json')
+        with sciluigi.util.FileLock(os.path.join(batchdir, 'status.lock')):
+            if os.path.exists(statuspath):
+                with open(statuspath) as statusfile:
+                    status = json.load(statusfile)
+                if time.time() - status['time'] < self.poll_interval:
+                    return status['queued']
+            proc = sub.Popen('squeue -h -r -j {j} -o %i'.format(j=jobid), shell=True,
+                             stdout=sub.PIPE, stderr=sub.PIPE)
+            stdout, stderr = proc.communicate()
+            if proc.returncode != 0:
+                log.warning('squeue failed for job array %s: %s', jobid,
+                            stderr.decode('utf-8', 'replace').strip())
+                return None
+            queued = stdout.decode('utf-8').split()
+            sciluigi.util.write_atomically(statuspath, json.dumps({'time': time.time(), 'queued': queued}))
+            return queued
+
+# ==============================================================================
+
+def _read_outputs(batchdir, index):
+    '''
+    Read the stdout and stderr of an array element, as bytes.
+    '''
+    outputs = []
+    for ext in ['out', 'err']:
+        try:
+            with open(os.path.join(batchdir, '%d.%s' % (index, ext)), 'rb') as outfile:
+                outputs.append(outfile.read())
+        except IOError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+            outputs.append(b'')
+    return outputs
+
+def _in_pending_range(queued, jobid, index):
+    '''
+    Check whether an element is among the ones squeue lists as a pending range
+    (such as 123_[4-9%2]), which it may do even with -r, for pending elements.
+    '''
+    prefix = '%s_[' % jobid
+    for jobspec in queued:
+        if not jobspec.startswith(prefix):
+            continue
+        for part in jobspec[len(prefix):].rstrip(']').split('%')[0].split(','):
+            bounds = part.split('-')
+            try:
+                if int(bounds[0]) <= index <= int(bounds[-1]):
+                    return True
+            except ValueError:
+                continue
+    return False
+
+def _sacct_state(elementid):
+    '''
+    Look up the state of a finished job (array element) with sacct.
+    '''
+    record = sciluigi.slurmacct.sacct([elementid]).get(elementid)
+    if record is None:
+        return 'UNKNOWN'
+    return record.state
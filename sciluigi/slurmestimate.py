@@ -0,0 +1,182 @@
+'''
+This module contains functionality for estimating the resources (time limit,
+cores and memory) to request from SLURM for a task, from what earlier runs of
+the same task class used, as recorded in the workflow's audit history.
+
+Runs whose parameters have the same shape as the task's are used, if there
+are enough of them, otherwise all runs of the task class. Two sets of
+parameters have the same shape if they have the same names, and values of the
+same kind, with numbers of about the same size (within a power of two),
+compared in the form they are stored in audit records in. The
+estimates are the given percentile of the past execution times, average
+number of cores in use (total CPU time / execution time) and peak memory use,
+with a safety margin added.
+'''
+
+import copy
+import logging
+import math
+import sciluigi.audit
+import sciluigi.util
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Fraction added on top of the estimates
+MARGIN = 0.5
+# Percentile of the past values to base the estimates on
+PERCENTILE = 95
+# Fewest earlier runs to base estimates on
+MIN_SAMPLES = 3
+# Shortest time limit to request, in seconds
+MIN_TIME_SEC = 60
+# Parameters left out of parameter shapes, as they differ between tasks of a
+# workflow, or are what is being estimated
+SHAPE_EXCLUDED_PARAMS = ['workflow_task', 'instance_name', 'slurminfo']
+
+# ==============================================================================
+
+def parameter_shape(params):
+    '''
+    Return a hashable summary of the names and kinds of values of a dict of
+    task parameters (see the module docstring).
+    '''
+    shape = []
+    for name, val in sorted(params.items()):
+        if name in SHAPE_EXCLUDED_PARAMS:
+            continue
+        # As stored in audit records, so that live parameters match recorded ones
+        val = sciluigi.audit._auditvalue(val)
+        try:
+            num = float(val)
+            kind = 'num:%d' % int(math.floor(math.log(abs(num), 2))) if num else 'num:0'
+        except (TypeError, ValueError, OverflowError):
+            kind = type(val).__name__
+        shape.append((name, kind))
+    return tuple(shape)
+
+def format_duration(seconds):
+    '''
+    Format seconds as a SLURM time limit on the form [D-]HH:MM:SS.
+    '''
+    seconds = int(math.ceil(seconds))
+    days, seconds = divmod(seconds, 86400)
+    timestr = '%02d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    if days:
+        timestr = '%d-%s' % (days, timestr)
+    return timestr
+
+# ==============================================================================
+
+class ResourceEstimate(object):
+    '''
+    Estimated resources for a task, with the reasoning behind them. Resources
+    that could not be estimated are None.
+    '''
+    def __init__(self, time_sec=None, cores=None, mem_mb=None, samples=0, reasons=None):
+        self.time_sec = time_sec
+        self.cores = cores
+        self.mem_mb = mem_mb
+        # Number of earlier runs the estimates are based on
+        self.samples = samples
+        self.reasons = reasons or []
+
+    def apply(self, slurminfo):
+        '''
+        Return a copy of a SlurmInfo, with the estimated resources. The number
+        of cores and threads are never raised above the ones in the SlurmInfo,
+        as earlier runs could not have used more than they were given.
+        '''
+        slurminfo = copy.copy(slurminfo)
+        if self.time_sec is not None:
+            slurminfo.time = format_duration(self.time_sec)
+        if self.cores is not None:
+            slurminfo.cores = min(int(slurminfo.cores), self.cores)
+            slurminfo.threads = min(int(slurminfo.threads), slurminfo.cores)
+        if self.mem_mb is not None:
+            slurminfo.mem = self.mem_mb
+        return slurminfo
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+class SlurmResourceEstimator(object):
+    '''
+    Estimate the resources of tasks from audit records of earlier runs (see
+    the module docstring).
+    '''
+    def __init__(self, margin=MARGIN, percentile=PERCENTILE, min_samples=MIN_SAMPLES,
+                 min_time_sec=MIN_TIME_SEC):
+        self.margin = margin
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_time_sec = min_time_sec
+
+    def select_records(self, records, task_family, params):
+        '''
+        Return the records of successful earlier runs of the task class, with
+        the same parameter shape if there are at least min_samples of those,
+        and whether they were selected by shape.
+        '''
+        records = [record for record in records
+                   if record.get('task_family') == task_family
+                   and not record.get('info', {}).get('trace_failed')]
+        shape = parameter_shape(params)
+        same_shape = [record for record in records
+                      if parameter_shape(record.get('params', {})) == shape]
+        if len(same_shape) >= self.min_samples:
+            return same_shape, True
+        return records, False
+
+    def estimate(self, records, task_family, params):
+        '''
+        Estimate the resources of a task of the given class and parameters,
+        from the audit records of earlier runs, and return a ResourceEstimate.
+        '''
+        records, by_shape = self.select_records(records, task_family, params)
+        estimate = ResourceEstimate(samples=len(records))
+        if len(records) < self.min_samples:
+            estimate.reasons.append('%d earlier runs of %s, fewer than the %d needed' % (
+                len(records), task_family, self.min_samples))
+            return estimate
+        estimate.reasons.append('%d earlier runs of %s%s' % (
+            len(records), task_family,
+            ' with the same parameter shape' if by_shape else ' (too few with the same parameter shape)'))
+        factor = 1.0 + self.margin
+
+        times = []
+        cores = []
+        mems = []
+        for record in records:
+            info = record.get('info', {})
+            exectime = sciluigi.util.float_or_none(info.get('slurm_exectime_sec'))
+            if exectime is None:
+                exectime = sciluigi.util.float_or_none(info.get('task_exectime_sec'))
+            if exectime is not None:
+                times.append(exectime)
+            totalcpu = sciluigi.util.float_or_none(info.get('slurm_totalcpu_sec'))
+            slurm_exectime = sciluigi.util.float_or_none(info.get('slurm_exectime_sec'))
+            if totalcpu is not None and slurm_exectime:
+                cores.append(totalcpu / slurm_exectime)
+            maxrss = sciluigi.util.float_or_none(info.get('slurm_maxrss_kb'))
+            if maxrss is not None:
+                mems.append(maxrss)
+
+        if len(times) >= self.min_samples:
+            pct = sciluigi.util.percentile(times, self.percentile)
+            estimate.time_sec = max(self.min_time_sec, int(math.ceil(pct * factor / 60.0)) * 60)
+            estimate.reasons.append('time: p%d of %d execution times is %.1fs, +%d%% -> %s' % (
+                self.percentile, len(times), pct, self.margin * 100,
+                format_duration(estimate.time_sec)))
+        if len(cores) >= self.min_samples:
+            pct = sciluigi.util.percentile(cores, self.percentile)
+            estimate.cores = max(1, int(math.ceil(pct * factor)))
+            estimate.reasons.append('cores: p%d of %d average cores in use is %.2f, +%d%% -> %d' % (
+                self.percentile, len(cores), pct, self.margin * 100, estimate.cores))
+        if len(mems) >= self.min_samples:
+            pct = sciluigi.util.percentile(mems, self.percentile)
+            estimate.mem_mb = max(1, int(math.ceil(pct * factor / 1024.0)))
+            estimate.reasons.append('mem: p%d of %d peak memory uses is %.0fK, +%d%% -> %dM' % (
+                self.percentile, len(mems), pct, self.margin * 100, estimate.mem_mb))
+        return estimate
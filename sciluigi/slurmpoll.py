@@ -0,0 +1,223 @@
+'''
+This module contains functionality for waiting on SLURM jobs submitted with
+sbatch, without each waiting task querying SLURM on its own.
+
+Each process has one poller thread, watching the jobs submitted from it. The
+job ids are also registered in a folder shared by all luigi worker processes,
+and whichever process is first to find that a poll is due looks up all
+outstanding jobs there, with one squeue call, followed by one sacct call for
+the jobs that have left the queue. Results of finished jobs are written back
+to the folder, where the process waiting for them picks them up.
+
+Jobs that have left the queue, but still have no accounting record at all
+after max_wait_seconds (as when the accounting database lags far behind, or
+is not available), are given up on, with the state UNKNOWN. Jobs that are
+back in the queue, or that sacct reports as pending or running, as after a
+failed squeue call, are never given up on.
+'''
+
+import json
+import logging
+import os
+import subprocess as sub
+import threading
+import time
+import sciluigi.slurmacct
+import sciluigi.util
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Folder for the ids of outstanding jobs, and the results of finished ones
+JOBS_DIR = '.sciluigi/slurm_jobs'
+# Seconds between looking up the state of outstanding jobs
+POLL_INTERVAL = 10.0
+# Seconds between checking for results of finished jobs of this process
+CHECK_INTERVAL = 1.0
+# Seconds after leaving the queue to give up on jobs without an accounting
+# record
+MAX_WAIT_SECONDS = 600.0
+# State of jobs that were given up on
+STATE_UNKNOWN = 'UNKNOWN'
+
+# ==============================================================================
+
+class SlurmJobWatch(object):
+    '''
+    Handle for waiting on a job watched by a SlurmJobPoller.
+    '''
+    def __init__(self, jobid):
+        self.jobid = jobid
+        self.result = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        '''
+        Wait for the job to finish, and return its accounting record, as a
+        sciluigi.slurmacct.SacctRecord (or None, if the timeout passed first).
+        '''
+        self._done.wait(timeout)
+        return self.result
+
+    def _set_result(self, result):
+        self.result = result
+        self._done.set()
+
+class SlurmJobPoller(object):
+    '''
+    Watch SLURM jobs until they have finished (see the module docstring).
+    Use get_poller() to get the poller shared within the process.
+    '''
+    def __init__(self, jobsdir=JOBS_DIR, interval=POLL_INTERVAL, max_wait_seconds=MAX_WAIT_SECONDS):
+        self.jobsdir = os.path.abspath(jobsdir)
+        self.interval = interval
+        self.max_wait_seconds = max_wait_seconds
+        self.pid = os.getpid()
+        self._watches = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        sciluigi.util.ensuredir(os.path.join(self.jobsdir, 'outstanding'))
+        sciluigi.util.ensuredir(os.path.join(self.jobsdir, 'done'))
+
+    def watch(self, jobid):
+        '''
+        Start watching a job, and return a SlurmJobWatch for waiting on it.
+        '''
+        jobid = str(jobid)
+        sciluigi.util.write_atomically(os.path.join(self.jobsdir, 'outstanding', jobid), '')
+        watch = SlurmJobWatch(jobid)
+        with self._lock:
+            self._watches[jobid] = watch
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+        return watch
+
+    def _run(self):
+        while True:
+            try:
+                self._deliver_results()
+                self.poll()
+            except Exception as exc:
+                log.warning('Polling SLURM jobs failed: %s', exc)
+            with self._lock:
+                if not self._watches:
+                    self._thread = None
+                    return
+            time.sleep(min(CHECK_INTERVAL, self.interval))
+
+    def _deliver_results(self):
+        '''
+        Hand the results of finished jobs to the watches waiting for them.
+        '''
+        with self._lock:
+            jobids = list(self._watches)
+        for jobid in jobids:
+            donepath = os.path.join(self.jobsdir, 'done', jobid)
+            if os.path.exists(donepath):
+                with open(donepath) as donefile:
+                    result = sciluigi.slurmacct.SacctRecord(**json.load(donefile))
+                os.remove(donepath)
+                with self._lock:
+                    watch = self._watches.pop(jobid)
+                watch._set_result(result)
+
+    def poll(self):
+        '''
+        Look up all outstanding jobs (of all processes), if no process has
+        done so within the poll interval, and write the results of the ones
+        that have finished, or that have been given up on.
+        '''
+        stamppath = os.path.join(self.jobsdir, 'last_poll')
+        with sciluigi.util.FileLock(os.path.join(self.jobsdir, 'poll.lock')):
+            if os.path.exists(stamppath) and time.time() - os.path.getmtime(stamppath) < self.interval:
+                return
+            with open(stamppath, 'w'):
+                pass
+            outstanding = os.listdir(os.path.join(self.jobsdir, 'outstanding'))
+            outstanding = [jobid for jobid in outstanding if '.tmp.' not in jobid]
+            if not outstanding:
+                return
+            queued = _squeue(outstanding)
+            left = [jobid for jobid in outstanding if queued is None or jobid not in queued]
+            for jobid in outstanding:
+                if jobid not in left:
+                    self._set_left_at(jobid, None)
+            if not left:
+                return
+            records = sciluigi.slurmacct.sacct(left)
+            for jobid in left:
+                record = records.get(jobid)
+                if record is not None and record.finished:
+                    self._finish(jobid, record)
+                elif record is not None:
+                    # Still pending or running, as when squeue failed
+                    self._set_left_at(jobid, None)
+                else:
+                    left_at = self._get_left_at(jobid)
+                    if left_at is None:
+                        self._set_left_at(jobid, time.time())
+                    elif time.time() - left_at >= self.max_wait_seconds:
+                        log.warning('No accounting record of job %s after %.0fs, giving up on it',
+                                    jobid, self.max_wait_seconds)
+                        self._finish(jobid, sciluigi.slurmacct.SacctRecord(jobid, STATE_UNKNOWN))
+
+    def _get_left_at(self, jobid):
+        '''
+        Return the time a job was first found to have left the queue without
+        an accounting record, kept in its outstanding file, or None.
+        '''
+        with open(os.path.join(self.jobsdir, 'outstanding', jobid)) as outfile:
+            left_at = outfile.read().strip()
+        return float(left_at) if left_at else None
+
+    def _set_left_at(self, jobid, left_at):
+        '''
+        Write (or with None, clear) the time a job was first found to have
+        left the queue without an accounting record.
+        '''
+        if self._get_left_at(jobid) != left_at:
+            sciluigi.util.write_atomically(os.path.join(self.jobsdir, 'outstanding', jobid),
+                                           '' if left_at is None else repr(left_at))
+
+    def _finish(self, jobid, record):
+        '''
+        Write the result of a job, and stop looking it up.
+        '''
+        donepath = os.path.join(self.jobsdir, 'done', jobid)
+        sciluigi.util.write_atomically(donepath, json.dumps(record.to_dict()))
+        os.remove(os.path.join(self.jobsdir, 'outstanding', jobid))
+
+def _squeue(jobids):
+    '''
+    Return the ids of the given jobs that are still in the queue, or None if
+    squeue fails (as it may, for jobs that have been purged from the queue).
+    '''
+    cmd = 'squeue -h -j {ids} -o %i'.format(ids=','.join(jobids))
+    proc = sub.Popen(cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode != 0:
+        log.debug('squeue failed: %s', stderr.decode('utf-8', 'replace').strip())
+        return None
+    return set(stdout.decode('utf-8').split())
+
+# ==============================================================================
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+def get_poller(jobsdir=JOBS_DIR, interval=POLL_INTERVAL, max_wait_seconds=MAX_WAIT_SECONDS):
+    '''
+    Return the poller of this process for the given jobs folder, interval
+    and time to wait for accounting records.
+    '''
+    key = (os.path.abspath(jobsdir), interval, max_wait_seconds)
+    with _pollers_lock:
+        poller = _pollers.get(key)
+        # A poller's thread does not survive forking a worker process
+        if poller is None or poller.pid != os.getpid():
+            poller = SlurmJobPoller(jobsdir, interval, max_wait_seconds)
+            _pollers[key] = poller
+        return poller
@@ -0,0 +1,451 @@
+'''
+This module contains functionality for running many short commands in a pool
+of long-lived SLURM allocations (pilot jobs), instead of waiting for one new
+allocation per command.
+
+Each pilot job runs an agent, which takes commands from a queue folder shared
+with the tasks, and runs them as job steps (with srun) within its allocation,
+a number of slots at a time. Tasks put their command in the queue, start new
+pilot jobs while there are more queued and running commands than slots in
+the pool (up to a maximum number of pilot jobs), and wait for the result. An
+agent exits when it has been idle for a while, so the pool shrinks again
+when there is less work.
+
+Pilot jobs get a time limit of their own, longer than the one of a single
+command. An agent stops taking new commands once less than the time limit of
+a command is left of its allocation, and exits when its running commands
+have finished, so that commands are not killed along with the pilot job.
+Pilot jobs that were submitted but whose agents never started (as when the
+job was cancelled before it started) are no longer counted on once they have
+left the queue, or after start_seconds.
+
+Agents can also be started as local processes, running commands as plain
+subprocesses, for trying out workflows (and testing) without SLURM.
+
+An agent is started with:
+
+    python -m sciluigi.slurmpool <pool folder> <agent id> [options]
+'''
+
+import argparse
+import json
+import logging
+import os
+import subprocess as sub
+import sys
+import time
+import uuid
+import hashlib
+import sciluigi.slurmpoll
+import sciluigi.util
+
+# ==============================================================================
+
+log = logging.getLogger('sciluigi-interface')
+
+# Folder for the queue, results and agents of pools
+POOL_DIR = '.sciluigi/slurm_pools'
+# Largest number of pilot jobs per pool
+MAX_AGENTS = 4
+# Seconds an agent waits without commands to run, before exiting
+IDLE_SECONDS = 60.0
+# Seconds between checks for new commands and results
+CHECK_INTERVAL = 1.0
+# Agents not heard from in this many seconds are considered dead
+DEAD_SECONDS = 60.0
+# Time limit of pilot jobs, unless the time limit of commands is longer
+AGENT_TIME = '4:00:00'
+# Seconds after which pilot jobs whose agents have not started are no longer
+# counted on
+START_SECONDS = 3600.0
+# Seconds to wait for a command to finish, including time in the queue
+TIMEOUT_SECONDS = 86400.0
+
+# Ways of starting agents
+LAUNCH_SBATCH = 'sbatch'
+LAUNCH_LOCAL = 'local'
+
+# Script running an agent, submitted with sbatch as a pilot job (or run
+# locally). Agents import sciluigi from the same place as the workflow.
+AGENT_SCRIPT = '''#!/bin/bash
+cd {cwd}
+export PYTHONPATH={libdir}${{PYTHONPATH:+:$PYTHONPATH}}
+{agent}
+'''
+
+# ==============================================================================
+
+class PoolCommandResult(object):
+    '''
+    The outcome of a command run in a pool.
+    '''
+    def __init__(self, retcode, stdout, stderr, agentid=None, wait_sec=None, exectime_sec=None):
+        self.retcode = retcode
+        self.stdout = stdout
+        self.stderr = stderr
+        # Id of the agent (and pilot job) that ran the command
+        self.agentid = agentid
+        # Seconds from queueing the command until it started, and running it
+        self.wait_sec = wait_sec
+        self.exectime_sec = exectime_sec
+
+class PoolAgentLostException(Exception):
+    '''
+    Exception to throw when the agent running a command stopped responding
+    (for example, because its pilot job hit the time limit).
+    '''
+    pass
+
+class PoolTimeoutException(Exception):
+    '''
+    Exception to throw when a command did not finish within the timeout of
+    the pool.
+    '''
+    pass
+
+def parse_time_limit(timestr):
+    '''
+    Parse a SLURM time limit (minutes, minutes:seconds, hours:minutes:seconds,
+    days-hours, days-hours:minutes or days-hours:minutes:seconds) into
+    seconds, or return None if it can not be parsed.
+    '''
+    try:
+        days = 0
+        timestr = str(timestr).strip()
+        if '-' in timestr:
+            days, timestr = timestr.split('-', 1)
+            parts = [int(part) for part in timestr.split(':')]
+            hours, minutes, seconds = parts + [0] * (3 - len(parts))
+        else:
+            parts = [int(part) for part in timestr.split(':')]
+            if len(parts) == 1:
+                hours, minutes, seconds = 0, parts[0], 0
+            elif len(parts) == 2:
+                hours, minutes, seconds = [0] + parts
+            else:
+                hours, minutes, seconds = parts
+        return int(days) * 86400 + hours * 3600 + minutes * 60 + seconds
+    except ValueError:
+        return None
+
+# ==============================================================================
+
+class SlurmPool(object):
+    '''
+    A pool of pilot jobs with the same sbatch arguments and launcher, shared
+    by all tasks (in all processes) that use it (see the module docstring).
+    With launch=LAUNCH_LOCAL, agents are local processes, and run commands
+    without the launcher.
+
+    agent_seconds is the time limit of the pilot jobs, and command_seconds
+    the one of commands, both in seconds (None for no limit).
+    '''
+    def __init__(self, sbatch_args, launcher='', slots=1, max_agents=MAX_AGENTS,
+                 idle_seconds=IDLE_SECONDS, launch=LAUNCH_SBATCH, pooldir=POOL_DIR,
+                 check_interval=CHECK_INTERVAL, dead_seconds=DEAD_SECONDS, agent_seconds=None,
+                 command_seconds=None, start_seconds=START_SECONDS, timeout=TIMEOUT_SECONDS):
+        self.sbatch_args = sbatch_args
+        self.launcher = launcher
+        self.slots = max(1, int(slots))
+        self.max_agents = max_agents
+        self.idle_seconds = idle_seconds
+        self.launch = launch
+        self.check_interval = check_interval
+        self.dead_seconds = dead_seconds
+        self.agent_seconds = agent_seconds
+        self.command_seconds = command_seconds
+        self.start_seconds = start_seconds
+        self.timeout = timeout
+        # Agents only know the time limit of the commands of their own pool
+        poolkey = hashlib.md5((sbatch_args + '\n' + launcher + '\n' + launch + '\n' +
+                               str(command_seconds)).encode('utf-8'))
+        self.pooldir = os.path.join(os.path.abspath(pooldir), poolkey.hexdigest()[:16])
+        for subdir in ['queue', 'running', 'results', 'agents', 'starting']:
+            sciluigi.util.ensuredir(os.path.join(self.pooldir, subdir))
+
+    def run(self, command):
+        '''
+        Run command in the pool, wait for it to finish, and return a
+        PoolCommandResult. Raises PoolTimeoutException if it has not finished
+        within the timeout of the pool.
+        '''
+        cmdid = '%.6f_%s' % (time.time(), uuid.uuid4().hex[:12])
+        queuepath = os.path.join(self.pooldir, 'queue', cmdid + '.cmd')
+        sciluigi.util.write_atomically(queuepath, command + '\n')
+        self.ensure_capacity()
+        rcpath = os.path.join(self.pooldir, 'results', cmdid + '.rc')
+        start = time.time()
+        last_check = start
+        while not os.path.exists(rcpath):
+            time.sleep(self.check_interval)
+            if self.timeout is not None and time.time() - start >= self.timeout:
+                try:
+                    os.remove(queuepath)
+                except OSError:
+                    log.warning('Command %s in pool %s is left running after the timeout',
+                                cmdid, self.pooldir)
+                raise PoolTimeoutException('Command %s in pool %s did not finish within %.0fs' % (
+                    cmdid, self.pooldir, self.timeout))
+            if time.time() - last_check >= self.dead_seconds / 2:
+                last_check = time.time()
+                self._check_progress(cmdid)
+
+        with open(rcpath) as rcfile:
+            result = json.load(rcfile)
+        outputs = []
+        for ext in ['.out', '.err']:
+            path = os.path.join(self.pooldir, 'results', cmdid + ext)
+            with open(path, 'rb') as outfile:
+                outputs.append(outfile.read())
+            os.remove(path)
+        os.remove(rcpath)
+        return PoolCommandResult(result['retcode'], outputs[0], outputs[1], result['agent'],
+                                 result['start'] - float(cmdid.split('_')[0]),
+                                 result['end'] - result['start'])
+
+    def _check_progress(self, cmdid):
+        '''
+        Make sure that a command is still on its way: start agents if it is
+        still queued and the pool has shrunk, and fail if it was taken by an
+        agent that is no longer alive.
+        '''
+        if os.path.exists(os.path.join(self.pooldir, 'queue', cmdid + '.cmd')):
+            self.ensure_capacity()
+            return
+        agentpath = os.path.join(self.pooldir, 'running', cmdid + '.agent')
+        if not os.path.exists(agentpath):
+            return
+        with open(agentpath) as agentfile:
+            agentid = agentfile.read().strip()
+        if agentid and agentid not in self.live_agents():
+            if not os.path.exists(os.path.join(self.pooldir, 'results', cmdid + '.rc')):
+                raise PoolAgentLostException('Agent %s running command %s in pool %s was lost' % (
+                    agentid, cmdid, self.pooldir))
+
+    def live_agents(self, include_draining=True):
+        '''
+        Return the ids of the agents that have been heard from recently,
+        optionally leaving out the ones that take no new commands.
+        '''
+        agents = []
+        agentsdir = os.path.join(self.pooldir, 'agents')
+        names = os.listdir(agentsdir)
+        for agentid in names:
+            # Temporary files, and the marks of draining agents
+            if '.' in agentid:
+                continue
+            if not include_draining and agentid + '.draining' in names:
+                continue
+            try:
+                if time.time() - os.path.getmtime(os.path.join(agentsdir, agentid)) < self.dead_seconds:
+                    agents.append(agentid)
+            except OSError:
+                # The agent exited
+                continue
+        return agents
+
+    def ensure_capacity(self):
+        '''
+        Start new agents while the queued and running commands outnumber the
+        slots of the live (and not draining) and starting agents, up to
+        max_agents.
+        '''
+        with sciluigi.util.FileLock(os.path.join(self.pooldir, 'manage.lock')):
+            queued = len([name for name in os.listdir(os.path.join(self.pooldir, 'queue'))
+                          if name.endswith('.cmd')])
+            running = len([name for name in os.listdir(os.path.join(self.pooldir, 'running'))
+                           if name.endswith('.cmd')])
+            agents = len(self.live_agents(include_draining=False)) + len(self._starting_agents())
+            wanted = min(self.max_agents, -(-(queued + running) // self.slots))
+            for _ in range(wanted - agents):
+                self._start_agent()
+
+    def _starting_agents(self):
+        '''
+        Return the ids of the agents that have been started, but have not yet
+        started running, forgetting the ones whose pilot jobs have left the
+        queue, or that were started more than start_seconds ago. Called with
+        the manage lock held.
+        '''
+        startingdir = os.path.join(self.pooldir, 'starting')
+        starting = {}
+        for agentid in os.listdir(startingdir):
+            if '.tmp.' in agentid:
+                continue
+            try:
+                with open(os.path.join(startingdir, agentid)) as startfile:
+                    starting[agentid] = json.load(startfile)
+            except (IOError, OSError, ValueError):
+                continue
+        jobids = [entry['jobid'] for entry in starting.values() if entry.get('jobid')]
+        queued = sciluigi.slurmpoll._squeue(jobids) if jobids else None
+        agents = []
+        for agentid, entry in sorted(starting.items()):
+            if queued is not None and entry.get('jobid') and entry['jobid'] not in queued:
+                log.warning('Pilot job %s of pool agent %s left the queue without starting the agent',
+                            entry['jobid'], agentid)
+            elif time.time() - entry['time'] >= self.start_seconds:
+                log.warning('Pool agent %s has not started within %.0fs', agentid,
+                            self.start_seconds)
+            else:
+                agents.append(agentid)
+                continue
+            os.remove(os.path.join(startingdir, agentid))
+        return agents
+
+    def _start_agent(self):
+        '''
+        Start a new agent, as a pilot job or a local process. Called with the
+        manage lock held, so that the agent can not take itself off the
+        starting agents before it has been put there.
+        '''
+        agentid = 'agent_' + uuid.uuid4().hex[:12]
+        logpath = os.path.join(self.pooldir, agentid + '.log')
+        args = [sys.executable, '-m', 'sciluigi.slurmpool', self.pooldir, agentid,
+                '--slots', str(self.slots), '--idle-seconds', str(self.idle_seconds),
+                '--check-interval', str(self.check_interval)]
+        if self.agent_seconds is not None and self.command_seconds is not None:
+            args += ['--time-limit', str(self.agent_seconds),
+                     '--command-seconds', str(self.command_seconds)]
+        if self.launch != LAUNCH_LOCAL:
+            args += ['--launcher', self.launcher]
+        scriptpath = os.path.join(self.pooldir, agentid + '.sh')
+        with open(scriptpath, 'w') as scriptfile:
+            scriptfile.write(AGENT_SCRIPT.format(
+                cwd=os.getcwd(), agent=sub.list2cmdline(args),
+                libdir=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        startpath = os.path.join(self.pooldir, 'starting', agentid)
+        if self.launch == LAUNCH_LOCAL:
+            log.info('Starting local pool agent %s', agentid)
+            with open(logpath, 'w') as logfile:
+                sub.Popen(['bash', scriptpath], stdout=logfile, stderr=sub.STDOUT)
+            sciluigi.util.write_atomically(startpath, json.dumps({'time': time.time()}))
+            return
+        cmd = 'sbatch --parsable -o {log} {args} {script}'.format(
+            log=logpath, args=self.sbatch_args, script=scriptpath)
+        log.info('Submitting pilot job for pool agent %s: %s', agentid, cmd)
+        proc = sub.Popen(cmd, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+        stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            log.error('Submitting pilot job failed (retcode %s): %s', proc.returncode,
+                      stderr.decode('utf-8', 'replace').strip())
+            return
+        jobid = sciluigi.util.parse_sbatch_jobid(stdout)
+        sciluigi.util.write_atomically(startpath, json.dumps({'time': time.time(), 'jobid': jobid}))
+        log.info('Submitted pilot job %s for pool agent %s', jobid, agentid)
+
+# ==============================================================================
+
+def run_agent(pooldir, agentid, slots=1, idle_seconds=IDLE_SECONDS, launcher='',
+              check_interval=CHECK_INTERVAL, time_limit=None, command_seconds=None):
+    '''
+    Run commands from the queue of a pool, at most slots at a time, until no
+    command has been waiting for idle_seconds, or until less than
+    command_seconds are left of the agent's time_limit (in seconds).
+    '''
+    started = time.time()
+    agentpath = os.path.join(pooldir, 'agents', agentid)
+    drainpath = agentpath + '.draining'
+    managelock = os.path.join(pooldir, 'manage.lock')
+    sciluigi.util.write_atomically(agentpath, str(os.getpid()))
+    with sciluigi.util.FileLock(managelock):
+        startpath = os.path.join(pooldir, 'starting', agentid)
+        if os.path.exists(startpath):
+            os.remove(startpath)
+
+    running = {}
+    idle_since = time.time()
+    draining = False
+    while True:
+        os.utime(agentpath, None)
+        for cmdid, (proc, start) in list(running.items()):
+            if proc.poll() is not None:
+                del running[cmdid]
+                _finish_command(pooldir, cmdid, agentid, proc.returncode, start)
+        if not draining and time_limit is not None and command_seconds is not None \
+                and started + time_limit - time.time() < command_seconds:
+            log.info('Agent %s takes no new commands, with too little time left', agentid)
+            sciluigi.util.write_atomically(drainpath, '')
+            draining = True
+        while not draining and len(running) < slots:
+            cmdid = _claim_command(pooldir, agentid)
+            if cmdid is None:
+                break
+            running[cmdid] = (_start_command(pooldir, cmdid, launcher), time.time())
+        if running:
+            idle_since = time.time()
+        elif draining:
+            os.remove(agentpath)
+            os.remove(drainpath)
+            return
+        elif time.time() - idle_since >= idle_seconds:
+            # Exit under the lock, so that tasks queueing commands meanwhile
+            # start a new agent, rather than count on this one
+            with sciluigi.util.FileLock(managelock):
+                if not os.listdir(os.path.join(pooldir, 'queue')):
+                    os.remove(agentpath)
+                    return
+        time.sleep(check_interval)
+
+def _claim_command(pooldir, agentid):
+    '''
+    Take the oldest command from the queue, by moving it to the running
+    folder, and return its id (or None, if the queue is empty).
+    '''
+    for name in sorted(os.listdir(os.path.join(pooldir, 'queue'))):
+        if not name.endswith('.cmd'):
+            continue
+        cmdid = name[:-len('.cmd')]
+        try:
+            os.rename(os.path.join(pooldir, 'queue', name), os.path.join(pooldir, 'running', name))
+        except OSError:
+            # Taken by another agent
+            continue
+        sciluigi.util.write_atomically(os.path.join(pooldir, 'running', cmdid + '.agent'), agentid)
+        return cmdid
+    return None
+
+def _start_command(pooldir, cmdid, launcher):
+    '''
+    Start running a command, with its output going to the results folder.
+    '''
+    resultpath = os.path.join(pooldir, 'results', cmdid)
+    with open(resultpath + '.out', 'wb') as stdout, open(resultpath + '.err', 'wb') as stderr:
+        return sub.Popen('{launcher} bash {cmd}'.format(
+            launcher=launcher, cmd=os.path.join(pooldir, 'running', cmdid + '.cmd')),
+                         shell=True, stdout=stdout, stderr=stderr)
+
+def _finish_command(pooldir, cmdid, agentid, retcode, start):
+    '''
+    Write the exit status of a finished command, and clean it up.
+    '''
+    sciluigi.util.write_atomically(
+        os.path.join(pooldir, 'results', cmdid + '.rc'),
+        json.dumps({'retcode': retcode, 'agent': agentid, 'start': start, 'end': time.time()}))
+    for ext in ['.cmd', '.agent']:
+        os.remove(os.path.join(pooldir, 'running', cmdid + ext))
+
+# ==============================================================================
+
+def main(args=None):
+    '''
+    Commandline interface, running a pool agent.
+    '''
+    parser = argparse.ArgumentParser(description='Run a sciluigi SLURM pool agent')
+    parser.add_argument('pooldir', help='Folder of the pool')
+    parser.add_argument('agentid', help='Id of this agent')
+    parser.add_argument('--slots', type=int, default=1, help='Number of commands to run at once')
+    parser.add_argument('--idle-seconds', type=float, default=IDLE_SECONDS,
+                        help='Seconds without commands to run, before exiting')
+    parser.add_argument('--check-interval', type=float, default=CHECK_INTERVAL,
+                        help='Seconds between checks for new commands')
+    parser.add_argument('--launcher', default='', help='Command to launch commands with')
+    parser.add_argument('--time-limit', type=float, help='Seconds the agent may run')
+    parser.add_argument('--command-seconds', type=float,
+                        help='Seconds a command may run, for taking no new commands near the time limit')
+    opts = parser.parse_args(args)
+    run_agent(opts.pooldir, opts.agentid, opts.slots, opts.idle_seconds, opts.launcher,
+              opts.check_interval, opts.time_limit, opts.command_seconds)
+
+if __name__ == '__main__':
+    main()
@@ -5,14 +5,26 @@ import json
 import luigi
 from luigi.six import iteritems, string_types
 import logging
+import os
+import signal
 import subprocess as sub
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sciluigi.audit
 import sciluigi.interface
 import sciluigi.dependencies
+import sciluigi.executor
+import sciluigi.sampler
 import sciluigi.slurm
+import sciluigi.util
 
 log = logging.getLogger('sciluigi-interface')
 
+# Guards launching and registering of command processes, and byte counters
+_ex_lock = threading.Lock()
+
 # ==============================================================================
 
 def new_task(name, cls, workflow_task, **kwargs):
@@ -42,6 +54,168 @@ def new_task(name, cls, workflow_task, **kwargs):
         newtask.slurminfo = slurminfo
     return newtask
 
+# ==============================================================================
+
+class OutputCapture(object):
+    '''
+    Read the output of a command from a pipe in a background thread, optionally
+    writing it all to a file, while keeping only its first and last bytes in
+    memory (or all of it, if head_bytes is None).
+    '''
+    def __init__(self, pipe, path=None, head_bytes=4096, tail_bytes=65536):
+        self.path = path
+        self.nbytes = 0
+        self._head_bytes = head_bytes
+        self._tail_bytes = tail_bytes
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._thread = threading.Thread(target=self._read, args=(pipe,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read(self, pipe):
+        outfile = None
+        if self.path is not None:
+            dirpath = os.path.dirname(self.path)
+            if dirpath:
+                sciluigi.util.ensuredir(dirpath)
+            outfile = open(self.path, 'ab')
+        try:
+            while True:
+                chunk = os.read(pipe.fileno(), 65536)
+                if not chunk:
+                    break
+                self.nbytes += len(chunk)
+                if outfile is not None:
+                    outfile.write(chunk)
+                self._keep(chunk)
+        finally:
+            pipe.close()
+            if outfile is not None:
+                outfile.close()
+
+    def _keep(self, chunk):
+        '''
+        Add a chunk of output to the head buffer while it has room, and the
+        rest to the tail ring buffer.
+        '''
+        if self._head_bytes is None:
+            self._tail += chunk
+            return
+        if len(self._head) < self._head_bytes:
+            room = self._head_bytes - len(self._head)
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        self._tail += chunk
+        if len(self._tail) > self._tail_bytes:
+            del self._tail[:len(self._tail) - self._tail_bytes]
+
+    def join(self):
+        '''
+        Wait until all output has been read.
+        '''
+        self._thread.join()
+
+    def getvalue(self):
+        '''
+        Return the kept output, with a marker where bytes have been left out.
+        '''
+        omitted = self.nbytes - len(self._head) - len(self._tail)
+        if omitted > 0:
+            marker = '\n[... {n} bytes omitted ...]\n'.format(n=omitted).encode('utf-8')
+            return bytes(self._head) + marker + bytes(self._tail)
+        return bytes(self._head + self._tail)
+
+# Resource usage values recorded for commands: peak resident set size, user
+# and system CPU time, block input and output operations, and voluntary and
+# involuntary context switches
+RUSAGE_KEYS = ['maxrss_kb', 'utime_sec', 'stime_sec', 'inblock', 'oublock', 'nvcsw', 'nivcsw']
+
+def wait_process(proc):
+    '''
+    Wait for a process to finish, setting its returncode, and return its
+    resource usage (including that of its waited-for children, such as the
+    commands run by a shell), or None where os.wait4 is not available.
+    '''
+    if not hasattr(os, 'wait4'):
+        proc.wait()
+        return None
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # Already reaped elsewhere
+        proc.wait()
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+def rusage_to_dict(rusage):
+    '''
+    Convert a resource.struct_rusage into a dict with the keys in RUSAGE_KEYS.
+    '''
+    maxrss_kb = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        # Reported in bytes rather than kilobytes
+        maxrss_kb = maxrss_kb // 1024
+    return {
+        'maxrss_kb': maxrss_kb,
+        'utime_sec': rusage.ru_utime,
+        'stime_sec': rusage.ru_stime,
+        'inblock': rusage.ru_inblock,
+        'oublock': rusage.ru_oublock,
+        'nvcsw': rusage.ru_nvcsw,
+        'nivcsw': rusage.ru_nivcsw,
+    }
+
+# ==============================================================================
+
+class CommandFailedException(Exception):
+    '''
+    Exception to throw when a command executed by a task exits with a non-zero
+    return code.
+    '''
+    def __init__(self, message, retcode=None, stdout=None, stderr=None):
+        super(CommandFailedException, self).__init__(message)
+        self.retcode = retcode
+        self.stdout = stdout
+        self.stderr = stderr
+
+class CommandsFailedException(Exception):
+    '''
+    Exception to throw when one or more of the commands executed by
+    Task.ex_many() failed. The CommandResults of all commands are in results.
+    '''
+    def __init__(self, message, results):
+        super(CommandsFailedException, self).__init__(message)
+        self.results = results
+
+class CommandResult(object):
+    '''
+    The outcome of one of the commands executed by Task.ex_many()
+    '''
+    def __init__(self, command):
+        self.command = command
+        self.retcode = None
+        self.stdout = None
+        self.stderr = None
+        self.exectime_sec = None
+        self.error = None
+        self.cancelled = False
+
+    def __str__(self):
+        if self.cancelled:
+            status = 'cancelled'
+        elif self.error is not None:
+            status = 'failed (retcode {r})'.format(r=self.retcode)
+        else:
+            status = 'ok'
+        return '{status}: {cmd}'.format(status=status, cmd=self.command)
+
+# ==============================================================================
+
 class Task(sciluigi.audit.AuditTrailHelpers, sciluigi.dependencies.DependencyHelpers, luigi.Task):
     '''
     SciLuigi Task, implementing SciLuigi specific functionality for dependency resolution
@@ -50,18 +224,228 @@ class Task(sciluigi.audit.AuditTrailHelpers, sciluigi.dependencies.DependencyHel
     workflow_task = luigi.Parameter()
     instance_name = luigi.Parameter()
 
-    def ex_local(self, command):
+    # If True, ex_local() streams the output of commands to per-task log files
+    # (see get_cmdlog_path()), instead of holding all of it in memory
+    stream_output = False
+    # Number of bytes from the beginning and the end of streamed output, to
+    # keep in memory for return values and error messages
+    output_head_bytes = 4096
+    output_tail_bytes = 65536
+
+    # Number of cores the task may use, if declared. Limits the number of
+    # commands ex_many() runs at once.
+    cores = None
+
+    # Memory the task may use, in megabytes, if declared. Together with the
+    # cores, declared to luigi's scheduler as the resources cores and mem_mb,
+    # where the [resources] section of the luigi config file sets a total of
+    # them, so that tasks are only started while they fit, and accounted for
+    # in the node's slots, if the workflow has a budget (see sciluigi.slots)
+    mem_mb = None
+    _slot_scheduler = None
+    _slot_token = None
+
+    # Name of the executor to run commands through with ex(), or an
+    # Executor instance (see sciluigi.executor). If None, it is looked up in
+    # the config file, or the workflow.
+    executor = None
+    # Total seconds the task's commands have waited for slots in the executor
+    # (see sciluigi.executor.LocalPoolExecutor), written to the audit trail
+    # when the task finishes, if any did
+    executor_slot_wait_sec = None
+
+    # Total number of bytes that commands have written to stdout and stderr,
+    # written to the audit trail when the task finishes, if it ran any
+    stdout_bytes = 0
+    stderr_bytes = 0
+    _local_commands = 0
+
+    # Resource usage totals of all commands run by the task (see RUSAGE_KEYS)
+    rusage = None
+
+    # If True, the resource usage of the process trees of the task's local
+    # commands is sampled every sample_interval seconds while the task runs,
+    # and the samples are added to its audit info, as resource_samples (see
+    # sciluigi.sampler). Processes of other tasks running in the same worker
+    # process, as with run_fast(), are not included.
+    sample_resources = False
+    sample_interval = 1.0
+    _sampler = None
+
+    # Commands executed by the task, with start and end times, for the
+    # execution trace (see sciluigi.trace)
+    _trace_commands = None
+
+    # Processes started by ex_many() and still running, and whether the batch
+    # has been cancelled. Only set while ex_many() is running.
+    _batch_procs = None
+    _batch_cancelled = None
+
+    @luigi.Task.event_handler(luigi.Event.START)
+    def start_resource_sampler(self):
+        '''
+        Start sampling the resource usage of the task's commands, if
+        sample_resources is set.
+        '''
+        if isinstance(self, Task) and self.sample_resources:
+            self._sampler = sciluigi.sampler.ProcessTreeSampler(interval=self.sample_interval,
+                                                                commands_only=True)
+            self._sampler.start()
+
+    def process_resources(self):
+        '''
+        Implementation of Luigi API method, adding the task's cores and memory
+        (see get_local_resources()) to its resources, as cores and mem_mb, for
+        the ones that the [resources] section of the luigi config file sets a
+        total of. Amounts are capped at the totals, so that every task fits.
+        '''
+        resources = dict(super(Task, self).process_resources())
+        local = self.get_local_resources()
+        if local is None:
+            return resources
+        config = luigi.configuration.get_config()
+        for name, amount in zip(['cores', 'mem_mb'], local):
+            total = config.getint('resources', name, None)
+            if total is not None and amount and name not in resources:
+                resources[name] = min(amount, total)
+        return resources
+
+    @luigi.Task.event_handler(luigi.Event.START)
+    def acquire_node_slots(self):
+        '''
+        Take the task's cores and memory (see get_local_resources()) in the
+        node's slots, if the workflow has a budget, for accounting. Tasks are
+        held back by luigi's scheduler (see process_resources()), so this does
+        not wait.
+        '''
+        if not isinstance(self, Task) or self.workflow_task is None:
+            return
+        scheduler = self.workflow_task.get_slot_scheduler()
+        resources = self.get_local_resources()
+        if scheduler is None or resources is None:
+            return
+        cores, mem_mb = resources
+        self._slot_token = scheduler.acquire(self.instance_name, cores, mem_mb, wait=False)
+        self._slot_scheduler = scheduler
+        self.add_auditinfo('slot_cores', cores)
+        self.add_auditinfo('slot_mem_mb', mem_mb)
+
+    @luigi.Task.event_handler(luigi.Event.PROCESSING_TIME)
+    def release_node_slots_when_done(self, task_exectime_sec):
+        '''
+        Free the task's slots when it has finished running.
+        '''
+        if isinstance(self, Task):
+            self.release_node_slots()
+
+    @luigi.Task.event_handler(luigi.Event.FAILURE)
+    def release_node_slots_on_failure(self, exception):
+        '''
+        Free the task's slots when it has failed.
+        '''
+        if isinstance(self, Task):
+            self.release_node_slots()
+
+    def release_node_slots(self):
+        '''
+        Free the task's slots, if it holds any.
+        '''
+        if self._slot_token is not None:
+            self._slot_scheduler.release(self._slot_token)
+            self._slot_token = None
+
+    def get_local_resources(self):
+        '''
+        Return the cores and memory (in megabytes) the task uses on the local
+        node, as a tuple, or None if it uses none worth accounting for.
+        '''
+        return (int(self.cores or 1), int(self.mem_mb or 0))
+
+    def collect_final_auditinfo(self):
+        '''
+        Add the output and resource usage totals of the task's commands to
+        the audit info, and the commands themselves, if the workflow traces
+        its execution. Stop the resource sampler, if running, and add its
+        samples, and the peak values among them, too.
+        '''
+        with _ex_lock:
+            totals = dict(self.rusage) if self.rusage is not None else None
+            output_bytes = (self.stdout_bytes, self.stderr_bytes) if self._local_commands else None
+            slot_wait_sec = self.executor_slot_wait_sec
+        if output_bytes is not None:
+            self.add_auditinfo('stdout_bytes', output_bytes[0])
+            self.add_auditinfo('stderr_bytes', output_bytes[1])
+        if slot_wait_sec is not None:
+            self.add_auditinfo('executor_slot_wait_sec', '%.3f' % slot_wait_sec)
+        if totals is not None:
+            for key in RUSAGE_KEYS + ['commands']:
+                if isinstance(totals[key], float):
+                    self.add_auditinfo('rusage_' + key, '%.3f' % totals[key])
+                else:
+                    self.add_auditinfo('rusage_' + key, totals[key])
+        if self._sampler is not None:
+            samples = self._sampler.stop()
+            self._sampler = None
+            if samples:
+                self.add_auditinfo('sampled_peak_rss_kb', max(s['rss_kb'] for s in samples))
+                self.add_auditinfo('sampled_peak_cpu_pct', max(s['cpu_pct'] for s in samples))
+                self.add_auditinfo('resource_samples', samples)
+        if self._trace_commands and getattr(self.get_audit_workflow(), 'trace_execution', False):
+            self.add_auditinfo('trace_commands', self._trace_commands)
+
+    def get_cmdlog_path(self, streamname):
+        '''
+        Return the path of the file that the given output stream ('stdout' or
+        'stderr') of commands is streamed to, when stream_output is set.
+        '''
+        wflogpath = os.path.splitext(self.workflow_task.get_wflogpath())[0]
+        return os.path.join(wflogpath, '{name}.{stream}'.format(
+            name=self.instance_name, stream=streamname))
+
+    def ex_local(self, command, stdout_target=None, stderr_target=None):
         '''
         Execute command locally (not through resource manager).
+
+        If stream_output is set, or a target (TargetInfo, luigi target or path)
+        is given for stdout or stderr, output is streamed to files, and only
+        its beginning and end is returned.
         '''
         # If list, convert to string
         if isinstance(command, list):
             command = sub.list2cmdline(command)
 
         log.info('Executing command: ' + str(command))
-        proc = sub.Popen(command, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
-        stdout, stderr = proc.communicate()
+        streaming = self.stream_output or stdout_target is not None or stderr_target is not None
+        start = time.time()
+        proc = self._start_process(command)
+        if streaming:
+            stdout_path = _target_path(stdout_target, self.get_cmdlog_path('stdout'))
+            stderr_path = _target_path(stderr_target, self.get_cmdlog_path('stderr'))
+            captures = [OutputCapture(pipe, path, self.output_head_bytes, self.output_tail_bytes)
+                        for pipe, path in [(proc.stdout, stdout_path), (proc.stderr, stderr_path)]]
+        else:
+            captures = [OutputCapture(pipe, None, None, None) for pipe in [proc.stdout, proc.stderr]]
+        sampler = self._sampler
+        if sampler is not None:
+            sampler.add_command(proc.pid)
+        rusage = wait_process(proc)
+        if sampler is not None:
+            sampler.remove_command(proc.pid)
+        for capture in captures:
+            capture.join()
+        stdout, stderr = [capture.getvalue() for capture in captures]
+        stdout_bytes, stderr_bytes = [capture.nbytes for capture in captures]
         retcode = proc.returncode
+        self.trace_command('ex_local', command, start, time.time(), retcode=retcode)
+        self._forget_process(proc)
+        if rusage is not None:
+            self._add_rusage(command, rusage)
+
+        with _ex_lock:
+            self.stdout_bytes += stdout_bytes
+            self.stderr_bytes += stderr_bytes
+            self._local_commands += 1
+        log.debug('Command wrote %d bytes to stdout and %d bytes to stderr', stdout_bytes, stderr_bytes)
 
         if len(stderr) > 0:
             log.debug('Stderr from command: %s', stderr)
@@ -74,17 +458,212 @@ class Task(sciluigi.audit.AuditTrailHelpers, sciluigi.dependencies.DependencyHel
                     cmd=command,
                     out=stdout,
                     err=stderr)
+            if streaming:
+                errmsg += '\nFull output in: {out}, {err}'.format(out=stdout_path, err=stderr_path)
             log.error(errmsg)
-            raise Exception(errmsg)
+            raise CommandFailedException(errmsg, retcode, stdout, stderr)
 
         return (retcode, stdout, stderr)
 
+    def trace_command(self, kind, command, start, end, **extra):
+        '''
+        Record that a command was executed (by the method named by kind) from
+        start to end, for the execution trace. Extra keyword arguments are
+        stored with it. Returns the recorded entry, as a dict.
+        '''
+        entry = {'kind': kind, 'command': command, 'start': start, 'end': end,
+                 'thread': threading.current_thread().name}
+        entry.update(extra)
+        with _ex_lock:
+            if self._trace_commands is None:
+                self._trace_commands = []
+            self._trace_commands.append(entry)
+        return entry
+
+    def add_executor_slot_wait(self, wait_sec):
+        '''
+        Add the time a command waited for a slot in the executor to the
+        task's total, in executor_slot_wait_sec.
+        '''
+        with _ex_lock:
+            self.executor_slot_wait_sec = (self.executor_slot_wait_sec or 0.0) + wait_sec
+
+    def _add_rusage(self, command, rusage):
+        '''
+        Add the resource usage of a finished command to the task's totals (the
+        largest peak RSS, and sums of the other values) in self.rusage, which
+        are written to the audit trail when the task finishes.
+        '''
+        usage = rusage_to_dict(rusage)
+        log.info('Resource usage of command: %s: %s', command,
+                 ', '.join('%s=%s' % (key, usage[key]) for key in RUSAGE_KEYS))
+        with _ex_lock:
+            if self.rusage is None:
+                self.rusage = dict((key, 0) for key in RUSAGE_KEYS)
+                self.rusage['commands'] = 0
+            for key in RUSAGE_KEYS:
+                if key == 'maxrss_kb':
+                    self.rusage[key] = max(self.rusage[key], usage[key])
+                else:
+                    self.rusage[key] += usage[key]
+            self.rusage['commands'] += 1
+
+    def _start_process(self, command):
+        '''
+        Start a shell process for command. Within ex_many(), processes are
+        started in their own process group and registered, so that the whole
+        process tree can be terminated if the batch is cancelled.
+        '''
+        with _ex_lock:
+            if self._batch_procs is None:
+                return sub.Popen(command, shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+            if self._batch_cancelled.is_set():
+                raise Exception('Command cancelled: %s' % command)
+            proc = sub.Popen(command, shell=True, stdout=sub.PIPE, stderr=sub.PIPE,
+                             start_new_session=True)
+            self._batch_procs.add(proc)
+            return proc
+
+    def _forget_process(self, proc):
+        '''
+        Unregister a finished process started within ex_many()
+        '''
+        with _ex_lock:
+            if self._batch_procs is not None:
+                self._batch_procs.discard(proc)
+
+    def get_max_concurrency(self):
+        '''
+        Return the number of commands ex_many() runs at once by default: the
+        task's declared cores, or the number of CPUs if none are declared.
+        '''
+        if self.cores is not None:
+            return int(self.cores)
+        return os.cpu_count() or 1
+
+    def ex_many(self, commands, max_concurrency=None, fail_fast=True):
+        '''
+        Execute a batch of commands concurrently, each through ex(), running at
+        most max_concurrency commands at once (by default get_max_concurrency()).
+
+        Returns a list of CommandResults, in the order of the commands. If any
+        command fails, a CommandsFailedException is raised once all commands
+        are done. With fail_fast, the first failure cancels the commands not
+        yet started and terminates the ones running.
+        '''
+        if max_concurrency is None:
+            max_concurrency = self.get_max_concurrency()
+        results = [CommandResult(command) for command in commands]
+        log.info('Executing %d commands, at most %d at a time', len(results), max_concurrency)
+
+        start = time.time()
+        self._batch_procs = set()
+        self._batch_cancelled = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=max(1, int(max_concurrency)))
+        futures = []
+        try:
+            futures = [pool.submit(self._ex_batch_command, result) for result in results]
+            for future in as_completed(futures):
+                if not future.cancelled() and future.result().error is not None and fail_fast:
+                    self._cancel_batch(futures)
+        except BaseException:
+            self._cancel_batch(futures)
+            raise
+        finally:
+            pool.shutdown(wait=True)
+            self._batch_procs = None
+            self._batch_cancelled = None
+        for result in results:
+            if result.exectime_sec is None:
+                # Never started
+                result.cancelled = True
+
+        failed = [result for result in results if result.error is not None and not result.cancelled]
+        log.info('Executed %d commands in %.3fs (%d failed, %d cancelled)',
+                 len(results), time.time() - start, len(failed),
+                 len([result for result in results if result.cancelled]))
+        if failed:
+            errmsg = '{n} of {tot} commands failed:\n{res}'.format(
+                n=len(failed), tot=len(results), res='\n'.join(str(r) for r in results))
+            raise CommandsFailedException(errmsg, results)
+        return results
+
+    def _ex_batch_command(self, result):
+        '''
+        Execute one command of an ex_many() batch, filling in its result.
+        '''
+        if self._batch_cancelled.is_set():
+            result.cancelled = True
+            return result
+        start = time.time()
+        try:
+            ex_result = self.ex(result.command)
+            if ex_result is not None:
+                result.retcode, result.stdout, result.stderr = ex_result
+        except Exception as exc:
+            result.error = exc
+            result.retcode = getattr(exc, 'retcode', None)
+            result.cancelled = self._batch_cancelled.is_set()
+        result.exectime_sec = time.time() - start
+        return result
+
+    def _cancel_batch(self, futures):
+        '''
+        Cancel the commands of an ex_many() batch not yet started, and
+        terminate the process groups of those running.
+        '''
+        with _ex_lock:
+            if self._batch_cancelled.is_set():
+                return
+            self._batch_cancelled.set()
+            for future in futures:
+                future.cancel()
+            for proc in self._batch_procs:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
     def ex(self, command):
         '''
-        Execute command. This is a short-hand function, to be overridden e.g. if supporting
-        execution via SLURM
+        Execute command, through the task's executor (see get_executor()).
+        '''
+        return self.get_executor().execute(self, command)
+
+    def get_executor(self):
+        '''
+        Return the executor to run commands through, from the task, the luigi
+        config file or the workflow (see sciluigi.executor for the order), or
+        the default one of the task.
+        '''
+        config = luigi.configuration.get_config()
+        executor = self.executor
+        if executor is None:
+            executor = config.get(self.task_family, 'executor', None)
+        if executor is None:
+            for default in [getattr(self.workflow_task, 'executor', None),
+                            config.get('sciluigi', 'executor', None)]:
+                if default is not None and sciluigi.executor.get_executor(default).supports(self):
+                    executor = default
+                    break
+        if executor is None:
+            executor = self.get_default_executor()
+        return sciluigi.executor.get_executor(executor)
+
+    def get_default_executor(self):
+        '''
+        Return the name of the executor to use when none is set, to be
+        overridden e.g. if supporting execution via SLURM.
         '''
-        return self.ex_local(command)
+        return 'local'
+
+def _target_path(target, default):
+    '''
+    Return the path of a TargetInfo, luigi target or path string, or default if None.
+    '''
+    if target is None:
+        return default
+    return getattr(target, 'path', target)
 
 # ==============================================================================
 
@@ -0,0 +1,161 @@
+'''
+This module contains functionality for exporting the execution of a workflow
+as a trace in the Trace Event Format, viewable in chrome://tracing or Perfetto.
+
+The trace is built from the workflow's JSON lines audit file, where tasks
+record when they started and finished, and the commands they executed. It can
+also be written from the commandline:
+
+    python -m sciluigi.trace <audit .jsonl file> <trace .json file>
+'''
+
+import json
+import sys
+import sciluigi.audit
+
+# ==============================================================================
+
+# Process id used for all events in the trace
+TRACE_PID = 1
+# Thread id of the track showing the span of the whole workflow
+WORKFLOW_TID = 0
+
+# ==============================================================================
+
+def build_trace(records):
+    '''
+    Build a trace (as a dict in the Trace Event Format) from audit records.
+    There is one span per task, with nested spans for the commands the task
+    executed. Tasks are packed onto as few worker tracks as hold them without
+    overlap, as the process id a task ran in does not identify a worker: luigi
+    forks a process per task, and run_fast() runs tasks in threads of one.
+    '''
+    tasks = {}
+    for record in records:
+        info = record.get('info', {})
+        if 'trace_start' in info:
+            tasks.setdefault(record['instance_name'], {'record': record, 'info': {}})
+            tasks[record['instance_name']]['info'].update(info)
+    if not tasks:
+        return {'traceEvents': [], 'displayTimeUnit': 'ms'}
+
+    t0 = min(task['info']['trace_start'] for task in tasks.values())
+    t1 = max(task['info']['trace_end'] for task in tasks.values())
+    tracks = TrackIds()
+    worker_ends = []
+    lanes = {}
+    events = [_span('workflow', 'workflow', t0, t1, t0, WORKFLOW_TID)]
+
+    for instance_name in sorted(tasks, key=lambda name: tasks[name]['info']['trace_start']):
+        info = tasks[instance_name]['info']
+        worker = _free_lane(worker_ends, info['trace_start'], info['trace_end']) + 1
+        tid = tracks.get(worker, None)
+        args = {'task_family': tasks[instance_name]['record'].get('task_family'),
+                'failed': bool(info.get('trace_failed')),
+                'process': info.get('trace_worker')}
+        events.append(_span(instance_name, 'task', info['trace_start'], info['trace_end'],
+                            t0, tid, args))
+        for cmd in sorted(info.get('trace_commands', []), key=lambda cmd: cmd['start']):
+            lane = None
+            if cmd.get('thread', 'MainThread') != 'MainThread':
+                lane = _free_lane(lanes.setdefault(worker, []), cmd['start'], cmd['end'])
+            cmd_tid = tracks.get(worker, lane)
+            cmd_args = {'command': cmd['command'], 'retcode': cmd.get('retcode')}
+            events.append(_span(cmd['kind'], 'command', cmd['start'], cmd['end'], t0,
+                                cmd_tid, cmd_args))
+            slurm_sec = cmd.get('slurm_exectime_sec')
+            if slurm_sec is not None:
+                exec_start = max(cmd['start'], cmd['end'] - slurm_sec)
+                events.append(_span('slurm queue wait', 'slurm', cmd['start'], exec_start,
+                                    t0, cmd_tid, {'slurm_jobid': cmd.get('slurm_jobid')}))
+                events.append(_span('slurm execution', 'slurm', exec_start, cmd['end'],
+                                    t0, cmd_tid, {'slurm_jobid': cmd.get('slurm_jobid')}))
+
+    events.append(_thread_name(WORKFLOW_TID, 'workflow'))
+    for name, tid in tracks.names():
+        events.append(_thread_name(tid, name))
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_trace(records, path):
+    '''
+    Build a trace from audit records, and write it as JSON to path.
+    '''
+    with open(path, 'w') as tracefile:
+        json.dump(build_trace(records), tracefile)
+
+# ==============================================================================
+
+class TrackIds(object):
+    '''
+    Hand out numeric track (thread) ids per worker, and per lane of commands
+    executed concurrently within it (by ex_many()).
+    '''
+    def __init__(self):
+        self._ids = {}
+
+    def get(self, worker, lane=None):
+        '''
+        Return the track id of a worker, or of one of its lanes of concurrent
+        commands.
+        '''
+        key = (worker, lane)
+        if key not in self._ids:
+            self._ids[key] = len(self._ids) + 1
+        return self._ids[key]
+
+    def names(self):
+        '''
+        Return (track name, track id) tuples for all tracks handed out.
+        '''
+        names = []
+        for (worker, lane), tid in sorted(self._ids.items(), key=lambda item: item[1]):
+            name = 'worker %s' % worker
+            if lane is not None:
+                name += ' (concurrent %d)' % (lane + 1)
+            names.append((name, tid))
+        return names
+
+def _free_lane(lane_ends, start, end):
+    '''
+    Return the index of the first lane that is free at start, given the end
+    times of the last span in each lane, and occupy it until end.
+    '''
+    for lane, lane_end in enumerate(lane_ends):
+        if lane_end <= start:
+            lane_ends[lane] = end
+            return lane
+    lane_ends.append(end)
+    return len(lane_ends) - 1
+
+def _span(name, category, start, end, t0, tid, args=None):
+    '''
+    Return a complete ('X') event, with times converted to microseconds since t0.
+    '''
+    event = {'name': name, 'cat': category, 'ph': 'X', 'pid': TRACE_PID, 'tid': tid,
+             'ts': int((start - t0) * 1e6), 'dur': max(0, int((end - start) * 1e6))}
+    if args:
+        event['args'] = args
+    return event
+
+def _thread_name(tid, name):
+    '''
+    Return a metadata event naming a track.
+    '''
+    return {'name': 'thread_name', 'ph': 'M', 'pid': TRACE_PID, 'tid': tid,
+            'args': {'name': name}}
+
+# ==============================================================================
+
+def main(args=None):
+    '''
+    Commandline interface, writing a trace file from an audit file.
+    '''
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 2:
+        sys.stderr.write('Usage: python -m sciluigi.trace <audit .jsonl file> <trace .json file>\n')
+        sys.exit(1)
+    write_trace(sciluigi.audit.read_auditrecords(args[0]), args[1])
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,16 @@ sciluigi library
 '''
 
 import csv
+import errno
 import os
 import time
 from luigi.six import iteritems
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 def timestamp(datefmt='%Y-%m-%d, %H:%M:%S'):
     '''
     Create timestamp as a formatted string.
@@ -28,10 +34,13 @@ def timelog():
 
 def ensuredir(dirpath):
     '''
-    Ensure directory exists.
+    Ensure directory exists. Safe to call from concurrently running tasks.
     '''
-    if not os.path.exists(dirpath):
+    try:
         os.makedirs(dirpath)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST or not os.path.isdir(dirpath):
+            raise
 
 RECORDFILE_DELIMITER = ':'
 
@@ -54,3 +63,67 @@ def dict_to_recordfile(filehandle, records):
     for key, val in iteritems(records):
         rows.append([key, val])
     csvwt.writerows(rows)
+
+def percentile(values, pct):
+    '''
+    Return the pct:th percentile of a list of numbers, interpolating linearly
+    between the closest ranks. Returns None for an empty list.
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+def float_or_none(val):
+    '''
+    Convert audit values such as '12.345' to floats, or None if not possible.
+    '''
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+def task_name(task):
+    '''
+    Return the instance name of sciluigi tasks, or the task id of other tasks
+    '''
+    return getattr(task, 'instance_name', None) or task.task_id
+
+def parse_sbatch_jobid(stdout):
+    '''
+    Return the job id in the output of sbatch --parsable, which prints
+    "jobid" or "jobid;cluster".
+    '''
+    return stdout.decode('utf-8').strip().split(';')[0]
+
+class FileLock(object):
+    '''
+    Exclusive lock on a file, held within a with statement, shared between
+    processes (where fcntl is available).
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self._fd)
+        self._fd = None
+
+def write_atomically(path, content):
+    '''
+    Write content to a file through a rename, so that readers never see it
+    partially written.
+    '''
+    tmppath = '%s.tmp.%d' % (path, os.getpid())
+    with open(tmppath, 'w') as tmpfile:
+        tmpfile.write(content)
+    os.rename(tmppath, path)
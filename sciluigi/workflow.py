@@ -3,17 +3,30 @@ This module contains sciluigi's subclasses of luigi's Task class.
 '''
 
 import datetime
+import glob
+import json
 import luigi
 import logging
 import os
+import weakref
 import sciluigi
 import sciluigi.audit
+import sciluigi.auditdb
+import sciluigi.critpath
 import sciluigi.interface
 import sciluigi.dependencies
+import sciluigi.plan
+import sciluigi.slots
 import sciluigi.slurm
+import sciluigi.trace
+import sciluigi.util
 
 log = logging.getLogger('sciluigi-interface')
 
+# Trace info (see sciluigi.trace) kept in the audit report, for the critical
+# path analysis of sciluigi.critpath. The rest is only in the JSON lines file.
+REPORT_TRACE_INFO = ['trace_start', 'trace_end']
+
 # ==============================================================================
 
 class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
@@ -24,13 +37,72 @@ class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
 
     instance_name = luigi.Parameter(default='sciluigi_workflow')
 
-    _tasks = {}
+    # Set to True for workflows whose workflow() method may return a different
+    # graph each time it is called, to build the graph anew on every requires()
+    dynamic_workflow = False
+
+    # Number of times the graph was built by calling workflow(), and number of
+    # times the cached graph was used instead
+    workflow_builds = 0
+    workflow_cache_hits = 0
+
+    # If True, the workflow only keeps weak references to its tasks, so that
+    # tasks not referenced from anywhere else can be garbage collected
+    weak_task_refs = False
+    # If True, tasks are dropped from the workflow's registry as soon as they
+    # have finished successfully (only for tasks run in the same process)
+    release_finished_tasks = False
+
+    # Path to an SQLite database to also record audit info in, for querying
+    # with sciluigi.auditdb. Can also be set with audit_db in the [sciluigi]
+    # section of the luigi config file.
+    audit_db = None
+
+    # If True, the commands tasks execute are recorded in the audit file, and
+    # a trace of the workflow's execution is written next to it when the
+    # workflow finishes, for viewing in chrome://tracing or Perfetto (see
+    # sciluigi.trace)
+    trace_execution = False
+
+    # If True, tasks get luigi priorities from the length of the longest path
+    # from them to the end of the workflow, weighted by the runtimes of their
+    # classes in earlier runs (or counted in tasks, without history), so that
+    # long chains of tasks are started early. Tasks with a priority of their
+    # own are left as they are. Can also be turned on with auto_priority =
+    # true in the [sciluigi] section of the luigi config file.
+    auto_priority = False
+
+    # Budget of cores and memory (in megabytes) on the local node, that the
+    # cores and memory tasks declare are accounted for within (see
+    # sciluigi.slots). Can also be set with node_cores and node_mem_mb in the
+    # [sciluigi] section of the luigi config file, and defaults to cores and
+    # mem_mb in its [resources] section, which luigi's scheduler holds tasks
+    # back by. If only memory is set, the budget of cores is the number of CPUs.
+    node_cores = None
+    node_mem_mb = None
+    node_slots_dir = sciluigi.slots.SLOTS_DIR
+
+    # Name of the executor that tasks without an executor of their own run
+    # their commands through, or an Executor instance (see sciluigi.executor)
+    executor = None
+
+    _workflow_output = None
+    _historical_runtimes = None
+    _audit_history = None
+    _audit_backends = None
     _wfstart = ''
     _wflogpath = ''
     _hasloggedstart = False
     _hasloggedfinish = False
     _hasaddedhandler = False
 
+    def __init__(self, *args, **kwargs):
+        super(WorkflowTask, self).__init__(*args, **kwargs)
+        # Registry of this workflow's tasks, by instance name
+        self._tasks = {}
+        # Names of all tasks ever added, also after they are released
+        self._tasknames = set()
+
     def _ensure_timestamp(self):
         '''
         Make sure that there is a time stamp for when the workflow started.
@@ -49,14 +121,68 @@ class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
             self._wflogpath = logpath
         return self._wflogpath
 
-    def get_auditdirpath(self):
+    def get_auditjsonpath(self):
         '''
-        Get the path to the workflow-speicfic audit trail directory.
+        Get the path to the workflow-specific JSON lines file, that tasks write
+        their audit records to.
         '''
         self._ensure_timestamp()
         clsname = self.__class__.__name__.lower()
-        audit_dirpath = 'audit/.audit_%s_%s' % (clsname, self._wfstart)
-        return audit_dirpath
+        return 'audit/workflow_%s_started_%s.jsonl' % (clsname, self._wfstart)
+
+    def get_audit_backends(self):
+        '''
+        Get the audit backends that task audit records are written to.
+        '''
+        if self._audit_backends is None:
+            backends = [sciluigi.audit.JsonLinesAuditBackend(self.get_auditjsonpath())]
+            audit_db = self.get_audit_db_path()
+            if audit_db:
+                clsname = self.__class__.__name__.lower()
+                backends.append(sciluigi.auditdb.SqliteAuditBackend(
+                    audit_db,
+                    workflow=clsname,
+                    run_id='%s_%s' % (clsname, self._wfstart),
+                    started=self._wfstart))
+            self._audit_backends = backends
+        return self._audit_backends
+
+    def get_slot_scheduler(self):
+        '''
+        Get the scheduler accounting for the cores and memory in use within
+        the node's budget, or None if no budget is set.
+        '''
+        config = luigi.configuration.get_config()
+        cores = (self.node_cores or config.get('sciluigi', 'node_cores', None)
+                 or config.get('resources', 'cores', None))
+        mem_mb = (self.node_mem_mb or config.get('sciluigi', 'node_mem_mb', None)
+                  or config.get('resources', 'mem_mb', None))
+        if cores is None and mem_mb is None:
+            return None
+        return sciluigi.slots.NodeSlotScheduler(cores or os.cpu_count() or 1, mem_mb,
+                                                self.node_slots_dir)
+
+    def get_audit_db_path(self):
+        '''
+        Get the path to the SQLite audit database, if one is set (as audit_db,
+        or in the luigi config file), otherwise None.
+        '''
+        if self.audit_db is not None:
+            return self.audit_db
+        return luigi.configuration.get_config().get('sciluigi', 'audit_db', None)
+
+    def write_auditrecord(self, record):
+        '''
+        Write one audit record, to all of the workflow's audit backends.
+        '''
+        for backend in self.get_audit_backends():
+            backend.write(record)
+
+    def get_audit_workflow(self):
+        '''
+        The workflow task writes audit info to its own audit log.
+        '''
+        return self
 
     def get_auditlogpath(self):
         '''
@@ -67,11 +193,20 @@ class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
         audit_dirpath = 'audit/workflow_%s_started_%s.audit' % (clsname, self._wfstart)
         return audit_dirpath
 
+    def get_tracepath(self):
+        '''
+        Get the path to the workflow-specific execution trace file.
+        '''
+        self._ensure_timestamp()
+        clsname = self.__class__.__name__.lower()
+        return 'audit/workflow_%s_started_%s.trace.json' % (clsname, self._wfstart)
+
     def add_auditinfo(self, infotype, infolog):
         '''
         Add audit information to the audit log.
         '''
-        return self._add_auditinfo(self.__class__.__name__.lower(), infotype, infolog)
+        self._add_auditinfo(self.__class__.__name__.lower(), infotype, infolog)
+        self.flush_auditinfo()
 
     def workflow(self):
         '''
@@ -102,12 +237,123 @@ class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
             log.info('SciLuigi: %s Workflow Started (logging to %s)', clsname, self.get_wflogpath())
             log.info('-'*80)
             self._hasloggedstart = True
-        workflow_output = self.workflow()
-        if workflow_output is None:
-            clsname = self.__class__.__name__
-            raise Exception(('Nothing returned from workflow() method in the %s Workflow task. '
-                             'Forgot to add a return statement at the end?') % clsname)
-        return workflow_output
+        return self.get_workflow_output()
+
+    def get_workflow_output(self):
+        '''
+        Return the last task(s) of the workflow, as returned by workflow().
+        The graph is built only once per workflow instance, unless
+        dynamic_workflow is set, or clear_workflow_cache() is called.
+        '''
+        if self._workflow_output is None or self.dynamic_workflow:
+            workflow_output = self.workflow()
+            if workflow_output is None:
+                clsname = self.__class__.__name__
+                raise Exception(('Nothing returned from workflow() method in the %s Workflow task. '
+                                 'Forgot to add a return statement at the end?') % clsname)
+            self.workflow_builds += 1
+            self._workflow_output = workflow_output
+            if self.get_auto_priority():
+                self.assign_priorities(workflow_output)
+        else:
+            self.workflow_cache_hits += 1
+        return self._workflow_output
+
+    def get_auto_priority(self):
+        '''
+        Return whether tasks get priorities from the workflow graph (as set
+        with auto_priority, or in the luigi config file).
+        '''
+        if self.auto_priority:
+            return True
+        return luigi.configuration.get_config().getboolean('sciluigi', 'auto_priority', False)
+
+    def assign_priorities(self, workflow_output):
+        '''
+        Set the luigi priority of the tasks in the workflow graph from the
+        longest remaining path from each task (see auto_priority).
+        '''
+        tasks, requirements = sciluigi.critpath.workflow_graph(workflow_output)
+        runtimes = self.get_historical_runtimes()
+        if runtimes:
+            # Classes not seen before are assumed to take a typical time
+            default_sec = sciluigi.util.percentile(list(runtimes.values()), 50)
+            durations = dict((name, runtimes.get(task.task_family, default_sec))
+                             for name, task in tasks.items())
+        else:
+            durations = dict((name, 1.0) for name in tasks)
+        remaining = sciluigi.critpath.CriticalPathAnalysis(
+            requirements, durations).remaining_path_lengths()
+        # Priorities are ranks, so that they are small integers that still
+        # keep sub-second differences apart
+        ranks = dict((length, rank) for rank, length in enumerate(sorted(set(remaining.values())), 1))
+        for name, task in tasks.items():
+            if 'priority' not in task.__dict__ and task.priority == luigi.Task.priority:
+                task.priority = ranks[remaining[name]]
+        log.debug('Assigned priorities to %d tasks (%s)', len(tasks),
+                  'from runtime history' if runtimes else 'from depth, without runtime history')
+
+    def get_historical_runtimes(self):
+        '''
+        Return the median runtime of each task class (by task family) in
+        earlier runs of this workflow, from the audit database if one is set,
+        otherwise from the JSON lines audit files in the audit folder.
+        '''
+        if self._historical_runtimes is None:
+            clsname = self.__class__.__name__.lower()
+            audit_db = self.get_audit_db_path()
+            if audit_db:
+                auditdb = sciluigi.auditdb.AuditDB(audit_db)
+                try:
+                    stats = auditdb.runtime_percentiles(workflow=clsname, percentiles=(50,))
+                finally:
+                    auditdb.close()
+                runtimes = dict((family, stat['p50']) for family, stat in stats.items())
+            else:
+                runtimes = sciluigi.critpath.historical_runtimes(self.get_history_auditpaths())
+            self._historical_runtimes = runtimes
+        return self._historical_runtimes
+
+    def get_audit_history(self):
+        '''
+        Return the audit records of tasks in earlier runs of this workflow,
+        from the audit database if one is set, otherwise from the JSON lines
+        audit files in the audit folder.
+        '''
+        if self._audit_history is None:
+            audit_db = self.get_audit_db_path()
+            if audit_db:
+                self._ensure_timestamp()
+                clsname = self.__class__.__name__.lower()
+                auditdb = sciluigi.auditdb.AuditDB(audit_db)
+                try:
+                    records = auditdb.records(workflow=clsname)
+                finally:
+                    auditdb.close()
+                current = '%s_%s' % (clsname, self._wfstart)
+                records = [record for record in records if record['run_id'] != current]
+            else:
+                records = []
+                for path in self.get_history_auditpaths():
+                    records.extend(sciluigi.audit.read_auditrecords(path))
+            self._audit_history = records
+        return self._audit_history
+
+    def get_history_auditpaths(self):
+        '''
+        Return the JSON lines audit files of earlier runs of this workflow.
+        '''
+        clsname = self.__class__.__name__.lower()
+        current = self.get_auditjsonpath()
+        return [path for path in glob.glob('audit/workflow_%s_started_*.jsonl' % clsname)
+                if path != current]
+
+    def clear_workflow_cache(self):
+        '''
+        Drop the cached graph, so that workflow() is called again on the next
+        call to requires().
+        '''
+        self._workflow_output = None
 
     def output(self):
         '''
@@ -126,11 +372,30 @@ class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
             log.error(errmsg)
             raise Exception(errmsg)
         else:
+            auditinfo = {}
+            records = sciluigi.audit.read_auditrecords(self.get_auditjsonpath())
+            for record in records:
+                auditinfo.setdefault(record['instance_name'], []).extend(
+                        record.get('entries', record['info'].items()))
             with self.output()['audit'].open('w') as auditfile:
-                for taskname in sorted(self._tasks):
-                    taskaudit_path = os.path.join(self.get_auditdirpath(), taskname)
-                    if os.path.exists(taskaudit_path):
-                        auditfile.write(open(taskaudit_path).read() + '\n')
+                for taskname in sorted(self._tasknames):
+                    if taskname in auditinfo:
+                        auditfile.write('[%s]\n' % taskname)
+                        for infotype, infoval in auditinfo[taskname]:
+                            if infotype.startswith('trace_') and infotype not in REPORT_TRACE_INFO:
+                                continue
+                            if isinstance(infoval, (list, dict)):
+                                infoval = json.dumps(infoval)
+                            auditfile.write('%s: %s\n' % (infotype, infoval))
+                        auditfile.write('\n')
+            if self.trace_execution:
+                sciluigi.trace.write_trace(records, self.get_tracepath())
+            scheduler = self.get_slot_scheduler()
+            starts = [record['info']['trace_start'] for record in records
+                      if 'trace_start' in record['info']]
+            if scheduler is not None and starts:
+                log.info('Node utilisation: %s', sciluigi.slots.format_utilisation(
+                    scheduler.utilisation(since=min(starts))))
         clsname = self.__class__.__name__
         if not self._hasloggedfinish:
             log.info('-'*80)
@@ -138,14 +403,84 @@ class WorkflowTask(sciluigi.audit.AuditTrailHelpers, luigi.Task):
             log.info('-'*80)
             self._hasloggedfinish = True
 
+    def plan(self, workers=sciluigi.plan.DEFAULT_PLAN_WORKERS):
+        '''
+        Dry-run the workflow: check which of its tasks are complete, which will
+        run, and which are blocked, without running anything. Completeness is
+        checked concurrently, on a pool of the given number of threads.
+        '''
+        wfplan = sciluigi.plan.plan_workflow(self, workers=workers)
+        log.info(wfplan.summary())
+        return wfplan
+
     def new_task(self, instance_name, cls, **kwargs):
         '''
         Create new task instance, and link it to the current workflow.
         '''
         newtask = sciluigi.new_task(instance_name, cls, self, **kwargs)
-        self._tasks[instance_name] = newtask
+        if self.weak_task_refs:
+            self._tasks[instance_name] = weakref.ref(newtask)
+        else:
+            self._tasks[instance_name] = newtask
+        self._tasknames.add(instance_name)
         return newtask
 
+    def get_task(self, instance_name):
+        '''
+        Return the task with the given instance name, or None if it has been
+        released (or garbage collected, when using weak references).
+        '''
+        task = self._tasks.get(instance_name)
+        if isinstance(task, weakref.ref):
+            task = task()
+        return task
+
+    def get_tasks(self):
+        '''
+        Return a dict of all tasks still held by the workflow, by instance name.
+        '''
+        tasks = {}
+        for instance_name in list(self._tasks):
+            task = self.get_task(instance_name)
+            if task is not None:
+                tasks[instance_name] = task
+        return tasks
+
+    def release_task(self, instance_name):
+        '''
+        Drop the workflow's reference to a task. Its audit info is still
+        included in the workflow's audit log.
+        '''
+        self._tasks.pop(instance_name, None)
+
+    def release_tasks(self, finished_only=True):
+        '''
+        Drop the workflow's references to its finished tasks, or to all tasks,
+        and then also the cached workflow graph.
+
+        Note that luigi's instance cache also keeps tasks alive, unless it is
+        turned off with luigi.task_register.Register.disable_instance_cache().
+        '''
+        for instance_name in list(self._tasks):
+            task = self.get_task(instance_name)
+            if task is None or not finished_only or task.complete():
+                self.release_task(instance_name)
+        if not finished_only:
+            self.clear_workflow_cache()
+
+# ================================================================================
+
+@luigi.Task.event_handler(luigi.Event.SUCCESS)
+def release_finished_task(task):
+    '''
+    Drop finished tasks from their workflow's registry, for workflows with
+    release_finished_tasks set.
+    '''
+    workflow_task = getattr(task, 'workflow_task', None)
+    if isinstance(workflow_task, WorkflowTask) and workflow_task.release_finished_tasks:
+        if workflow_task.get_task(task.instance_name) is task:
+            workflow_task.release_task(task.instance_name)
+
 # ================================================================================
 
 class WorkflowNotImplementedException(Exception):
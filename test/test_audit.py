@@ -0,0 +1,101 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class TestJsonLinesAuditBackend(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'audit', 'wf.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_concurrent_writes(self):
+        backend = sl.audit.JsonLinesAuditBackend(self.path)
+        def write_records(thread_no):
+            for i in range(50):
+                backend.write({'instance_name': 't%d' % thread_no, 'info': {'i': i, 'pad': 'x' * 5000}})
+        threads = [threading.Thread(target=write_records, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        records = backend.read()
+        self.assertEqual(len(records), 400)
+        self.assertEqual(sorted(r['info']['i'] for r in records if r['instance_name'] == 't3'),
+                         list(range(50)))
+
+    def test_skips_broken_lines(self):
+        backend = sl.audit.JsonLinesAuditBackend(self.path)
+        backend.write({'instance_name': 'a', 'info': {}})
+        with open(self.path, 'a') as auditfile:
+            auditfile.write('{"instance_name": "b", "inf')
+        self.assertEqual([r['instance_name'] for r in backend.read()], ['a'])
+
+
+class AuditedTask(sl.Task):
+    fail = luigi.BoolParameter()
+
+    def out_data(self):
+        return sl.TargetInfo(self, '/tmp/audited_task_never_written.txt')
+
+    def run(self):
+        self.add_auditinfo('custom_info', 42)
+        self.add_auditinfo('slurm_jobid', '101')
+        self.add_auditinfo('slurm_jobid', '102')
+        if self.fail:
+            raise Exception('Failing on purpose')
+
+
+class TestAuditTrail(unittest.TestCase):
+    def setUp(self):
+        self.wf = sl.WorkflowTask(instance_name='audit_trail_wf')
+
+    def tearDown(self):
+        path = self.wf.get_auditjsonpath()
+        if os.path.exists(path):
+            os.remove(path)
+
+    def test_auditinfo_is_buffered(self):
+        task = self.wf.new_task('audited', AuditedTask, fail=False)
+        task.run()
+        self.assertEqual(self.wf.get_audit_backends()[0].read(), [])
+        task.trigger_event(luigi.Event.PROCESSING_TIME, task, 1.5)
+        records = self.wf.get_audit_backends()[0].read()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['instance_name'], 'audited')
+        self.assertEqual(records[0]['info']['custom_info'], 42)
+        self.assertEqual(records[0]['info']['task_exectime_sec'], '1.500')
+
+    def test_auditinfo_is_flushed_on_failure(self):
+        w = luigi.worker.Worker()
+        task = self.wf.new_task('audited_failing', AuditedTask, fail=True)
+        w.add(task)
+        w.run()
+        records = self.wf.get_audit_backends()[0].read()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['info']['custom_info'], 42)
+        self.assertTrue(records[0]['info']['trace_failed'])
+
+    def test_repeated_infotypes_are_kept(self):
+        task = self.wf.new_task('audited', AuditedTask, fail=False)
+        task.run()
+        task.trigger_event(luigi.Event.PROCESSING_TIME, task, 1.5)
+        record = self.wf.get_audit_backends()[0].read()[0]
+        self.assertEqual([val for infotype, val in record['entries'] if infotype == 'slurm_jobid'],
+                         ['101', '102'])
+        self.assertEqual(record['info']['slurm_jobid'], '102')
+        self.wf.run()
+        with self.wf.output()['audit'].open() as auditfile:
+            report = auditfile.read()
+        os.remove(self.wf.get_auditlogpath())
+        self.assertIn('slurm_jobid: 101\nslurm_jobid: 102\n', report)
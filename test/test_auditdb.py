@@ -0,0 +1,95 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+def make_record(instance_name, task_family, exectime, **info):
+    info['task_exectime_sec'] = '%.3f' % exectime
+    return {'instance_name': instance_name, 'task_family': task_family,
+            'task_id': '%s_%s' % (task_family, instance_name), 'time': 0.0,
+            'params': {'instance_name': instance_name}, 'info': info}
+
+
+class TestAuditDB(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbpath = os.path.join(self.tmpdir, 'audit.db')
+        for run_no, factor in enumerate([1.0, 2.0]):
+            backend = sl.auditdb.SqliteAuditBackend(
+                self.dbpath, 'mywf', 'mywf_run%d' % run_no, '2016010%d' % run_no)
+            for i in range(1, 11):
+                backend.write(make_record('align_%d' % i, 'Align', i * factor))
+            backend.write(make_record('merge', 'Merge', 100.0 * factor))
+            backend.write(make_record('merge', 'Merge', 100.0 * factor,
+                                      slurm_exectime_sec=90, slurm_jobid='123'))
+        self.auditdb = sl.AuditDB(self.dbpath)
+
+    def tearDown(self):
+        self.auditdb.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_records_are_merged(self):
+        merges = self.auditdb.records(task_family='Merge')
+        self.assertEqual(len(merges), 2)
+        self.assertEqual(merges[0]['slurm_exectime_sec'], 90.0)
+        self.assertEqual(merges[0]['slurm_jobid'], '123')
+        self.assertEqual(merges[0]['params'], {'instance_name': 'merge'})
+
+    def test_slowest_tasks(self):
+        slowest = self.auditdb.slowest_tasks(limit=2)
+        self.assertEqual([(r['run_id'], r['instance_name']) for r in slowest],
+                         [('mywf_run1', 'merge'), ('mywf_run0', 'merge')])
+        slowest = self.auditdb.slowest_tasks(limit=1, run_id='mywf_run0')
+        self.assertEqual(slowest[0]['task_exectime_sec'], 100.0)
+
+    def test_runtime_percentiles(self):
+        stats = self.auditdb.runtime_percentiles()
+        self.assertEqual(stats['Align']['count'], 20)
+        self.assertAlmostEqual(stats['Align']['p50'], 7.5)
+        self.assertEqual(stats['Merge']['p95'], 195.0)
+
+    def test_runtime_trend(self):
+        trend = self.auditdb.runtime_trend(task_family='Align')
+        self.assertEqual([r['run_id'] for r in trend], ['mywf_run0', 'mywf_run1'])
+        self.assertEqual([r['total_sec'] for r in trend], [55.0, 110.0])
+
+
+class AuditDBTask(sl.Task):
+    def out_data(self):
+        return sl.TargetInfo(self, '/tmp/auditdbtask_never_written.txt')
+
+    def run(self):
+        pass
+
+
+class AuditDBWf(sl.WorkflowTask):
+    def workflow(self):
+        return self.new_task('task', AuditDBTask)
+
+
+class TestWorkflowAuditDB(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_workflow_writes_to_db(self):
+        wf = AuditDBWf()
+        wf.audit_db = os.path.join(self.tmpdir, 'audit.db')
+        task = wf.get_workflow_output()
+        task.trigger_event(luigi.Event.PROCESSING_TIME, task, 2.0)
+        auditdb = sl.AuditDB(wf.audit_db)
+        records = auditdb.records()
+        auditdb.close()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['workflow'], 'auditdbwf')
+        self.assertEqual(records[0]['task_exectime_sec'], 2.0)
+        os.remove(wf.get_auditjsonpath())
@@ -0,0 +1,144 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class CritPathTask(sl.Task):
+    def out_data(self):
+        return sl.TargetInfo(self, '/tmp/critpath_%s.txt' % self.instance_name)
+
+
+class CritPathWf(sl.WorkflowTask):
+    '''
+    a -> b -> d
+    a -> c -> d
+    '''
+    def workflow(self):
+        tasks = dict((name, self.new_task(name, CritPathTask)) for name in 'abcd')
+        tasks['b'].in_data = tasks['a'].out_data
+        tasks['c'].in_data = tasks['a'].out_data
+        tasks['d'].in_b = tasks['b'].out_data
+        tasks['d'].in_c = tasks['c'].out_data
+        return tasks['d']
+
+
+class TestCriticalPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.auditpath = os.path.join(self.tmpdir, 'workflow.audit')
+        with open(self.auditpath, 'w') as auditfile:
+            for name, sec in [('a', 1.0), ('b', 5.0), ('c', 2.0), ('d', 1.0)]:
+                auditfile.write('[%s]\ntask_exectime_sec: %.3f\ninstance_name: %s\n\n' % (name, sec, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_from_auditreport(self):
+        wf = CritPathWf(instance_name='critpath_wf')
+        analysis = sl.CriticalPathAnalysis.from_auditreport(wf, self.auditpath)
+        self.assertEqual(analysis.requirements['d'], ['b', 'c'])
+        self.assertEqual(analysis.critical_path(), (7.0, ['a', 'b', 'd']))
+        self.assertEqual(analysis.total_work, 9.0)
+        self.assertEqual(analysis.parallelism_profile(), [(0.0, 1), (1.0, 2), (3.0, 1), (7.0, 0)])
+        self.assertEqual(analysis.min_makespan(1), 9.0)
+        self.assertEqual(analysis.min_makespan(2), 7.0)
+        self.assertEqual(analysis.simulate_makespan(2), 7.0)
+        self.assertIn('Critical path: 7.000s', analysis.report())
+
+    def test_simulated_makespan_prefers_long_paths(self):
+        # Starting the short independent task first would give a makespan of 4
+        analysis = sl.CriticalPathAnalysis(
+            {'short': [], 'long1': [], 'long2': ['long1']},
+            {'short': 1.0, 'long1': 1.5, 'long2': 1.5})
+        self.assertEqual(analysis.simulate_makespan(1), 4.0)
+        self.assertEqual(analysis.simulate_makespan(2), 3.0)
+        self.assertEqual(analysis.remaining_path_lengths()['long1'], 3.0)
+
+    def test_cycle(self):
+        with self.assertRaises(Exception):
+            sl.CriticalPathAnalysis({'a': ['b'], 'b': ['a']}, {})
+
+
+class FastTask(CritPathTask):
+    pass
+
+
+class SlowTask(CritPathTask):
+    pass
+
+
+class PinnedTask(CritPathTask):
+    priority = 100
+
+
+class PriorityWf(sl.WorkflowTask):
+    '''
+    fast1 -> fast2 -> end
+    slow ----------> end
+    pinned --------> end
+    '''
+    auto_priority = True
+
+    def workflow(self):
+        fast1 = self.new_task('fast1', FastTask)
+        fast2 = self.new_task('fast2', FastTask)
+        slow = self.new_task('slow', SlowTask)
+        pinned = self.new_task('pinned', PinnedTask)
+        end = self.new_task('end', FastTask)
+        fast2.in_data = fast1.out_data
+        end.in_fast = fast2.out_data
+        end.in_slow = slow.out_data
+        end.in_pinned = pinned.out_data
+        return end
+
+
+class TestAutoPriority(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def priorities(self, wf):
+        wf.get_workflow_output()
+        return dict((name, task.priority) for name, task in wf.get_tasks().items())
+
+    def test_priorities_from_depth(self):
+        wf = PriorityWf(instance_name='priority_depth_wf')
+        wf.audit_db = os.path.join(self.tmpdir, 'empty.db')
+        prios = self.priorities(wf)
+        self.assertGreater(prios['fast1'], prios['fast2'])
+        self.assertGreater(prios['fast2'], prios['end'])
+        self.assertEqual(prios['fast2'], prios['slow'])
+        self.assertEqual(prios['pinned'], 100)
+
+    def test_off_by_default(self):
+        config = luigi.configuration.get_config()
+        wf = CritPathWf(instance_name='priority_default_wf')
+        self.assertEqual(set(self.priorities(wf).values()), set([luigi.Task.priority]))
+        config.set('sciluigi', 'auto_priority', 'true')
+        try:
+            wf = CritPathWf(instance_name='priority_config_wf')
+            wf.audit_db = os.path.join(self.tmpdir, 'empty.db')
+            self.assertGreater(self.priorities(wf)['a'], self.priorities(wf)['d'])
+        finally:
+            config.remove_option('sciluigi', 'auto_priority')
+
+    def test_priorities_from_history(self):
+        dbpath = os.path.join(self.tmpdir, 'audit.db')
+        backend = sl.auditdb.SqliteAuditBackend(dbpath, 'prioritywf', 'earlier_run', '20200101')
+        for task_id, family, sec in [('f1', 'FastTask', '1.0'), ('s1', 'SlowTask', '10.0')]:
+            backend.write({'instance_name': task_id, 'task_family': family, 'task_id': task_id,
+                           'time': 0.0, 'info': {'task_exectime_sec': sec}})
+        wf = PriorityWf(instance_name='priority_history_wf')
+        wf.audit_db = dbpath
+        prios = self.priorities(wf)
+        self.assertGreater(prios['slow'], prios['fast1'])
+        self.assertGreater(prios['fast1'], prios['fast2'])
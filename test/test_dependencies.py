@@ -84,3 +84,107 @@ class TestMultiInOutWorkflow(unittest.TestCase):
 
     def tearDown(self):
         pass
+
+class CountingOutTask(sl.Task):
+    an_id = luigi.Parameter()
+    calls = 0
+
+    def out_data(self):
+        self.calls += 1
+        return sl.TargetInfo(self, '/tmp/counting_%s_%d.txt' % (self.an_id, self.calls))
+
+class TestOutputPortCache(unittest.TestCase):
+    def setUp(self):
+        self.wf = sl.WorkflowTask(instance_name='portcache_wf')
+
+    def tearDown(self):
+        sl.DependencyHelpers.strict_ports = False
+
+    def test_output_is_cached(self):
+        task = self.wf.new_task('counting', CountingOutTask, an_id='cached')
+        first = task.output()
+        second = task.output()
+        self.assertEqual(task.calls, 1)
+        self.assertEqual([t.path for t in first], [t.path for t in second])
+
+    def test_clear_port_cache(self):
+        task = self.wf.new_task('counting', CountingOutTask, an_id='cleared')
+        task.output()
+        task.clear_port_cache()
+        outs = task.output()
+        self.assertEqual(task.calls, 2)
+        self.assertEqual(outs[0].path, '/tmp/counting_cleared_2.txt')
+
+    def test_strict_ports_raises_on_change(self):
+        sl.DependencyHelpers.strict_ports = True
+        task = self.wf.new_task('counting', CountingOutTask, an_id='strict')
+        task.output()
+        self.assertRaises(sl.dependencies.PortChangedException, task.output)
+
+class TestPortRegistry(unittest.TestCase):
+    def setUp(self):
+        self.wf = sl.WorkflowTask(instance_name='portregistry_wf')
+
+    def test_class_registry(self):
+        self.assertEqual(MultiOutTask._outport_names, ('out_multi',))
+        self.assertEqual(MultiInTask._inport_names, ('in_multi',))
+        self.assertEqual(MultiOutTask._inport_names, ())
+
+    def test_instance_assignment_updates_registry(self):
+        tout = self.wf.new_task('tout', MultiOutTask, an_id='reg')
+        tin = self.wf.new_task('tin_registry', MultiInTask)
+        tin.in_extra = tout.out_multi
+        self.assertEqual(tin._inport_names, ('in_multi', 'in_extra'))
+        self.assertEqual(MultiInTask._inport_names, ('in_multi',))
+        self.assertEqual(tin.requires(), [tout])
+
+    def test_rewiring_clears_port_cache(self):
+        touta = self.wf.new_task('tout', MultiOutTask, an_id='rewire_a')
+        toutb = self.wf.new_task('tout', MultiOutTask, an_id='rewire_b')
+        tin = self.wf.new_task('tin_rewire', MultiInTask)
+        tin.in_multi = touta.out_multi
+        self.assertTrue(tin.output()[0].path.startswith('/tmp/out_rewire_a'))
+        tin.in_multi = touta.out_multi
+        self.assertIsNotNone(tin._outport_cache)
+        tin.in_multi = toutb.out_multi
+        self.assertTrue(tin.output()[0].path.startswith('/tmp/out_rewire_b'))
+
+class TestUpstreamResolution(unittest.TestCase):
+    def setUp(self):
+        self.wf = sl.WorkflowTask(instance_name='upstream_wf')
+
+    def test_fanin_is_deduplicated(self):
+        touts = [self.wf.new_task('tout_%d' % i, MultiOutTask, an_id='fanin_%d' % i)
+                 for i in s.range(3)]
+        tin = self.wf.new_task('tin_fanin', MultiInTask)
+        tin.in_multi = [touts[0].out_multi, {'b': touts[1].out_multi(), 'c': touts[0].out_multi}]
+        tin.in_other = touts[2].out_multi()[0]
+        self.assertEqual(tin.requires(), [touts[0], touts[1], touts[2]])
+
+    def test_deep_nesting(self):
+        tout = self.wf.new_task('tout_deep', MultiOutTask, an_id='deep')
+        nested = tout.out_multi()[0]
+        for _ in s.range(10000):
+            nested = [nested]
+        tin = self.wf.new_task('tin_deep', MultiInTask)
+        tin.in_multi = nested
+        self.assertEqual(tin.requires(), [tout])
+
+class TestTargetInfo(unittest.TestCase):
+    def test_target_is_created_lazily(self):
+        tinfo = sl.TargetInfo(None, '/tmp/lazy_target.txt')
+        self.assertFalse(hasattr(tinfo, '__dict__'))
+        self.assertIsNone(tinfo._target)
+        self.assertIsInstance(tinfo.target, luigi.LocalTarget)
+        self.assertEqual(tinfo.target.path, '/tmp/lazy_target.txt')
+        self.assertIs(tinfo.target, tinfo.target)
+
+    def test_tmp_target_gets_path(self):
+        tinfo = sl.TargetInfo(None, None, is_tmp=True)
+        self.assertIsNotNone(tinfo.path)
+        self.assertEqual(tinfo.path, tinfo.target.path)
+
+    def test_s3_target_is_created_lazily(self):
+        tinfo = sl.S3TargetInfo(None, 's3://bucket/key.txt')
+        self.assertIsNone(tinfo._target)
+        self.assertEqual(tinfo.path, 's3://bucket/key.txt')
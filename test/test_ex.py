@@ -0,0 +1,142 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.CRITICAL)
+
+
+class ExTask(sl.Task):
+    def out_none(self):
+        return []
+
+
+class StreamingExTask(ExTask):
+    stream_output = True
+    output_head_bytes = 10
+    output_tail_bytes = 100
+
+
+class TestStreamingEx(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.wf = sl.WorkflowTask(instance_name='ex_wf')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        shutil.rmtree(os.path.splitext(self.wf.get_wflogpath())[0], ignore_errors=True)
+
+    def test_buffered(self):
+        task = self.wf.new_task('buffered', ExTask)
+        retcode, stdout, stderr = task.ex_local('echo hej; echo hopp >&2')
+        self.assertEqual((retcode, stdout, stderr), (0, b'hej\n', b'hopp\n'))
+        self.assertEqual((task.stdout_bytes, task.stderr_bytes), (4, 5))
+        task.ex_local('echo hej')
+        task.collect_final_auditinfo()
+        self.assertEqual([e for e in task._auditinfo['buffered'] if e[0].endswith('_bytes')],
+                         [('stdout_bytes', 8), ('stderr_bytes', 5)])
+
+    def test_streaming_to_log_files(self):
+        task = self.wf.new_task('streaming', StreamingExTask)
+        _, stdout, stderr = task.ex_local('head -c 100000 /dev/zero | tr "\\0" "a"; echo err >&2')
+        self.assertEqual(task.stdout_bytes, 100000)
+        self.assertTrue(stdout.startswith(b'a' * 10 + b'\n[... 99890 bytes omitted ...]\n'))
+        self.assertTrue(stdout.endswith(b'a' * 100))
+        self.assertEqual(stderr, b'err\n')
+        with open(task.get_cmdlog_path('stdout'), 'rb') as logfile:
+            self.assertEqual(len(logfile.read()), 100000)
+
+    def test_streaming_to_target(self):
+        task = self.wf.new_task('streaming_target', ExTask)
+        outpath = os.path.join(self.tmpdir, 'out.txt')
+        task.ex_local('echo hej', stdout_target=sl.TargetInfo(task, outpath))
+        with open(outpath) as outfile:
+            self.assertEqual(outfile.read(), 'hej\n')
+
+    def test_streaming_failure_shows_tail(self):
+        task = self.wf.new_task('streaming_fail', StreamingExTask)
+        with self.assertRaises(Exception) as ctx:
+            task.ex_local('seq 1 1000 >&2; exit 3')
+        self.assertIn('retcode 3', str(ctx.exception))
+        self.assertIn('999\\n1000', str(ctx.exception))
+        self.assertIn(task.get_cmdlog_path('stderr'), str(ctx.exception))
+
+
+class BatchExTask(ExTask):
+    cores = 2
+
+
+class TestExMany(unittest.TestCase):
+    def setUp(self):
+        self.wf = sl.WorkflowTask(instance_name='ex_many_wf')
+
+    def test_runs_concurrently(self):
+        task = self.wf.new_task('batch', BatchExTask)
+        self.assertEqual(task.get_max_concurrency(), 2)
+        results = task.ex_many(['sleep 0.3; echo %d' % i for i in range(4)])
+        # Two commands at a time, going by the spans they ran in
+        spans = [(cmd['start'], cmd['end']) for cmd in task._trace_commands]
+        self.assertEqual(len(spans), 4)
+        running = [sum(1 for start, end in spans if start <= t < end) for t, _ in spans]
+        self.assertEqual(max(running), 2)
+        self.assertEqual([r.stdout for r in results], [b'0\n', b'1\n', b'2\n', b'3\n'])
+        self.assertEqual([r.retcode for r in results], [0] * 4)
+        self.assertTrue(all(r.exectime_sec >= 0.3 for r in results))
+
+    def test_fail_fast(self):
+        task = self.wf.new_task('batch_fail', BatchExTask)
+        start = time.time()
+        with self.assertRaises(sl.task.CommandsFailedException) as ctx:
+            task.ex_many(['sleep 0.1; exit 4', 'sleep 0.3; sleep 10', 'sleep 10', 'echo never'])
+        self.assertLess(time.time() - start, 5)
+        results = ctx.exception.results
+        self.assertEqual(results[0].retcode, 4)
+        self.assertFalse(results[0].cancelled)
+        self.assertTrue(all(r.cancelled for r in results[1:]))
+
+    def test_no_fail_fast(self):
+        task = self.wf.new_task('batch_nofail', BatchExTask)
+        with self.assertRaises(sl.task.CommandsFailedException) as ctx:
+            task.ex_many(['exit 1', 'echo hej'], fail_fast=False)
+        results = ctx.exception.results
+        self.assertEqual([r.retcode for r in results], [1, 0])
+        self.assertEqual(results[1].stdout, b'hej\n')
+
+    def test_slurm_task_uses_threads(self):
+        task = self.wf.new_task('slurm_batch', sl.SlurmTask,
+            slurminfo=sl.SlurmInfo(sl.RUNMODE_LOCAL, 'proj', 'core', 1, '1:00', 'job', 3))
+        self.assertEqual(task.get_max_concurrency(), 3)
+        results = task.ex_many(['echo a', 'echo b'])
+        self.assertEqual([r.stdout for r in results], [b'a\n', b'b\n'])
+
+
+class TestResourceUsage(unittest.TestCase):
+    def setUp(self):
+        self.wf = sl.WorkflowTask(instance_name='rusage_wf')
+
+    def test_rusage_is_recorded(self):
+        task = self.wf.new_task('rusage', ExTask)
+        task.ex_local('python -c "x = bytearray(64 * 1024 * 1024); x[::4096] = b\'a\' * len(x[::4096])"')
+        task.ex_local('echo hej')
+        self.assertGreater(task.rusage['maxrss_kb'], 60000)
+        self.assertEqual(task.rusage['commands'], 2)
+        self.assertGreater(task.rusage['utime_sec'] + task.rusage['stime_sec'], 0)
+        # The totals are written once, when the task finishes
+        self.assertNotIn('rusage_commands', dict((task._auditinfo or {}).get('rusage', [])))
+        task.collect_final_auditinfo()
+        entries = task._auditinfo['rusage']
+        self.assertEqual(len([e for e in entries if e[0] == 'rusage_commands']), 1)
+        auditinfo = dict(entries)
+        self.assertEqual(auditinfo['rusage_maxrss_kb'], task.rusage['maxrss_kb'])
+        self.assertEqual(auditinfo['rusage_commands'], 2)
+
+    def test_returncode_from_signal(self):
+        task = self.wf.new_task('rusage_signal', ExTask)
+        with self.assertRaises(sl.task.CommandFailedException) as ctx:
+            task.ex_local('kill -9 $$')
+        self.assertEqual(ctx.exception.retcode, -9)
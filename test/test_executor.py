@@ -0,0 +1,107 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class ExecTask(sl.Task):
+    pass
+
+
+class PoolExecTask(sl.Task):
+    cores = 2
+
+
+class ExecWf(sl.WorkflowTask):
+    def workflow(self):
+        return self.new_task('exec_task', ExecTask)
+
+
+class TestExecutors(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = luigi.configuration.get_config()
+        sl.executor._executors.clear()
+
+    def tearDown(self):
+        for section in ['ExecTask', 'executor_fake']:
+            self.config.remove_section(section)
+        sl.executor._executors.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_default_local(self):
+        wf = ExecWf(instance_name='exec_default_wf')
+        task = wf.new_task('exec_default', ExecTask)
+        self.assertIsInstance(task.get_executor(), sl.executor.LocalExecutor)
+        self.assertEqual(task.ex('echo hi'), (0, b'hi\n', b''))
+        slurm_task = wf.new_task('exec_slurm', sl.SlurmTask, slurminfo=sl.SlurmInfo(
+            sl.RUNMODE_HPC_SBATCH, 'proj', 'core', 1, '1:00', 'exec', 1))
+        self.assertIsInstance(slurm_task.get_executor(), sl.executor.SbatchExecutor)
+
+    def test_fake_from_config(self):
+        self.config.set('ExecTask', 'executor', 'fake')
+        self.config.set('executor_fake', 'latency_sec', '0.2')
+        wf = ExecWf(instance_name='exec_config_wf')
+        task = wf.new_task('exec_config', ExecTask)
+        path = os.path.join(self.tmpdir, 'created')
+        start = time.time()
+        self.assertEqual(task.ex('touch %s' % path), (0, b'', b''))
+        self.assertGreaterEqual(time.time() - start, 0.2)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(task.get_executor().commands, 1)
+        self.assertEqual(task._trace_commands[0]['kind'], 'ex_fake')
+
+    def test_workflow_executor(self):
+        wf = ExecWf(instance_name='exec_workflow_wf')
+        wf.executor = sl.executor.FakeExecutor(retcode=3)
+        task = wf.new_task('exec_workflow', ExecTask)
+        with self.assertRaises(sl.task.CommandFailedException) as ctx:
+            task.ex('true')
+        self.assertEqual(ctx.exception.retcode, 3)
+        # The task's own executor comes first
+        task.executor = 'local'
+        self.assertEqual(task.ex('true')[0], 0)
+
+    def test_workflow_slurm_executor(self):
+        wf = ExecWf(instance_name='exec_slurm_wf')
+        wf.executor = 'sbatch'
+        # Plain tasks keep running locally, SLURM tasks use the workflow's executor
+        task = wf.new_task('exec_plain', ExecTask)
+        self.assertIsInstance(task.get_executor(), sl.executor.LocalExecutor)
+        slurm_task = wf.new_task('exec_slurm', sl.SlurmTask, slurminfo=sl.SlurmInfo(
+            sl.RUNMODE_HPC, 'proj', 'core', 1, '1:00', 'exec', 1))
+        self.assertIsInstance(slurm_task.get_executor(), sl.executor.SbatchExecutor)
+        # A SLURM executor set on a plain task itself is refused
+        task.executor = 'slurm_array'
+        with self.assertRaises(Exception) as ctx:
+            task.ex('true')
+        self.assertIn('needs a SLURM task', str(ctx.exception))
+
+    def test_local_pool_slots(self):
+        wf = ExecWf(instance_name='exec_pool_wf')
+        task = wf.new_task('exec_pool', PoolExecTask)
+        task.executor = sl.executor.LocalPoolExecutor(slots=3)
+        start = time.time()
+        task.ex_many(['sleep 0.3'] * 3, max_concurrency=3)
+        # Two cores per command only leave room for one command at a time
+        self.assertGreaterEqual(time.time() - start, 0.9)
+        self.assertEqual(task.executor.peak_slots_in_use, 2)
+        self.assertEqual(task.executor.commands, 3)
+        self.assertEqual(task.executor.slots_in_use, 0)
+        # One total of the time waited, when the task finishes
+        self.assertGreaterEqual(task.executor_slot_wait_sec, 0.5)
+        task.collect_final_auditinfo()
+        waits = [val for infotype, val in task._auditinfo['exec_pool']
+                 if infotype == 'executor_slot_wait_sec']
+        self.assertEqual(waits, ['%.3f' % task.executor_slot_wait_sec])
+
+    def test_unknown_executor(self):
+        with self.assertRaises(Exception):
+            sl.executor.get_executor('no_such_executor')
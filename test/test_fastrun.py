@@ -0,0 +1,121 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class FastWrite(sl.Task):
+    path = luigi.Parameter()
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        with self.out_data().open('w') as outfile:
+            outfile.write(self.instance_name + '\n')
+
+
+class FastConcat(sl.Task):
+    path = luigi.Parameter()
+    fail = luigi.BoolParameter()
+    in_parts = None
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        if self.fail:
+            raise Exception('Failing on purpose')
+        with self.out_data().open('w') as outfile:
+            for part in self.in_parts:
+                with part().open() as infile:
+                    outfile.write(infile.read())
+            outfile.write(self.instance_name + '\n')
+
+
+class FastWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+    fail_middle = luigi.BoolParameter()
+
+    def workflow(self):
+        path = lambda name: os.path.join(self.tmpdir, name + '.txt')
+        parts = [self.new_task('part_%d' % i, FastWrite, path=path('part_%d' % i))
+                 for i in range(3)]
+        middle = self.new_task('middle', FastConcat, path=path('middle'), fail=self.fail_middle)
+        middle.in_parts = [part.out_data for part in parts]
+        last = self.new_task('last', FastConcat, path=path('last'))
+        last.in_parts = [middle.out_data]
+        return last
+
+
+class TestFastRun(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read(self, name):
+        with open(os.path.join(self.tmpdir, name + '.txt')) as fobj:
+            return fobj.read()
+
+    def audited_tasks(self, wf):
+        return sorted(record['instance_name'] for record in wf.get_audit_backends()[0].read())
+
+    def test_run_fast(self):
+        wf = FastWf(instance_name='fast_wf', tmpdir=self.tmpdir)
+        result = sl.run_fast(wf, workers=2)
+        self.assertTrue(result.success)
+        self.assertEqual(sorted(result.done),
+                         ['fast_wf', 'last', 'middle', 'part_0', 'part_1', 'part_2'])
+        # The workflow task runs last
+        self.assertEqual(result.done[-1], 'fast_wf')
+        self.assertEqual(self.read('last'), 'part_0\npart_1\npart_2\nmiddle\nlast\n')
+        self.assertTrue(wf.complete())
+        self.assertEqual(self.audited_tasks(wf),
+                         ['last', 'middle', 'part_0', 'part_1', 'part_2'])
+        with wf.output()['audit'].open() as auditfile:
+            self.assertIn('[middle]', auditfile.read())
+
+    def test_same_audit_info_as_luigi(self):
+        luigi_wf = FastWf(instance_name='fast_luigi_wf', tmpdir=os.path.join(self.tmpdir, 'luigi'))
+        luigi.build([luigi_wf], local_scheduler=True)
+        fast_wf = FastWf(instance_name='fast_fast_wf', tmpdir=os.path.join(self.tmpdir, 'fast'))
+        sl.run_fast(fast_wf)
+        infotypes = lambda wf: dict((record['instance_name'], sorted(record['info']))
+                                    for record in wf.get_audit_backends()[0].read())
+        self.assertEqual(infotypes(fast_wf), infotypes(luigi_wf))
+
+    def test_complete_tasks_are_skipped(self):
+        for name in ['middle', 'part_0']:
+            with open(os.path.join(self.tmpdir, name + '.txt'), 'w') as fobj:
+                fobj.write('existing\n')
+        wf = FastWf(instance_name='fast_skip_wf', tmpdir=self.tmpdir)
+        result = sl.run_fast(wf)
+        self.assertEqual(result.complete, ['middle'])
+        self.assertEqual(sorted(result.done), ['fast_skip_wf', 'last'])
+        self.assertEqual(self.read('last'), 'existing\nlast\n')
+
+    def test_failure_blocks_downstream(self):
+        wf = FastWf(instance_name='fast_fail_wf', tmpdir=self.tmpdir, fail_middle=True)
+        result = sl.run_fast(wf, workers=2)
+        self.assertFalse(result.success)
+        self.assertEqual(list(result.failed), ['middle'])
+        self.assertIn('Failing on purpose', result.failed['middle'])
+        self.assertEqual(sorted(result.blocked), ['fast_fail_wf', 'last'])
+        self.assertEqual(sorted(result.done), ['part_0', 'part_1', 'part_2'])
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'last.txt')))
+
+    def test_processes(self):
+        wf = FastWf(instance_name='fast_proc_wf', tmpdir=self.tmpdir)
+        result = sl.run_fast(wf, workers=2, use_processes=True)
+        self.assertTrue(result.success)
+        self.assertEqual(self.read('last'), 'part_0\npart_1\npart_2\nmiddle\nlast\n')
+        self.assertEqual(self.audited_tasks(wf),
+                         ['last', 'middle', 'part_0', 'part_1', 'part_2'])
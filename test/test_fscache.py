@@ -0,0 +1,99 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class TestDirListingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = sl.DirListingCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, name):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fobj:
+            fobj.write('x')
+        return path
+
+    def settle(self):
+        old = time.time() - 2 * sl.fscache.RACY_SECONDS
+        os.utime(self.tmpdir, (old, old))
+
+    def test_exists(self):
+        path_a = self.touch('a.txt')
+        self.settle()
+        self.assertTrue(self.cache.exists(path_a))
+        self.assertTrue(self.cache.all_exist([path_a, self.tmpdir]))
+        self.assertFalse(self.cache.exists(os.path.join(self.tmpdir, 'b.txt')))
+        self.assertFalse(self.cache.exists(os.path.join(self.tmpdir, 'nodir', 'c.txt')))
+        self.assertTrue(self.cache._listings[self.tmpdir].complete)
+
+    def test_new_files_are_seen(self):
+        self.settle()
+        path_b = os.path.join(self.tmpdir, 'b.txt')
+        self.assertFalse(self.cache.exists(path_b))
+        # Directory modification time changes, so the listing is not trusted
+        self.touch('b.txt')
+        self.assertTrue(self.cache.exists(path_b))
+        self.settle()
+        self.assertTrue(self.cache.exists(path_b))
+
+    def test_broken_symlink(self):
+        os.symlink(os.path.join(self.tmpdir, 'missing'), os.path.join(self.tmpdir, 'link'))
+        self.settle()
+        self.assertFalse(self.cache.exists(os.path.join(self.tmpdir, 'link')))
+
+    def test_invalidate(self):
+        path_a = self.touch('a.txt')
+        self.settle()
+        self.assertTrue(self.cache.exists(path_a))
+        self.cache.invalidate([path_a])
+        self.assertNotIn(self.tmpdir, self.cache._listings)
+
+
+class FSCacheWriter(sl.Task):
+    outdir = luigi.Parameter()
+
+    def out_data(self):
+        return [sl.TargetInfo(self, os.path.join(self.outdir, 'out_%d.txt' % i)) for i in range(5)]
+
+    def run(self):
+        for tinfo in self.out_data():
+            with tinfo.open('w') as ofile:
+                ofile.write('data')
+
+
+class FSCacheWf(sl.WorkflowTask):
+    outdir = luigi.Parameter()
+
+    def workflow(self):
+        return self.new_task('writer', FSCacheWriter, outdir=self.outdir)
+
+
+class TestCachedComplete(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_complete_after_run(self):
+        wf = FSCacheWf(outdir=self.tmpdir)
+        writer = wf.workflow()
+        old = time.time() - 2 * sl.fscache.RACY_SECONDS
+        os.utime(self.tmpdir, (old, old))
+        self.assertFalse(writer.complete())
+        w = luigi.worker.Worker()
+        w.add(wf)
+        w.run()
+        self.assertTrue(writer.complete())
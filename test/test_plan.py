@@ -0,0 +1,71 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class PlanRawData(sl.ExternalTask):
+    path = luigi.Parameter()
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+
+class PlanCopy(sl.Task):
+    path = luigi.Parameter()
+    in_data = None
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        with self.in_data().open() as infile, self.out_data().open('w') as outfile:
+            outfile.write(infile.read())
+
+
+class PlanWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+
+    def workflow(self):
+        path = lambda name: os.path.join(self.tmpdir, name)
+        raw = self.new_task('raw', PlanRawData, path=path('raw.txt'))
+        done = self.new_task('done', PlanCopy, path=path('done.txt'))
+        done.in_data = raw.out_data
+        first = self.new_task('first', PlanCopy, path=path('first.txt'))
+        first.in_data = done.out_data
+        second = self.new_task('second', PlanCopy, path=path('second.txt'))
+        second.in_data = first.out_data
+
+        missing = self.new_task('missing', PlanRawData, path=path('missing.txt'))
+        stuck = self.new_task('stuck', PlanCopy, path=path('stuck.txt'))
+        stuck.in_data = missing.out_data
+        return [second, stuck]
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ['raw.txt', 'done.txt']:
+            with open(os.path.join(self.tmpdir, name), 'w') as fobj:
+                fobj.write('data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plan(self):
+        wf = PlanWf(tmpdir=self.tmpdir)
+        wfplan = wf.plan(workers=4)
+        names = lambda tasks: sorted(t.instance_name for t in tasks)
+        # raw is upstream of a complete task, so it is never checked
+        self.assertEqual(names(wfplan.complete), ['done'])
+        self.assertEqual(names(wfplan.ready), ['first'])
+        self.assertEqual(names(wfplan.pending), ['second'])
+        self.assertEqual(names(wfplan.blocked), ['missing', 'sciluigi_workflow', 'stuck'])
+        self.assertEqual(names(wfplan.to_run), ['first', 'second'])
+        self.assertIn('Ready to run: 1', wfplan.summary())
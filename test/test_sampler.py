@@ -0,0 +1,69 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import subprocess as sub
+import sys
+import time
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+MEMHOG = 'python -c "import time; x = bytearray(80 * 1024 * 1024); time.sleep(0.6)"'
+
+
+@unittest.skipUnless(os.path.isdir('/proc'), 'Needs /proc')
+class TestProcessTreeSampler(unittest.TestCase):
+    def test_samples_shell_pipeline(self):
+        sampler = sl.sampler.ProcessTreeSampler(interval=0.1)
+        proc = sub.Popen('%s | cat' % MEMHOG, shell=True)
+        sampler.start()
+        proc.wait()
+        samples = sampler.stop()
+        self.assertGreater(len(samples), 2)
+        peak = max(samples, key=lambda s: s['rss_kb'])
+        self.assertGreaterEqual(peak['procs'], 3)
+        self.assertGreater(peak['rss_kb'], 70000)
+        self.assertEqual(sorted(peak['top'].items(), key=lambda i: -i[1])[0][0], 'python')
+
+
+class SampledTask(sl.Task):
+    sample_resources = True
+    sample_interval = 0.1
+
+    def out_done(self):
+        return sl.TargetInfo(self, '/tmp/sampledtask_never_written.txt')
+
+    def run(self):
+        self.ex(MEMHOG)
+
+
+@unittest.skipUnless(os.path.isdir('/proc'), 'Needs /proc')
+class TestSampledTask(unittest.TestCase):
+    def test_samples_in_audit(self):
+        wf = sl.WorkflowTask(instance_name='sampled_wf')
+        task = wf.new_task('sampled', SampledTask)
+        task.trigger_event(luigi.Event.START, task)
+        task.run()
+        task.trigger_event(luigi.Event.PROCESSING_TIME, task, 0.7)
+        records = wf.get_audit_backends()[0].read()
+        os.remove(wf.get_auditjsonpath())
+        info = records[0]['info']
+        self.assertGreater(info['sampled_peak_rss_kb'], 70000)
+        self.assertGreater(len(info['resource_samples']), 2)
+
+    def test_other_processes_left_out(self):
+        wf = sl.WorkflowTask(instance_name='sampled_own_wf')
+        task = wf.new_task('sampled_own', SampledTask)
+        task.trigger_event(luigi.Event.START, task)
+        # Another task's command, running in the same process
+        other = sub.Popen(MEMHOG, shell=True)
+        task.ex('sleep 0.6')
+        other.wait()
+        task.trigger_event(luigi.Event.PROCESSING_TIME, task, 0.7)
+        records = wf.get_audit_backends()[0].read()
+        os.remove(wf.get_auditjsonpath())
+        info = records[0]['info']
+        self.assertLess(info['sampled_peak_rss_kb'], 70000)
+        self.assertIn('sleep', set().union(*[s['top'] for s in info['resource_samples']]))
@@ -0,0 +1,139 @@
+import json
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class TestNodeSlotScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.scheduler = sl.NodeSlotScheduler(4, 1000, self.tmpdir, poll_interval=0.05)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_waits_for_budget(self):
+        token = self.scheduler.acquire('big', cores=3, mem_mb=500)
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(
+            self.scheduler.acquire('small', cores=2, mem_mb=100)))
+        waiter.start()
+        time.sleep(0.3)
+        self.assertEqual(admitted, [])
+        self.assertEqual([entry['name'] for entry in self.scheduler.status()['waiting'].values()],
+                         ['small'])
+        # Fits the cores, but not the memory
+        self.scheduler.acquire('tiny', cores=1, mem_mb=400)
+        self.scheduler.release(token)
+        waiter.join(5)
+        self.assertEqual(len(admitted), 1)
+        status = self.scheduler.status()
+        self.assertEqual(sorted(entry['name'] for entry in status['running'].values()),
+                         ['small', 'tiny'])
+        self.assertEqual(status['waiting'], {})
+
+    def test_starving_task_is_not_overtaken(self):
+        self.scheduler.starvation_sec = 0.1
+        token = self.scheduler.acquire('first', cores=3)
+        waiter = threading.Thread(target=self.scheduler.acquire, args=('big', 4))
+        waiter.start()
+        time.sleep(0.3)
+        # Would fit, but big has waited too long to be overtaken
+        taker = threading.Thread(target=self.scheduler.acquire, args=('small', 1))
+        taker.start()
+        time.sleep(0.3)
+        names = [entry['name'] for entry in self.scheduler.status()['running'].values()]
+        self.assertEqual(names, ['first'])
+        self.scheduler.release(token)
+        waiter.join(5)
+        names = [entry['name'] for entry in self.scheduler.status()['running'].values()]
+        self.assertEqual(names, ['big'])
+        self.scheduler.release(list(self.scheduler.status()['running'])[0])
+        taker.join(5)
+        self.assertFalse(taker.is_alive())
+
+    def test_frees_slots_of_dead_processes(self):
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        state = {'running': {'gone': {'name': 'gone', 'cores': 4, 'mem_mb': 0, 'pid': proc.pid,
+                                      'since': time.time()}},
+                 'waiting': {}}
+        with open(os.path.join(self.tmpdir, 'state.json'), 'w') as statefile:
+            json.dump(state, statefile)
+        self.scheduler.acquire('next', cores=4)
+        names = [entry['name'] for entry in self.scheduler.status()['running'].values()]
+        self.assertEqual(names, ['next'])
+
+    def test_utilisation(self):
+        events = [{'time': 10.0, 'cores': 4, 'mem_mb': 500},
+                  {'time': 20.0, 'cores': 2, 'mem_mb': 100},
+                  {'time': 30.0, 'cores': 0, 'mem_mb': 0}]
+        stats = sl.slots.utilisation(events, 4, 1000, since=10.0, until=40.0)
+        self.assertAlmostEqual(stats['avg_cores'], 2.0)
+        self.assertAlmostEqual(stats['cores_utilisation'], 0.5)
+        self.assertAlmostEqual(stats['avg_mem_mb'], 200.0)
+        self.assertEqual((stats['peak_cores'], stats['peak_mem_mb']), (4, 500))
+        self.assertIn('2.0 of 4 in use on average (50%)', sl.slots.format_utilisation(stats))
+
+
+class SlotTask(sl.Task):
+    cores = 2
+    path = luigi.Parameter()
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        time.sleep(0.3)
+        with self.out_data().open('w') as outfile:
+            outfile.write('data')
+
+
+class SlotWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+
+    def workflow(self):
+        tasks = [self.new_task('slot_%d' % i, SlotTask, path=os.path.join(self.tmpdir, '%d.txt' % i))
+                 for i in range(3)]
+        return tasks
+
+
+class TestSlotAdmission(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = luigi.configuration.get_config()
+        self.config.set('resources', 'cores', '3')
+
+    def tearDown(self):
+        self.config.remove_option('resources', 'cores')
+        shutil.rmtree(self.tmpdir)
+
+    def test_tasks_run_within_budget(self):
+        wf = SlotWf(instance_name='slot_wf', tmpdir=self.tmpdir)
+        wf.node_slots_dir = os.path.join(self.tmpdir, 'slots')
+        tasks = luigi.task.flatten(wf.requires())
+        self.assertEqual(tasks[0].process_resources(), {'cores': 2})
+        w = luigi.worker.Worker(worker_processes=3)
+        w.add(wf)
+        w.run()
+        records = [record for record in wf.get_audit_backends()[0].read()
+                   if record['task_family'] == 'SlotTask']
+        self.assertEqual(len(records), 3)
+        spans = sorted((r['info']['trace_start'], r['info']['trace_end']) for r in records)
+        # Two cores each, out of three, leaves room for one task at a time,
+        # so luigi's scheduler starts one task at a time
+        for (_, end), (start, _) in zip(spans, spans[1:]):
+            self.assertGreaterEqual(start, end - 0.05)
+        self.assertEqual(set(r['info']['slot_cores'] for r in records), set([2]))
+        stats = wf.get_slot_scheduler().utilisation()
+        self.assertEqual(stats['peak_cores'], 2)
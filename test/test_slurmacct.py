@@ -0,0 +1,73 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import unittest
+from test_slurmarray import FakeSlurmTestCase, FAKE_SRUN
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+# Stand-ins for salloc, running the command right away, and sacct, reporting
+# every job as completed
+FAKE_SALLOC = '''#!/bin/bash
+jobid=3000
+until mkdir $FAKE_SLURM_DIR/jobs/$jobid 2> /dev/null; do jobid=$(( jobid + 1 )); done
+echo "salloc: Pending job allocation $jobid" >&2
+echo "salloc: Granted job allocation $jobid" >&2
+while [ "$1" != "srun" ]; do shift; done
+"$@"
+'''
+
+FAKE_SACCT = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/sacct_calls
+for jobid in ${2//,/ }; do
+    echo "$jobid|COMPLETED|0:0|00:00:42|01:02.250|"
+    echo "$jobid.0|COMPLETED|0:0|00:00:41|01:02.250|1.5M"
+done
+'''
+
+
+class TestParseSacct(unittest.TestCase):
+    def test_parse_sacct(self):
+        records = sl.slurmacct.parse_sacct(
+            '123|CANCELLED by 42|0:15|1-02:03:04|10:00.500|\n'
+            '123.batch|CANCELLED|0:15|1-02:03:04|00:00.100|1024K\n'
+            '123.0|CANCELLED|0:15|1-02:03:00|10:00.400|2G\n'
+            '124_3|PENDING|0:0|00:00:00|00:00:00|\n')
+        self.assertEqual(sorted(records), ['123', '124_3'])
+        record = records['123']
+        self.assertEqual((record.state, record.exitcode, record.signal), ('CANCELLED', 0, 15))
+        self.assertEqual((record.elapsed_sec, record.totalcpu_sec), (93784.0, 600.5))
+        self.assertEqual(record.maxrss_kb, 2 * 1024 * 1024)
+        self.assertTrue(record.finished)
+        self.assertFalse(records['124_3'].finished)
+        self.assertIsNone(records['124_3'].maxrss_kb)
+
+
+class SallocTask(sl.SlurmTask):
+    pass
+
+
+class TestSacctCollector(FakeSlurmTestCase):
+    fake_commands = [('salloc', FAKE_SALLOC), ('srun', FAKE_SRUN), ('sacct', FAKE_SACCT)]
+
+    def test_batched_lookup(self):
+        wf = sl.WorkflowTask(instance_name='sacct_collector_wf')
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC, 'proj', 'core', 1, '1:00', 'salloc', 1)
+        task = wf.new_task('salloc_task', SallocTask, slurminfo=slurminfo)
+        results = task.ex_many(['echo a', 'echo b', 'echo c'], max_concurrency=3)
+        self.assertEqual([r.stdout for r in results], [b'a\n', b'b\n', b'c\n'])
+        task.collect_final_auditinfo()
+        calls = self.calls('sacct')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0].split()[1].split(',')), ['3000', '3001', '3002'])
+        self.assertEqual(task.slurm_exectime_sec, 42)
+        info = dict(task._auditinfo[task.instance_name])
+        self.assertEqual(info['slurm_maxrss_kb'], 1536)
+        self.assertEqual(info['slurm_totalcpu_sec'], '62.250')
+        hpc_spans = [e for e in task._trace_commands if e['kind'] == 'ex_hpc']
+        self.assertEqual([e['slurm_exectime_sec'] for e in hpc_spans], [42.0] * 3)
+        # Finished jobs are cached
+        self.assertEqual(sl.slurmacct.get_collector().request('3000').wait(0).elapsed_sec, 42.0)
+        self.assertEqual(len(self.calls('sacct')), 1)
@@ -0,0 +1,121 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+# Stand-ins for the SLURM commands, running array elements as local processes
+FAKE_SBATCH = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/sbatch_calls
+for arg in "$@"; do
+    case $arg in --array=0-*) last=${arg#--array=0-} ;; esac
+    script=$arg
+done
+jobid=$(( $(ls $FAKE_SLURM_DIR/jobs | wc -l) + 1000 ))
+echo "$(dirname $script) $last" > $FAKE_SLURM_DIR/jobs/$jobid
+for i in $(seq 0 $last); do
+    SLURM_ARRAY_TASK_ID=$i bash $script > /dev/null 2>&1 &
+done
+echo "$jobid;cluster"
+'''
+
+FAKE_SQUEUE = '''#!/bin/bash
+while [ $# -gt 0 ]; do
+    case $1 in -j) jobid=$2; shift ;; esac
+    shift
+done
+read batchdir last < $FAKE_SLURM_DIR/jobs/$jobid
+for i in $(seq 0 $last); do
+    [ -e $batchdir/$i.rc ] || echo ${jobid}_$i
+done
+'''
+
+FAKE_SRUN = '''#!/bin/bash
+while [[ $1 == -* ]]; do shift 2; done
+exec "$@"
+'''
+
+FAKE_SACCT = '''#!/bin/bash
+echo "$2|FAILED|0:9|00:00:01|00:00:01|"
+'''
+
+
+class FakeSlurmTestCase(unittest.TestCase):
+    fake_commands = [('sbatch', FAKE_SBATCH), ('squeue', FAKE_SQUEUE),
+                     ('srun', FAKE_SRUN), ('sacct', FAKE_SACCT)]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        bindir = os.path.join(self.tmpdir, 'bin')
+        os.makedirs(bindir)
+        os.makedirs(os.path.join(self.tmpdir, 'jobs'))
+        for name, script in self.fake_commands:
+            path = os.path.join(bindir, name)
+            with open(path, 'w') as scriptfile:
+                scriptfile.write(script)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = bindir + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_SLURM_DIR'] = self.tmpdir
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def calls(self, name):
+        with open(os.path.join(self.tmpdir, name + '_calls')) as callsfile:
+            return callsfile.read().splitlines()
+
+
+class TestSlurmArrayRunner(FakeSlurmTestCase):
+    def test_commands_share_array(self):
+        runner = sl.slurmarray.SlurmArrayRunner(
+            '-A proj -p core -n 1 -t 1:00 -J test', 'srun -n 1 -c 1',
+            spooldir=os.path.join(self.tmpdir, 'spool'), gather_seconds=0.5, poll_interval=0.2)
+        results = {}
+        def run(name, command):
+            results[name] = runner.run(command)
+        threads = [threading.Thread(target=run, args=(name, cmd)) for name, cmd in
+                   [('a', 'echo a'), ('b', 'echo b >&2'), ('c', 'exit 3')]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        calls = self.calls('sbatch')
+        self.assertEqual(len(calls), 1)
+        self.assertIn('--array=0-2', calls[0])
+        self.assertEqual((results['a'].retcode, results['a'].stdout), (0, b'a\n'))
+        self.assertEqual((results['b'].retcode, results['b'].stderr), (0, b'b\n'))
+        self.assertEqual(results['c'].retcode, 3)
+        self.assertEqual(sorted(r.jobid for r in results.values()), ['1000_0', '1000_1', '1000_2'])
+
+
+class ArrayTask(sl.SlurmTask):
+    array_gather_seconds = 0.1
+    array_poll_interval = 0.2
+
+    def run(self):
+        self.ex('echo from array')
+
+
+class TestArrayRunmode(FakeSlurmTestCase):
+    def test_slurm_task(self):
+        wf = sl.WorkflowTask(instance_name='array_runmode_wf')
+        slurminfo = sl.SlurmInfo(sl.slurm.RUNMODE_HPC_ARRAY, 'proj', 'core', 1, '1:00', 'array', 1)
+        task = wf.new_task('array_task', ArrayTask, slurminfo=slurminfo)
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            self.assertEqual(task.ex('echo from array'), (0, b'from array\n', b''))
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(task.slurm_jobid, '1000_0')
+        self.assertIn('-A proj -p core -n 1 -t 1:00 -J array', self.calls('sbatch')[0])
@@ -0,0 +1,117 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+def history_record(task_id, params, exectime, totalcpu, maxrss_kb, family='EstimatedTask'):
+    return {'instance_name': task_id, 'task_family': family, 'task_id': task_id, 'time': 0.0,
+            'params': params,
+            'info': {'task_exectime_sec': '%.3f' % (exectime + 1), 'slurm_exectime_sec': exectime,
+                     'slurm_totalcpu_sec': '%.3f' % totalcpu, 'slurm_maxrss_kb': maxrss_kb}}
+
+
+class TestSlurmResourceEstimator(unittest.TestCase):
+    def setUp(self):
+        self.estimator = sl.SlurmResourceEstimator(margin=0.5, percentile=100, min_samples=3)
+        self.records = [history_record('a%d' % i, {'size': 100}, 100 + 10 * i, 200 + 20 * i, 2048 * 1024)
+                        for i in range(3)]
+        # Much larger inputs, of a different parameter shape
+        self.records += [history_record('b%d' % i, {'size': 10000}, 3600, 36000, 8192 * 1024)
+                         for i in range(3)]
+
+    def test_estimate_from_same_shape(self):
+        estimate = self.estimator.estimate(self.records, 'EstimatedTask', {'size': 120})
+        self.assertEqual(estimate.samples, 3)
+        # 120s * 1.5, rounded up to whole minutes
+        self.assertEqual(estimate.time_sec, 180)
+        self.assertEqual(estimate.cores, 3)
+        self.assertEqual(estimate.mem_mb, 3072)
+        self.assertIn('3 earlier runs of EstimatedTask with the same parameter shape', estimate.reasons)
+
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC, 'proj', 'core', 8, '4:00:00', 'est', 8)
+        estimated = estimate.apply(slurminfo)
+        self.assertEqual(estimated.get_argstr_hpc().split(),
+                         '-A proj -p core -n 3 -t 00:03:00 -J est --mem=3072M srun -n 1 -c 3'.split())
+        self.assertEqual(slurminfo.time, '4:00:00')
+
+    def test_estimate_from_all_runs_of_class(self):
+        estimate = self.estimator.estimate(self.records, 'EstimatedTask', {'size': 'other'})
+        self.assertEqual(estimate.samples, 6)
+        self.assertEqual(estimate.time_sec, 5400)
+        self.assertEqual(sl.slurmestimate.format_duration(90000), '1-01:00:00')
+
+    def test_too_few_runs(self):
+        estimate = self.estimator.estimate(self.records, 'OtherTask', {'size': 100})
+        self.assertEqual((estimate.time_sec, estimate.cores, estimate.mem_mb), (None, None, None))
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC, 'proj', 'core', 8, '4:00:00', 'est', 8)
+        self.assertEqual(estimate.apply(slurminfo).get_argstr_hpc(), slurminfo.get_argstr_hpc())
+
+
+class EstimatedTask(sl.SlurmTask):
+    size = luigi.IntParameter()
+    slurm_estimator = sl.SlurmResourceEstimator(margin=0.5, percentile=100)
+
+
+class EstimateWf(sl.WorkflowTask):
+    size = luigi.IntParameter(default=150)
+
+    def workflow(self):
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC, 'proj', 'core', 8, '4:00:00', 'est', 8)
+        return self.new_task('estimated', EstimatedTask, slurminfo=slurminfo, size=self.size)
+
+
+class TestEstimatedSlurmInfo(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_estimate_from_audit_db(self):
+        dbpath = os.path.join(self.tmpdir, 'audit.db')
+        backend = sl.auditdb.SqliteAuditBackend(dbpath, 'estimatewf', 'earlier_run', '20200101')
+        for i in range(3):
+            backend.write(history_record('t%d' % i, {'size': 200}, 60 + i, 60, 1024 * 1024))
+        wf = EstimateWf(instance_name='estimate_wf')
+        wf.audit_db = dbpath
+        task = wf.get_workflow_output()
+        slurminfo = task.get_slurminfo()
+        self.assertEqual((slurminfo.time, slurminfo.cores, slurminfo.mem), ('00:02:00', 2, 1536))
+        self.assertIs(task.get_slurminfo(), slurminfo)
+        self.assertEqual(task.slurminfo.cores, 8)
+
+        task.flush_auditinfo()
+        info = wf.get_audit_backends()[0].read()[-1]['info']
+        self.assertEqual(info['slurm_estimate']['samples'], 3)
+        self.assertEqual(info['slurm_estimate']['time_sec'], 120)
+        self.assertTrue(any(reason.startswith('time: p100 of 3 execution times is 62.0s')
+                            for reason in info['slurm_estimate']['reasons']))
+
+    def test_estimate_from_recorded_runs(self):
+        dbpath = os.path.join(self.tmpdir, 'audit.db')
+        # Earlier runs, with records written the way finished tasks write them
+        for size, exectime in [(150, 60), (160, 61), (170, 62), (10000, 3600), (12000, 3600),
+                               (14000, 3600)]:
+            earlier = EstimateWf(instance_name='estimate_earlier_%d' % size, size=size)
+            earlier.audit_db = dbpath
+            task = earlier.get_workflow_output()
+            task.add_auditinfo('slurm_exectime_sec', exectime)
+            task.flush_auditinfo()
+        wf = EstimateWf(instance_name='estimate_recorded_wf', size=140)
+        wf.audit_db = dbpath
+        task = wf.get_workflow_output()
+        self.assertEqual(sl.slurmestimate.parameter_shape(task.param_kwargs),
+                         sl.slurmestimate.parameter_shape(wf.get_audit_history()[0]['params']))
+        slurminfo = task.get_slurminfo()
+        self.assertEqual(slurminfo.time, '00:02:00')
+        task.flush_auditinfo()
+        info = wf.get_audit_backends()[0].read()[-1]['info']
+        self.assertIn('3 earlier runs of EstimatedTask with the same parameter shape',
+                      info['slurm_estimate']['reasons'])
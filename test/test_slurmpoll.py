@@ -0,0 +1,150 @@
+import logging
+import luigi
+import sciluigi as sl
+import os
+import unittest
+from test_slurmarray import FakeSlurmTestCase, FAKE_SRUN
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+# Stand-ins for the SLURM commands, running jobs as local processes, and
+# keeping their exit status in $FAKE_SLURM_DIR/jobs/<jobid> when done
+FAKE_SBATCH = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/sbatch_calls
+while [ $# -gt 1 ]; do
+    case $1 in -o) out=$2; shift ;; -e) err=$2; shift ;; esac
+    shift
+done
+jobid=2000
+until mkdir $FAKE_SLURM_DIR/jobs/$jobid.id 2> /dev/null; do jobid=$(( jobid + 1 )); done
+touch $FAKE_SLURM_DIR/jobs/$jobid
+( bash $1 > $out 2> $err; echo $? > $FAKE_SLURM_DIR/jobs/$jobid.tmp; mv $FAKE_SLURM_DIR/jobs/$jobid.tmp $FAKE_SLURM_DIR/jobs/$jobid ) > /dev/null 2>&1 &
+echo "$jobid;cluster"
+'''
+
+FAKE_SQUEUE = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/squeue_calls
+for jobid in ${3//,/ }; do
+    [ -s $FAKE_SLURM_DIR/jobs/$jobid ] || echo $jobid
+done
+'''
+
+FAKE_SACCT = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/sacct_calls
+for jobid in ${2//,/ }; do
+    if [ -s $FAKE_SLURM_DIR/jobs/$jobid ]; then
+        rc=$(cat $FAKE_SLURM_DIR/jobs/$jobid)
+        if [ $rc -eq 0 ]; then state=COMPLETED; else state=FAILED; fi
+        echo "$jobid|$state|$rc:0|00:01:05|00:02.500|"
+        echo "$jobid.batch|$state|$rc:0|00:01:05|00:02.500|2048K"
+    fi
+done
+'''
+
+# An squeue that fails on its first calls (for longer than
+# sbatch_max_wait_seconds), as when slurmctld is busy
+FAKE_SQUEUE_FLAKY = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/squeue_calls
+[ $(wc -l < $FAKE_SLURM_DIR/squeue_calls) -gt 5 ] || exit 1
+for jobid in ${3//,/ }; do
+    [ -s $FAKE_SLURM_DIR/jobs/$jobid ] || echo $jobid
+done
+'''
+
+# Accounting that also reports the jobs that are still running
+FAKE_SACCT_RUNNING = FAKE_SACCT.replace('''    fi
+done''', '''    elif [ -e $FAKE_SLURM_DIR/jobs/$jobid ]; then
+        echo "$jobid|RUNNING|0:0|00:00:01|00:00.000|"
+    fi
+done''')
+
+# Accounting that never reports the jobs, as when slurmdbd is down
+FAKE_SACCT_DOWN = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/sacct_calls
+'''
+
+
+class SbatchTask(sl.SlurmTask):
+    sbatch_poll_interval = 0.2
+    sbatch_max_wait_seconds = 0.5
+
+
+class TestSbatchRunmode(FakeSlurmTestCase):
+    fake_commands = [('sbatch', FAKE_SBATCH), ('squeue', FAKE_SQUEUE),
+                     ('srun', FAKE_SRUN), ('sacct', FAKE_SACCT)]
+
+    def setUp(self):
+        super(TestSbatchRunmode, self).setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super(TestSbatchRunmode, self).tearDown()
+
+    def test_jobs_share_poller(self):
+        wf = sl.WorkflowTask(instance_name='sbatch_runmode_wf')
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC_SBATCH, 'proj', 'core', 1, '1:00', 'sbatch', 1)
+        task = wf.new_task('sbatch_task', SbatchTask, slurminfo=slurminfo)
+        with self.assertRaises(sl.task.CommandsFailedException) as ctx:
+            task.ex_many(['sleep 1; echo a', 'sleep 1; echo b >&2', 'sleep 1; exit 2'],
+                         max_concurrency=3, fail_fast=False)
+        results = ctx.exception.results
+        self.assertEqual((results[0].retcode, results[0].stdout), (0, b'a\n'))
+        self.assertEqual((results[1].retcode, results[1].stderr), (0, b'b\n'))
+        self.assertEqual(results[2].retcode, 2)
+        self.assertEqual(len(self.calls('sbatch')), 3)
+        # Outstanding jobs are looked up together
+        self.assertEqual(max(len(call.split()[2].split(',')) for call in self.calls('squeue')), 3)
+        self.assertEqual(task.slurm_exectime_sec, 65.0)
+        task.flush_auditinfo()
+        info = wf.get_audit_backends()[0].read()[-1]['info']
+        self.assertEqual(info['slurm_maxrss_kb'], 2048)
+        self.assertEqual(info['slurm_totalcpu_sec'], '2.500')
+
+
+class TestSbatchLostAccounting(FakeSlurmTestCase):
+    fake_commands = [('sbatch', FAKE_SBATCH), ('squeue', FAKE_SQUEUE),
+                     ('srun', FAKE_SRUN), ('sacct', FAKE_SACCT_DOWN)]
+
+    def setUp(self):
+        super(TestSbatchLostAccounting, self).setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super(TestSbatchLostAccounting, self).tearDown()
+
+    def test_gives_up_on_job(self):
+        wf = sl.WorkflowTask(instance_name='sbatch_lost_wf')
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC_SBATCH, 'proj', 'core', 1, '1:00', 'sbatch', 1)
+        task = wf.new_task('sbatch_lost_task', SbatchTask, slurminfo=slurminfo)
+        with self.assertRaises(sl.task.CommandFailedException) as ctx:
+            task.ex('echo a')
+        self.assertIn('state UNKNOWN', str(ctx.exception))
+        self.assertGreaterEqual(len(self.calls('sacct')), 2)
+        self.assertEqual(os.listdir(os.path.join(sl.slurmpoll.JOBS_DIR, 'outstanding')), [])
+
+
+class TestSbatchFlakySqueue(FakeSlurmTestCase):
+    fake_commands = [('sbatch', FAKE_SBATCH), ('squeue', FAKE_SQUEUE_FLAKY),
+                     ('srun', FAKE_SRUN), ('sacct', FAKE_SACCT_RUNNING)]
+
+    def setUp(self):
+        super(TestSbatchFlakySqueue, self).setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super(TestSbatchFlakySqueue, self).tearDown()
+
+    def test_running_job_is_not_given_up_on(self):
+        wf = sl.WorkflowTask(instance_name='sbatch_flaky_wf')
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC_SBATCH, 'proj', 'core', 1, '1:00', 'sbatch', 1)
+        task = wf.new_task('sbatch_flaky_task', SbatchTask, slurminfo=slurminfo)
+        # Runs for longer than sbatch_max_wait_seconds after squeue first failed
+        self.assertEqual(task.ex('sleep 2; echo a'), (0, b'a\n', b''))
+        self.assertGreater(len(self.calls('squeue')), 5)
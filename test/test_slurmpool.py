@@ -0,0 +1,148 @@
+import glob
+import json
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from test_slurmarray import FakeSlurmTestCase, FAKE_SRUN
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+# Stand-in for sbatch, running pilot jobs as local processes
+FAKE_SBATCH = '''#!/bin/bash
+echo "$@" >> $FAKE_SLURM_DIR/sbatch_calls
+while [ $# -gt 1 ]; do
+    case $1 in -o) out=$2; shift ;; esac
+    shift
+done
+bash $1 > $out 2>&1 &
+echo "3000;cluster"
+'''
+
+
+class PoolTask(sl.SlurmTask):
+    pool_max_agents = 2
+    pool_idle_seconds = 0.5
+
+
+class PilotPoolTask(PoolTask):
+    pool_agent_time = '2:00:00'
+
+
+class LocalPoolTask(PoolTask):
+    pool_launch = sl.slurmpool.LAUNCH_LOCAL
+
+
+class TestPoolRunmode(FakeSlurmTestCase):
+    fake_commands = [('sbatch', FAKE_SBATCH), ('srun', FAKE_SRUN)]
+
+    def setUp(self):
+        super(TestPoolRunmode, self).setUp()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        super(TestPoolRunmode, self).tearDown()
+
+    def wait_for_agents_to_exit(self, pooldir):
+        deadline = time.time() + 10
+        while os.listdir(os.path.join(pooldir, 'agents')) and time.time() < deadline:
+            time.sleep(0.2)
+        self.assertEqual(os.listdir(os.path.join(pooldir, 'agents')), [])
+
+    def test_local_agents(self):
+        wf = sl.WorkflowTask(instance_name='pool_local_wf')
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC_POOL, 'proj', 'core', 1, '1:00', 'pool', 1)
+        task = wf.new_task('pool_task', LocalPoolTask, slurminfo=slurminfo)
+        with self.assertRaises(sl.task.CommandsFailedException) as ctx:
+            task.ex_many(['echo a', 'echo b >&2', 'sleep 0.5; exit 2', 'echo d'],
+                         max_concurrency=4, fail_fast=False)
+        results = ctx.exception.results
+        self.assertEqual((results[0].retcode, results[0].stdout), (0, b'a\n'))
+        self.assertEqual((results[1].retcode, results[1].stderr), (0, b'b\n'))
+        self.assertEqual(results[2].retcode, 2)
+        self.assertEqual((results[3].retcode, results[3].stdout), (0, b'd\n'))
+
+        pooldirs = glob.glob(os.path.join(self.tmpdir, sl.slurmpool.POOL_DIR, '*'))
+        self.assertEqual(len(pooldirs), 1)
+        # The pool grows no further than pool_max_agents, and shrinks when idle
+        self.assertLessEqual(len(glob.glob(os.path.join(pooldirs[0], 'agent_*.log'))), 2)
+        self.wait_for_agents_to_exit(pooldirs[0])
+
+        task.flush_auditinfo()
+        info = wf.get_audit_backends()[0].read()[-1]['info']
+        self.assertTrue(info['slurm_pool_agent'].startswith('agent_'))
+        self.assertIn('slurm_pool_wait_sec', info)
+
+    def test_pilot_jobs(self):
+        wf = sl.WorkflowTask(instance_name='pool_sbatch_wf')
+        slurminfo = sl.SlurmInfo(sl.RUNMODE_HPC_POOL, 'proj', 'core', 4, '1:00', 'pool', 2)
+        task = wf.new_task('pool_task', PilotPoolTask, slurminfo=slurminfo)
+        results = task.ex_many(['echo %d' % i for i in range(4)], max_concurrency=4)
+        self.assertEqual([result.stdout for result in results], [b'0\n', b'1\n', b'2\n', b'3\n'])
+
+        sbatch_calls = self.calls('sbatch')
+        self.assertGreaterEqual(len(sbatch_calls), 1)
+        self.assertLessEqual(len(sbatch_calls), 2)
+        self.assertIn('-n 4 -t 2:00:00', sbatch_calls[0])
+        pooldir = glob.glob(os.path.join(self.tmpdir, sl.slurmpool.POOL_DIR, '*'))[0]
+        # Pilot jobs run two commands at a time, as job steps
+        with open(glob.glob(os.path.join(pooldir, 'agent_*.sh'))[0]) as scriptfile:
+            script = scriptfile.read()
+        self.assertIn('--slots 2', script)
+        self.assertIn('--time-limit 7200 --command-seconds 60', script)
+        self.assertIn('--launcher "srun -n 1 -c 2"', script)
+        self.wait_for_agents_to_exit(pooldir)
+
+
+class TestPoolRecovery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def pool(self, **kwargs):
+        return sl.slurmpool.SlurmPool('', launch=sl.slurmpool.LAUNCH_LOCAL, pooldir=self.tmpdir,
+                                      idle_seconds=0.2, check_interval=0.05, **kwargs)
+
+    def test_stale_starting_agent(self):
+        pool = self.pool(max_agents=1, start_seconds=1.0)
+        # A pilot job that was cancelled before its agent started
+        with open(os.path.join(pool.pooldir, 'starting', 'agent_lost'), 'w') as startfile:
+            json.dump({'time': time.time() - 2.0, 'jobid': '3001'}, startfile)
+        result = pool.run('echo hi')
+        self.assertEqual((result.retcode, result.stdout), (0, b'hi\n'))
+        self.assertNotIn('agent_lost', os.listdir(os.path.join(pool.pooldir, 'starting')))
+
+    def test_timeout(self):
+        pool = self.pool(max_agents=0, timeout=0.3)
+        with self.assertRaises(sl.slurmpool.PoolTimeoutException):
+            pool.run('echo never')
+        self.assertEqual(os.listdir(os.path.join(pool.pooldir, 'queue')), [])
+
+    def test_agent_drains_near_time_limit(self):
+        pool = self.pool()
+        for i in range(2):
+            sl.util.write_atomically(os.path.join(pool.pooldir, 'queue', '%d_cmd.cmd' % i),
+                                     'sleep 0.5\n')
+        start = time.time()
+        sl.slurmpool.run_agent(pool.pooldir, 'agent_draining', idle_seconds=5.0,
+                               check_interval=0.05, time_limit=1.0, command_seconds=0.7)
+        # Exits after the first command, rather than start one it has no time for
+        self.assertLess(time.time() - start, 2.0)
+        self.assertIn('0_cmd.rc', os.listdir(os.path.join(pool.pooldir, 'results')))
+        self.assertEqual(os.listdir(os.path.join(pool.pooldir, 'queue')), ['1_cmd.cmd'])
+        self.assertEqual(os.listdir(os.path.join(pool.pooldir, 'agents')), [])
+
+    def test_parse_time_limit(self):
+        parse = sl.slurmpool.parse_time_limit
+        self.assertEqual([parse('30'), parse('1:00'), parse('2:00:00'), parse('1-2'),
+                          parse('1-0:30'), parse('bad')],
+                         [1800, 60, 7200, 93600, 88200, None])
@@ -0,0 +1,109 @@
+import json
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class TracedTask(sl.Task):
+    path = luigi.Parameter()
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        self.ex('true')
+        self.ex_many(['true', 'true'], max_concurrency=2)
+        with self.out_data().open('w') as outfile:
+            outfile.write('data')
+
+
+class TracedWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+    trace_execution = True
+
+    def workflow(self):
+        first = self.new_task('first', TracedTask, path=os.path.join(self.tmpdir, 'first.txt'))
+        second = self.new_task('second', TracedTask, path=os.path.join(self.tmpdir, 'second.txt'))
+        second.in_data = first.out_data
+        return second
+
+
+class UntracedWf(TracedWf):
+    trace_execution = False
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_workflow_writes_trace(self):
+        wf = TracedWf(instance_name='traced_wf', tmpdir=self.tmpdir)
+        w = luigi.worker.Worker()
+        w.add(wf)
+        w.run()
+        with open(wf.get_tracepath()) as tracefile:
+            events = json.load(tracefile)['traceEvents']
+        spans = [e for e in events if e['ph'] == 'X']
+        tasks = dict((e['name'], e) for e in spans if e['cat'] == 'task')
+        self.assertEqual(sorted(tasks), ['first', 'second'])
+        self.assertGreaterEqual(tasks['second']['ts'], tasks['first']['ts'] + tasks['first']['dur'])
+        self.assertEqual(tasks['first']['tid'], tasks['second']['tid'])
+        commands = [e for e in spans if e['cat'] == 'command']
+        self.assertEqual(len(commands), 6)
+        # Commands run concurrently by ex_many() go on tracks of their own
+        self.assertEqual(len(set(e['tid'] for e in commands)), 3)
+        # Only the task spans are kept in the readable audit report
+        with wf.output()['audit'].open() as auditfile:
+            report = auditfile.read()
+        self.assertIn('trace_start: ', report)
+        self.assertNotIn('trace_commands', report)
+        self.assertNotIn('trace_worker', report)
+        track_names = [e['args']['name'] for e in events if e['ph'] == 'M']
+        self.assertIn('worker 1', track_names)
+        self.assertEqual(tasks['first']['args']['process'], os.getpid())
+
+    def test_tasks_packed_onto_workers(self):
+        span = lambda name, start, end, pid: {'instance_name': name, 'task_family': 'T', 'info': {
+            'trace_start': start, 'trace_end': end, 'trace_worker': pid, 'trace_commands': []}}
+        # Forked one process per task (a, b, c), and two threads in one process (d, e)
+        records = [span('a', 0.0, 1.0, 11), span('b', 0.5, 2.0, 12), span('c', 1.5, 3.0, 13),
+                   span('d', 3.0, 4.0, 14), span('e', 3.0, 4.0, 14)]
+        events = sl.trace.build_trace(records)['traceEvents']
+        tids = dict((e['name'], e['tid']) for e in events if e.get('cat') == 'task')
+        self.assertEqual(tids['a'], tids['c'])
+        self.assertNotEqual(tids['a'], tids['b'])
+        self.assertNotEqual(tids['d'], tids['e'])
+        self.assertEqual(len(set(tids.values())), 2)
+
+    def test_not_traced_by_default(self):
+        wf = UntracedWf(instance_name='untraced_wf', tmpdir=self.tmpdir)
+        w = luigi.worker.Worker()
+        w.add(wf)
+        w.run()
+        self.assertTrue(wf.complete())
+        self.assertFalse(os.path.exists(wf.get_tracepath()))
+        records = wf.get_audit_backends()[0].read()
+        self.assertFalse(any('trace_commands' in record['info'] for record in records))
+
+    def test_slurm_queue_wait(self):
+        records = [{'instance_name': 'aligner', 'task_family': 'Aligner', 'info': {
+            'trace_start': 100.0, 'trace_end': 200.0, 'trace_worker': 1,
+            'trace_commands': [{'kind': 'ex_hpc', 'command': 'bwa', 'start': 110.0,
+                                'end': 190.0, 'thread': 'MainThread',
+                                'slurm_exectime_sec': 60, 'slurm_jobid': '42'}]}}]
+        events = sl.trace.build_trace(records)['traceEvents']
+        slurm = dict((e['name'], e) for e in events if e.get('cat') == 'slurm')
+        self.assertEqual((slurm['slurm queue wait']['ts'], slurm['slurm queue wait']['dur']),
+                         (10000000, 20000000))
+        self.assertEqual((slurm['slurm execution']['ts'], slurm['slurm execution']['dur']),
+                         (30000000, 60000000))
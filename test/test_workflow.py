@@ -0,0 +1,108 @@
+import gc
+import logging
+import luigi
+import sciluigi as sl
+import os
+import shutil
+import tempfile
+import unittest
+
+log = logging.getLogger('sciluigi-interface')
+log.setLevel(logging.WARNING)
+
+
+class RegistryTask(sl.Task):
+    path = luigi.Parameter()
+
+    def out_data(self):
+        return sl.TargetInfo(self, self.path)
+
+    def run(self):
+        with self.out_data().open('w') as outfile:
+            outfile.write('data')
+
+
+class RegistryWf(sl.WorkflowTask):
+    tmpdir = luigi.Parameter()
+
+    def workflow(self):
+        return self.new_task('writer', RegistryTask, path=os.path.join(self.tmpdir, 'out.txt'))
+
+
+class ReleasingRegistryWf(RegistryWf):
+    release_finished_tasks = True
+
+
+class WeakRegistryWf(RegistryWf):
+    weak_task_refs = True
+
+
+class DynamicRegistryWf(RegistryWf):
+    dynamic_workflow = True
+
+
+class TestTaskRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_registry_is_per_instance(self):
+        wf_a = RegistryWf(instance_name='registry_a', tmpdir=self.tmpdir)
+        wf_b = RegistryWf(instance_name='registry_b', tmpdir=self.tmpdir)
+        wf_a.new_task('only_in_a', RegistryTask, path='/tmp/only_in_a.txt')
+        self.assertIsNotNone(wf_a.get_task('only_in_a'))
+        self.assertIsNone(wf_b.get_task('only_in_a'))
+
+    def test_release_finished_tasks(self):
+        wf = RegistryWf(instance_name='registry_release', tmpdir=self.tmpdir)
+        writer = wf.get_workflow_output()
+        wf.new_task('unfinished', RegistryTask, path=os.path.join(self.tmpdir, 'nope.txt'))
+        writer.run()
+        wf.release_tasks()
+        self.assertEqual(sorted(wf.get_tasks()), ['unfinished'])
+        self.assertEqual(sorted(wf._tasknames), ['unfinished', 'writer'])
+        wf.release_tasks(finished_only=False)
+        self.assertEqual(wf.get_tasks(), {})
+        self.assertIsNone(wf._workflow_output)
+
+    def test_release_on_success(self):
+        wf = ReleasingRegistryWf(tmpdir=self.tmpdir)
+        w = luigi.worker.Worker()
+        w.add(wf)
+        w.run()
+        self.assertIsNone(wf.get_task('writer'))
+        with open(wf.output()['audit'].path) as auditfile:
+            self.assertIn('[writer]', auditfile.read())
+
+    def test_weak_task_refs(self):
+        wf = WeakRegistryWf(tmpdir=self.tmpdir)
+        luigi.task_register.Register.disable_instance_cache()
+        try:
+            wf.new_task('weak', RegistryTask, path=os.path.join(self.tmpdir, 'weak.txt'))
+            gc.collect()
+            self.assertIsNone(wf.get_task('weak'))
+            self.assertIn('weak', wf._tasknames)
+        finally:
+            luigi.task_register.Register.clear_instance_cache()
+
+
+class TestWorkflowGraphCache(unittest.TestCase):
+    def test_graph_is_built_once(self):
+        wf = RegistryWf(instance_name='counting_wf', tmpdir='/tmp')
+        first = wf.get_workflow_output()
+        second = wf.get_workflow_output()
+        self.assertIs(first, second)
+        self.assertEqual(wf.workflow_builds, 1)
+        self.assertEqual(wf.workflow_cache_hits, 1)
+        wf.clear_workflow_cache()
+        wf.get_workflow_output()
+        self.assertEqual(wf.workflow_builds, 2)
+
+    def test_dynamic_workflow_is_rebuilt(self):
+        wf = DynamicRegistryWf(instance_name='dynamic_counting_wf', tmpdir='/tmp')
+        wf.get_workflow_output()
+        wf.get_workflow_output()
+        self.assertEqual(wf.workflow_builds, 2)
+        self.assertEqual(wf.workflow_cache_hits, 0)